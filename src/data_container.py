@@ -1,10 +1,52 @@
 """Classes for data container."""
+import asyncio
+from itertools import count, islice
+import sys
 from time import time
-from uuid import uuid4
+from weakref import WeakSet
 
-from src.lockable import Lockable
+from src.eviction_index import EvictionIndex
+from src.id_generator import UUIDGenerator
+from src.lockable import ReadWriteLockable
 
-class DataContainer(Lockable):
+EVICTION_LRU = "lru"
+EVICTION_OLDEST = "oldest"
+EVICTION_LARGEST = "largest"
+
+def get_approximate_size(value):
+    """Get the approximate size in bytes of a value and of the items of the containers in it.
+
+    Arrays are counted by their nbytes, and values referred to several times only once. Other
+    objects are counted without the values their attributes refer to, which may be shared.
+    """
+    size = 0
+    seen_ids = set()
+    pending = [value]
+
+    while pending:
+        value = pending.pop()
+
+        if id(value) in seen_ids or isinstance(value, type):
+            continue
+
+        seen_ids.add(id(value))
+        nbytes = getattr(value, "nbytes", None)
+
+        if isinstance(nbytes, int):
+            size += max(sys.getsizeof(value), nbytes)
+            continue
+
+        size += sys.getsizeof(value)
+
+        if isinstance(value, dict):
+            pending.extend(value.keys())
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            pending.extend(value)
+
+    return size
+
+class DataContainer(ReadWriteLockable):
     """Base class for data container."""
 
     # pylint: disable = too-few-public-methods
@@ -19,6 +61,66 @@ class DataContainer(Lockable):
             """Clean up the entry data."""
             raise NotImplementedError()
 
+    class Listener:
+        """Listener notified after the entries of the data container change."""
+
+        def attach(self, data_container):
+            """Handle the entries of the data container as added and follow its changes."""
+
+            for entry in data_container.iter_entries():
+                self.entry_added(entry.entry_id, entry)
+
+            data_container.add_listener(self)
+
+        def detach(self, data_container):
+            """Stop following the changes of the data container."""
+            data_container.remove_listener(self)
+
+        def entry_added(self, entry_id, entry):
+            """Handle an added entry."""
+
+        def entry_updated(self, entry_id, old_entry, entry):
+            """Handle an updated entry."""
+
+        def entry_removed(self, entry_id, entry):
+            """Handle a removed entry."""
+
+        def entry_refreshed(self, entry_id, entry):
+            """Handle an entry whose update time has been set after it was added."""
+
+    class View:
+        """Live read-only view of the entries of a data container."""
+
+        def __init__(self, data_container):
+            self._data_container = data_container
+
+        def __len__(self):
+            return self._data_container.count()
+
+        def __iter__(self):
+            return self._data_container.iter_entries()
+
+        def __contains__(self, entry_id):
+            return self._data_container.has(entry_id)
+
+        def __getitem__(self, entry_id):
+            return self._data_container.get(entry_id)
+
+    def __init__(self, max_waiting_num = 8):
+        """Initialize data container instance."""
+        super().__init__(max_waiting_num)
+
+        self._listeners = []
+        self._indexes = {}
+
+    def add_listener(self, listener):
+        """Notify the listener about changes of the entries."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop notifying the listener."""
+        self._listeners.remove(listener)
+
     def add(self, entry, key = None):
         """Add data entry."""
         self._check_lock(key)
@@ -53,12 +155,75 @@ class DataContainer(Lockable):
         """Remove entry by id."""
         raise NotImplementedError()
 
+    def remove_many(self, entry_ids, key = None):
+        """Remove entries by id."""
+
+        for entry_id in entry_ids:
+            self.remove(entry_id, key)
+
     def get_all(self):
         """Get all data entry."""
         raise NotImplementedError()
 
+    def iter_entries(self, predicate = None, key = None):
+        """Iterate over the entries, or the ones predicate is true for, without copying them."""
+        self._check_read_lock(key)
+
+        entries = iter(self.get_all())
+
+        return entries if predicate is None else filter(predicate, entries)
+
+    def count(self, predicate = None, key = None):
+        """Count the entries, or the ones predicate is true for."""
+        return sum(1 for _ in self.iter_entries(predicate, key))
+
+    def page(self, offset, limit, predicate = None, key = None):
+        """Get up to limit entries after skipping offset ones, in iteration order."""
+        return list(islice(self.iter_entries(predicate, key), offset, offset + limit))
+
+    def view(self):
+        """Get a live read-only view of the entries."""
+        return DataContainer.View(self)
+
+    def add_index(self, name, index):
+        """Add a secondary index, such as a HashIndex or a SortedIndex, kept up to date."""
+
+        if name in self._indexes:
+            raise RuntimeError("Index already existing.")
+
+        index.attach(self)
+        self._indexes[name] = index
+
+    def remove_index(self, name):
+        """Remove a secondary index."""
+        self._indexes.pop(name).detach(self)
+
+    def find(self, index_name, *args, key = None, **kwargs):
+        """Get the entries matching a query of a secondary index."""
+        index = self._indexes.get(index_name)
+
+        if index is None:
+            raise RuntimeError("Index not existing.")
+
+        return [self.get(entry_id, key) for entry_id in index.query(*args, **kwargs)]
+
 class DataContainerWithMaxSize(DataContainer):
-    """Base class for data containers with max size."""
+    """Base class for data containers with max size.
+
+    A max_size of None leaves the number of entries unbounded. With max_bytes, the approximate
+    size of the entries is also kept under a byte budget. Once a limit is exceeded, entries are
+    evicted by the eviction policy: the least recently updated ones by default, the least recently
+    used ones with EVICTION_LRU, or the largest ones with EVICTION_LARGEST. The entry just added
+    or updated is never evicted for it. Entry sizes are only computed, and total_bytes only
+    tracked, with max_bytes or EVICTION_LARGEST.
+
+    Entries can also expire once their ttl, or the ttl of the container if they have none, has
+    passed since they were updated. Expiry times are kept in a heap, and a timer on the running
+    event loop removes the entries due together through remove_many. Without a running loop,
+    expired entries are removed by expire, or when the max size is exceeded.
+    """
+
+    # pylint: disable = too-many-instance-attributes
 
     class Entry(DataContainer.Entry):
         """Entry type for the data container with max size."""
@@ -67,6 +232,7 @@ class DataContainerWithMaxSize(DataContainer):
             super().__init__(entry_type)
 
             self.updated_at = None
+            self.ttl = None
 
         def refresh(self):
             """Set new update time."""
@@ -76,10 +242,36 @@ class DataContainerWithMaxSize(DataContainer):
             """Clean up the entry data."""
             raise NotImplementedError()
 
-    def __init__(self, max_size = 8, max_waiting_num = 8):
+        def get_size(self):
+            """Get the approximate size of the entry and of its attributes in bytes.
+
+            Entries referring to large objects the approximation misses should override it.
+            """
+            return sys.getsizeof(self) + get_approximate_size(vars(self))
+
+    # Time to wait before trying to expire entries again while the container is locked.
+    _expiry_retry_delay = 1
+
+    # pylint: disable = too-many-arguments
+    def __init__(self, max_size = 8, max_waiting_num = 8, ttl = None, max_bytes = None,
+            eviction_policy = EVICTION_OLDEST):
         super().__init__(max_waiting_num)
 
+        if eviction_policy not in (EVICTION_LRU, EVICTION_OLDEST, EVICTION_LARGEST):
+            raise ValueError("Unknown eviction policy: " + str(eviction_policy))
+
         self._max_size = max_size
+        self._max_bytes = max_bytes
+        self._eviction_policy = eviction_policy
+        self._ttl = ttl
+        self._sizes = {}
+        self._track_sizes = max_bytes is not None or eviction_policy == EVICTION_LARGEST
+        self._total_bytes = 0
+        self._use_counter = count()
+        self._eviction_index = EvictionIndex()
+        self._expiry_index = EvictionIndex()
+        self._expiry_timer = None
+        self._expiry_timer_at = None
 
     def add(self, entry, key = None):
         """Add data entry."""
@@ -90,17 +282,54 @@ class DataContainerWithMaxSize(DataContainer):
 
         self._check_id(entry)
         entry.refresh()
-        self._check_max_size()
+        self._index_entry(entry.entry_id, entry)
+
+        for listener in self._listeners:
+            listener.entry_refreshed(entry.entry_id, entry)
+
+        self._check_max_size(entry.entry_id, key)
 
         return entry.entry_id
 
+    @property
+    def total_bytes(self):
+        """Approximate total size of the entries in bytes, 0 when sizes are not tracked."""
+        return self._total_bytes
+
     def get_all(self):
         """Get all data entry."""
         raise NotImplementedError()
 
-    def get_all_sorted(self):
+    def get_all_sorted(self, key = None):
         """Get all data entry sorted."""
-        return sorted(self.get_all(), key = self._get_sort_key)
+        return sorted(self.iter_entries(key = key), key = self._get_sort_key)
+
+    def expire(self, now = None, key = None):
+        """Remove the entries expired by now, the current time by default, and get their ids."""
+        self._check_lock(key)
+
+        now = time() if now is None else now
+        expiry_times = {}
+
+        while len(self._expiry_index) > 0:
+            expires_at = self._expiry_index.get_sort_key(self._expiry_index.peek())
+
+            if expires_at > now:
+                break
+
+            expiry_times[self._expiry_index.pop()] = expires_at
+
+        try:
+            self.remove_many(list(expiry_times), key)
+        except Exception:
+            # Keep expiring the entries which could not be removed.
+            for entry_id, expires_at in expiry_times.items():
+                if entry_id in self._eviction_index:
+                    self._expiry_index.push(entry_id, expires_at)
+
+            raise
+
+        return list(expiry_times)
 
     def _check_id(self, entry):
         """Add id to the entry if not exists."""
@@ -114,20 +343,150 @@ class DataContainerWithMaxSize(DataContainer):
         """Get the key to sort entry."""
         raise NotImplementedError()
 
-    def _check_max_size(self):
-        """Remove item when exceed the max size."""
-        entries = self.get_all()
+    def _get_eviction_key(self, entry, size):
+        """Get the key to pick the entries to evict first by the eviction policy."""
+
+        if self._eviction_policy == EVICTION_LRU:
+            return next(self._use_counter)
+
+        if self._eviction_policy == EVICTION_LARGEST:
+            return -size
+
+        return self._get_sort_key(entry)
+
+    def _index_entry(self, entry_id, entry):
+        """Put the entry into the eviction and expiry indexes, or move it to its new keys."""
+        size = entry.get_size() if self._track_sizes else 0
+
+        self._total_bytes += size - self._sizes.get(entry_id, 0)
+        self._sizes[entry_id] = size
+        self._eviction_index.push(entry_id, self._get_eviction_key(entry, size))
+
+        expires_at = self._get_expiry_time(entry)
+
+        if expires_at is None:
+            self._expiry_index.discard(entry_id)
+        else:
+            self._expiry_index.push(entry_id, expires_at)
+            self._schedule_expiry()
 
-        if len(entries) > self._max_size:
-            self.remove(self.get_all_sorted()[0].entry_id)
+    def _unindex_entry(self, entry_id):
+        """Drop the entry from the eviction and expiry indexes."""
+        self._total_bytes -= self._sizes.pop(entry_id, 0)
+        self._eviction_index.discard(entry_id)
+        self._expiry_index.discard(entry_id)
+
+    def _touch(self, entry_id):
+        """Mark the entry as used for the least recently used policy."""
+
+        if self._eviction_policy == EVICTION_LRU and entry_id in self._eviction_index:
+            self._eviction_index.push(entry_id, next(self._use_counter))
+
+    def _get_expiry_time(self, entry):
+        ttl = getattr(entry, "ttl", None)
+
+        if ttl is None:
+            ttl = self._ttl
+
+        if ttl is None or entry.updated_at is None:
+            return None
+
+        return entry.updated_at + ttl
+
+    def _schedule_expiry(self, delay = None):
+        """Set the timer for the earliest expiry time, if there is a running event loop."""
+
+        if len(self._expiry_index) == 0:
+            return
+
+        expires_at = self._expiry_index.get_sort_key(self._expiry_index.peek())
+
+        if delay is not None:
+            expires_at = max(expires_at, time() + delay)
+
+        if self._expiry_timer is not None:
+            if self._expiry_timer_at <= expires_at:
+                return
+
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        self._expiry_timer = loop.call_later(max(expires_at - time(), 0), self._on_expiry_timer)
+        self._expiry_timer_at = expires_at
+
+    def _on_expiry_timer(self):
+        self._expiry_timer = None
+        # Try again later if the entries could not be removed, for example while locked.
+        delay = self._expiry_retry_delay
+
+        try:
+            self.expire()
+            delay = None
+        except RuntimeError:
+            pass
+        finally:
+            self._schedule_expiry(delay)
+
+    def _is_over_limits(self):
+        if self._max_size is not None and len(self._sizes) > self._max_size:
+            return True
+
+        return self._max_bytes is not None and self._total_bytes > self._max_bytes
+
+    def _check_max_size(self, kept_id = None, key = None):
+        """Remove items while exceeding the max size or the byte budget, except kept_id."""
+
+        if not self._is_over_limits():
+            return
+
+        self.expire(key = key)
+
+        kept_key = None
+
+        if kept_id in self._eviction_index:
+            kept_key = self._eviction_index.get_sort_key(kept_id)
+            self._eviction_index.discard(kept_id)
+
+        try:
+            while len(self._eviction_index) > 0 and self._is_over_limits():
+                self.remove(self._eviction_index.peek(), key)
+        finally:
+            if kept_key is not None and kept_id in self._sizes:
+                self._eviction_index.push(kept_id, kept_key)
 
 class DictDataContainer(DataContainer):
-    """Data container that have the data as a dict in the memory."""
+    """Data container that have the data as a dict in the memory.
 
-    def __init__(self, max_waiting_num = 8):
+    Ids of entries added without one come from id_generator, UUID4 ids by default.
+    """
+
+    class IdIterator:
+        """Iterator over the ids of a dict, copying the remaining ids only when detached."""
+
+        def __init__(self, data):
+            self._entry_ids = iter(data)
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            return next(self._entry_ids)
+
+        def detach(self):
+            """Copy the remaining ids, so the dict can change without breaking the iteration."""
+            self._entry_ids = iter(list(self._entry_ids))
+
+    def __init__(self, max_waiting_num = 8, id_generator = None):
         super().__init__(max_waiting_num)
 
         self._data = {}
+        self._id_generator = id_generator or UUIDGenerator()
+        self._id_iterators = WeakSet()
 
     def add(self, entry, key = None):
         super().add(entry, key)
@@ -136,8 +495,12 @@ class DictDataContainer(DataContainer):
             raise RuntimeError("Id already existing.")
 
         self._check_id(entry)
+        self._detach_id_iterators()
         self._data[entry.entry_id] = entry
 
+        for listener in self._listeners:
+            listener.entry_added(entry.entry_id, entry)
+
         return entry.entry_id
 
     def update(self, entry_id, entry, key = None):
@@ -146,10 +509,14 @@ class DictDataContainer(DataContainer):
         if not entry_id in self._data:
             raise RuntimeError("Id not existing.")
 
+        old_entry = self._data[entry_id]
         self._data[entry_id] = entry
 
+        for listener in self._listeners:
+            listener.entry_updated(entry_id, old_entry, entry)
+
     def has(self, entry_id, key=None):
-        self._check_lock(key)
+        self._check_read_lock(key)
 
         if entry_id in self._data:
             return True
@@ -157,7 +524,7 @@ class DictDataContainer(DataContainer):
         return False
 
     def get(self, entry_id, key = None):
-        self._check_lock(key)
+        self._check_read_lock(key)
 
         if not entry_id in self._data:
             raise RuntimeError("Id not existing.")
@@ -166,13 +533,57 @@ class DictDataContainer(DataContainer):
 
     def remove(self, entry_id, key = None):
         self._check_lock(key)
-        self._data[entry_id].destroy()
 
+        entry = self._data[entry_id]
+        entry.destroy()
+
+        self._detach_id_iterators()
         del self._data[entry_id]
 
+        for listener in self._listeners:
+            listener.entry_removed(entry_id, entry)
+
     def get_all(self):
         return list(self._data.values())
 
+    def iter_entries(self, predicate = None, key = None):
+        self._check_read_lock(key)
+
+        # The ids are only copied if entries are added or removed before the iteration ends.
+        entry_ids = DictDataContainer.IdIterator(self._data)
+        self._id_iterators.add(entry_ids)
+        entries = self._iter_entries_by_ids(entry_ids)
+
+        return entries if predicate is None else filter(predicate, entries)
+
+    def count(self, predicate = None, key = None):
+        if predicate is None:
+            self._check_read_lock(key)
+
+            return len(self._data)
+
+        return super().count(predicate, key)
+
+    def page(self, offset, limit, predicate = None, key = None):
+        if predicate is not None:
+            return super().page(offset, limit, predicate, key)
+
+        self._check_read_lock(key)
+
+        return list(self._iter_entries_by_ids(list(islice(self._data, offset, offset + limit))))
+
+    def _iter_entries_by_ids(self, entry_ids):
+        """Iterate over the entries of the ids still existing."""
+        return (self._data[entry_id] for entry_id in entry_ids if entry_id in self._data)
+
+    def _detach_id_iterators(self):
+        """Let the ongoing iterations copy their remaining ids before ids are added or removed."""
+
+        for id_iterator in list(self._id_iterators):
+            id_iterator.detach()
+
+        self._id_iterators.clear()
+
     def _check_id(self, entry):
         """Add id to the entry if not exists."""
 
@@ -181,33 +592,19 @@ class DictDataContainer(DataContainer):
 
     def _generate_id(self, entry):
         """Generate entry id."""
-        entry_id = entry.entry_id
-
-        if entry_id and entry_id not in self._data:
-            return entry_id
-
-        if entry_id in self._data and entry == self._data[entry_id]:
-            return entry_id
-
-        while True:
-            entry_id = str(uuid4())
-            duplicated = False
-
-            for exsisting_entry in self.get_all():
-                if exsisting_entry.entry_id == entry_id:
-                    duplicated = True
-
-            if not duplicated:
-                return entry_id
+        return self._id_generator.generate(entry, lambda entry_id: entry_id in self._data)
 
 class DictDataContainerWithMaxSize(DictDataContainer, DataContainerWithMaxSize):
     """Data container that have the data as a dict in the memory."""
 
-    def __init__(self, max_size = 8, max_waiting_num = 8):
+    # pylint: disable = too-many-arguments
+    def __init__(self, max_size = 8, max_waiting_num = 8, id_generator = None, ttl = None,
+            max_bytes = None, eviction_policy = EVICTION_OLDEST):
         """Initialize data container instance."""
 
-        DictDataContainer.__init__(self, max_waiting_num)
-        DataContainerWithMaxSize.__init__(self, max_size, max_waiting_num)
+        DictDataContainer.__init__(self, max_waiting_num, id_generator)
+        DataContainerWithMaxSize.__init__(self, max_size, max_waiting_num, ttl, max_bytes,
+            eviction_policy)
 
     def add(self, entry, key = None):
         """Add data entry."""
@@ -217,6 +614,28 @@ class DictDataContainerWithMaxSize(DictDataContainer, DataContainerWithMaxSize):
 
         return entry_id
 
+    def update(self, entry_id, entry, key = None):
+        DictDataContainer.update(self, entry_id, entry, key)
+
+        self._index_entry(entry_id, entry)
+        self._check_max_size(entry_id, key)
+
+    def get(self, entry_id, key = None):
+        entry = DictDataContainer.get(self, entry_id, key)
+
+        self._touch(entry_id)
+
+        return entry
+
+    def remove(self, entry_id, key = None):
+        DictDataContainer.remove(self, entry_id, key)
+
+        self._unindex_entry(entry_id)
+
     def _get_sort_key(self, entry):
         """Get the key to sort entry."""
+
+        if entry.updated_at is None:
+            return 0
+
         return entry.updated_at
@@ -1,77 +1,470 @@
 """Components for data persistence."""
-import threading
 from pathlib import Path
+from threading import Lock
+import asyncio
 import json
 
 from singleton_decorator import singleton
 
-from src.data_container import DictDataContainerWithMaxSize
+from src.data_container import EVICTION_OLDEST, DataContainerWithMaxSize, \
+    DictDataContainerWithMaxSize
+from src.json_compatible import to_json_default
+from src.snapshot import FSYNC_INTERVAL, FsyncPolicy, SnapshotFile
+from src.write_behind import WriteBehind
 
-@singleton
-class LocalJSONFileDictDataPersistence(DictDataContainerWithMaxSize):
-    """Data persistence by storing data as a dict in local JSON file."""
+class LazyEntry(DataContainerWithMaxSize.Entry):
+    """Placeholder of a persisted entry not created from its JSON object yet."""
 
-    def __init__(self, max_size = 8, max_waiting_num = 8, path = '.cache', file_name = 'data.json'):
-        super().__init__(max_size, max_waiting_num)
+    def __init__(self, entry_id, entry_class, json_object):
+        super().__init__(json_object.get("_type"))
 
-        self._data_path = path
-        self._file_name = file_name
+        self.entry_id = entry_id
+        self.updated_at = json_object.get("updated_at")
+        self.ttl = json_object.get("ttl")
+        self._entry_class = entry_class
+        self._json_object = json_object
 
-        json_data = None
+    def hydrate(self):
+        """Create the actual entry."""
+        return self._entry_class.from_json(self._json_object)
 
-        try:
-            with (Path(self._data_path) / self._file_name).open() as file:
-                json_data = json.load(file)
-
-                for entry_id, json_object in json_data.items():
-                    if json_object["_type"] == "person":
-                        # pylint: disable = cyclic-import
-                        # pylint: disable = import-outside-toplevel
-                        from src.person import Person
-                        self._data[entry_id] = Person.from_json(json_object)
-        except (PermissionError, FileNotFoundError, json.decoder.JSONDecodeError):
-            pass
+    def to_json(self):
+        """Convert the entry to json object."""
+        return self._json_object
+
+    def destroy(self):
+        """Clean up the entry data."""
+        self.hydrate().destroy()
+
+class LocalFileDictDataPersistence(DictDataContainerWithMaxSize):
+    """Base class for data persistence storing data as a dict in local files.
+
+    With lazy_load, entries read from the files stay as LazyEntry placeholders holding their
+    JSON object until get or get_all touches them, or warm_up creates them in the background.
+
+    With an encoding_store, the face encodings of the entries are kept in its binary file and
+    snapshots only refer to their rows.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, max_size = 8, max_waiting_num = 8, path = '.cache',
+            write_debounce = .05, write_max_staleness = 1, fsync_policy = FSYNC_INTERVAL,
+            fsync_interval = 5, lazy_load = False, encoding_store = None, id_generator = None,
+            ttl = None, max_bytes = None, eviction_policy = EVICTION_OLDEST):
+        super().__init__(max_size, max_waiting_num, id_generator, ttl, max_bytes, eviction_policy)
+
+        self._data_path = path
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval
+        self._lazy_load = lazy_load
+        self._unhydrated_ids = set()
+        self._encoding_store = encoding_store
+        self._encoding_rows = {}
+        self._snapshot_file = None
+        self._writer = WriteBehind(self._write_files, write_debounce, write_max_staleness)
 
     def add(self, entry, key = None):
         """Add data entry."""
 
         entry_id = super().add(entry, key)
 
-        self._export_to_json_file()
+        self._on_entry_changed(entry_id)
 
         return entry_id
 
     def update(self, entry_id, entry, key = None):
         super().update(entry_id, entry, key)
 
-        self._export_to_json_file()
+        self._unhydrated_ids.discard(entry_id)
+        self._on_entry_changed(entry_id)
+
+    def get(self, entry_id, key = None):
+        entry = super().get(entry_id, key)
+
+        if entry_id in self._unhydrated_ids:
+            entry = self._hydrate(entry_id)
+
+        return entry
 
     def remove(self, entry_id, key = None):
         """Remove entries by id."""
-        super().remove(entry_id, key)
+        self._remove_entry(entry_id, key)
+        self._on_entry_removed(entry_id)
 
-        self._export_to_json_file()
+    def remove_many(self, entry_ids, key = None):
+        """Remove entries by id, persisting the removals together."""
+        removed_ids = []
+
+        try:
+            for entry_id in entry_ids:
+                self._remove_entry(entry_id, key)
+                removed_ids.append(entry_id)
+        finally:
+            if removed_ids:
+                self._on_entries_removed(removed_ids)
+
+    def get_all(self):
+        for entry_id in list(self._unhydrated_ids):
+            self._hydrate(entry_id)
+
+        return super().get_all()
+
+    async def warm_up(self, batch_size = 32):
+        """Create the lazily loaded entries in batches, yielding to the event loop in between."""
+
+        while self._unhydrated_ids:
+            for entry_id in list(self._unhydrated_ids)[:batch_size]:
+                self._hydrate(entry_id)
+
+            await asyncio.sleep(0)
+
+    @property
+    def write_stats(self):
+        """Counters of requested, coalesced and performed file writes."""
+        return self._writer.stats
+
+    @property
+    def generation(self):
+        """Generation number of the current snapshot file."""
+        return self._snapshot_file.generation
 
     def flush(self):
         """Save data in memory."""
+        self._writer.flush()
+
+    async def async_flush(self):
+        """Save data in memory without blocking the event loop."""
+        await self._writer.async_flush()
+
+    def _on_entry_changed(self, entry_id):
+        """Persist an added or updated entry."""
+        raise NotImplementedError()
+
+    def _on_entry_removed(self, entry_id):
+        """Persist a removed entry."""
+        raise NotImplementedError()
+
+    def _on_entries_removed(self, entry_ids):
+        """Persist removed entries."""
+
+        for entry_id in entry_ids:
+            self._on_entry_removed(entry_id)
+
+    def _iter_entries_by_ids(self, entry_ids):
+        return (self._hydrate(entry_id) if entry_id in self._unhydrated_ids
+            else self._data[entry_id] for entry_id in entry_ids if entry_id in self._data)
+
+    def _remove_entry(self, entry_id, key):
+        if entry_id in self._unhydrated_ids:
+            # The actual entry may hold resources destroy has to clean up.
+            self._hydrate(entry_id)
+
+        super().remove(entry_id, key)
+
+    def _write_files(self):
+        """Write pending changes to the files, called from the writer thread."""
+        raise NotImplementedError()
+
+    # pylint: disable = no-self-use
+    def _get_entry_class(self, json_object):
+        """Get the class to create the entry from json object, or None if the type is unknown."""
+
+        if json_object["_type"] == "person":
+            # pylint: disable = cyclic-import
+            # pylint: disable = import-outside-toplevel
+            from src.person import Person
+
+            return Person
+
+        return None
+
+    def _load_entry(self, entry_id, json_object):
+        """Put an entry read from a file into the memory."""
+        entry_class = self._get_entry_class(json_object)
+
+        if entry_class is None:
+            return
+
+        if self._lazy_load:
+            entry = LazyEntry(entry_id, entry_class, json_object)
+            self._unhydrated_ids.add(entry_id)
+        else:
+            entry = entry_class.from_json(json_object)
+            self._unhydrated_ids.discard(entry_id)
+
+        if entry_id not in self._data:
+            self._detach_id_iterators()
+
+        self._data[entry_id] = entry
+        self._index_entry(entry_id, entry)
+
+    def _unload_entry(self, entry_id):
+        """Drop an entry read from a file from the memory."""
+        self._detach_id_iterators()
+        self._data.pop(entry_id, None)
+        self._unhydrated_ids.discard(entry_id)
+        self._unindex_entry(entry_id)
+
+    def _hydrate(self, entry_id):
+        """Replace the placeholder of a lazily loaded entry with the actual entry."""
+        entry = self._data[entry_id].hydrate()
+
+        self._data[entry_id] = entry
+        self._unhydrated_ids.discard(entry_id)
+        self._index_entry(entry_id, entry)
+
+        return entry
+
+    def _create_snapshot_file(self, file_name):
+        return SnapshotFile(self._data_path, file_name, self._fsync_policy, self._fsync_interval)
+
+    def _load_snapshot_file(self, snapshot_file):
+        """Load the entries of the newest readable snapshot."""
+        json_data = snapshot_file.load() or {}
+
+        if self._encoding_store is not None:
+            self._load_encodings(json_data, snapshot_file.load_fallbacks())
+
+        for entry_id, json_object in json_data.items():
+            self._load_entry(entry_id, json_object)
+
+    def _save_snapshot_file(self, snapshot_file, data, force_sync = False):
+        """Write the entries as a new snapshot generation."""
+        json_data = {}
+
+        for entry_id, entry in data.items():
+            json_data[entry_id] = entry.to_json()
+
+        if self._encoding_store is not None:
+            self._save_encodings(json_data)
+
+        snapshot_file.save(json_data, force_sync)
+
+    def _load_encodings(self, json_data, fallback_json_data = ()):
+        """Replace the row references in the JSON objects with the encodings they refer to.
+
+        Rows referred to by the fallback snapshots stay used too, so falling back to one of them
+        later does not read recycled rows.
+        """
+        field = self._encoding_store.field
+        self._encoding_rows = {}
+        used_rows = set()
+
+        for entry_id, json_object in json_data.items():
+            if isinstance(json_object, dict) and isinstance(json_object.get(field), dict):
+                self._encoding_rows[entry_id] = json_object[field]["rows"]
+                used_rows.update(json_object[field]["rows"])
+
+        for fallback in fallback_json_data:
+            for json_object in fallback.values():
+                if isinstance(json_object, dict) and isinstance(json_object.get(field), dict):
+                    used_rows.update(json_object[field]["rows"])
+
+        self._encoding_store.open(used_rows)
+
+        for entry_id, rows in self._encoding_rows.items():
+            json_data[entry_id][field] = self._encoding_store.get(rows)
+
+    def _save_encodings(self, json_data):
+        """Move the encodings in the JSON objects to the encoding store, leaving row references."""
+        field = self._encoding_store.field
+
+        for entry_id, json_object in json_data.items():
+            if not isinstance(json_object, dict) or json_object.get(field) is None:
+                continue
+
+            encodings = self._encoding_store.to_matrix(json_object[field])
+
+            if encodings is None:
+                continue
+
+            rows = self._encoding_rows.get(entry_id)
+
+            if rows is None or not self._encoding_store.equals(rows, encodings):
+                if rows is not None:
+                    self._encoding_store.release(rows)
+
+                rows = self._encoding_store.put(encodings)
+                self._encoding_rows[entry_id] = rows
+
+            json_data[entry_id] = dict(json_object)
+            json_data[entry_id][field] = {"rows": rows}
+
+        for entry_id in set(self._encoding_rows) - set(json_data):
+            self._encoding_store.release(self._encoding_rows.pop(entry_id))
+
+        self._encoding_store.flush()
+
+    def _prepare_data_path(self):
+        path = Path(self._data_path)
+
+        if not path.exists():
+            try:
+                path.mkdir()
+            except FileExistsError:
+                pass
+
+        return path
+
+class JSONFileDictDataPersistence(LocalFileDictDataPersistence): # pylint: disable = too-many-ancestors
+    """Data persistence by storing data as a dict in local JSON file.
+
+    Unlike LocalJSONFileDictDataPersistence, every call creates an instance, for example one per
+    shard of a sharded data container.
+    """
+
+    # pylint: disable = too-many-arguments
+    def __init__(self, max_size = 8, max_waiting_num = 8, path = '.cache', file_name = 'data.json',
+            write_debounce = .05, write_max_staleness = 1, fsync_policy = FSYNC_INTERVAL,
+            fsync_interval = 5, lazy_load = False, encoding_store = None, id_generator = None,
+            ttl = None, max_bytes = None, eviction_policy = EVICTION_OLDEST):
+        super().__init__(max_size, max_waiting_num, path, write_debounce, write_max_staleness,
+            fsync_policy, fsync_interval, lazy_load, encoding_store, id_generator, ttl, max_bytes,
+            eviction_policy)
+
+        self._file_name = file_name
+        self._snapshot_file = self._create_snapshot_file(file_name)
+
+        self._load_snapshot_file(self._snapshot_file)
+
+    def _on_entry_changed(self, entry_id):
+        self._export_to_json_file()
+
+    def _on_entry_removed(self, entry_id):
+        self._export_to_json_file()
+
+    def _on_entries_removed(self, entry_ids):
         self._export_to_json_file()
 
     def _export_to_json_file(self):
-        def save_file():
-            path = Path(self._data_path)
+        """Schedule a coalesced write of the data to the JSON file."""
+        self._writer.mark_dirty()
 
-            if not path.exists():
-                try:
-                    path.mkdir()
-                except FileExistsError:
-                    pass
+    def _write_files(self):
+        self._save_snapshot_file(self._snapshot_file, dict(self._data))
 
-            json_data = {}
+@singleton
+class LocalJSONFileDictDataPersistence(JSONFileDictDataPersistence): # pylint: disable = too-many-ancestors
+    """Data persistence by storing data as a dict in local JSON file, shared as a singleton."""
 
-            for entry_id, entry in self._data.items():
-                json_data[entry_id] = entry.to_json()
+@singleton
+class LocalJournalFileDictDataPersistence(LocalFileDictDataPersistence): # pylint: disable = too-many-ancestors
+    """Data persistence by appending changes to a local journal file next to a JSON snapshot.
+
+    The journal is compacted into the snapshot once it grows over compact_size bytes or holds
+    more than compact_ratio records per entry in memory.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    # pylint: disable = too-many-locals
+    def __init__(self, max_size = 8, max_waiting_num = 8, path = '.cache', file_name = 'data.json',
+            journal_file_name = 'data.journal', compact_size = 1 << 20, compact_ratio = 4,
+            write_debounce = .05, write_max_staleness = 1, fsync_policy = FSYNC_INTERVAL,
+            fsync_interval = 5, lazy_load = False, encoding_store = None, id_generator = None,
+            ttl = None, max_bytes = None, eviction_policy = EVICTION_OLDEST):
+        super().__init__(max_size, max_waiting_num, path, write_debounce, write_max_staleness,
+            fsync_policy, fsync_interval, lazy_load, encoding_store, id_generator, ttl, max_bytes,
+            eviction_policy)
+
+        self._snapshot_file = self._create_snapshot_file(file_name)
+        self._journal_file_name = journal_file_name
+        self._journal_fsync_policy = FsyncPolicy(fsync_policy, fsync_interval)
+        self._compact_size = compact_size
+        self._compact_ratio = compact_ratio
+        self._pending_records = []
+        self._pending_records_lock = Lock()
+        self._journal_size = 0
+        self._journal_record_num = 0
+        self._compaction_num = 0
+
+        self._load_snapshot_file(self._snapshot_file)
+        self._replay_journal()
+
+        if self._should_compact():
+            self._writer.mark_dirty()
+
+    @property
+    def compaction_num(self):
+        """How many times the journal has been compacted."""
+        return self._compaction_num
+
+    def _on_entry_removed(self, entry_id):
+        self._append_records([{"op": "remove", "id": entry_id}])
 
-            with (path / self._file_name).open('w') as file:
-                json.dump(json_data, file)
+    def _on_entries_removed(self, entry_ids):
+        self._append_records([{"op": "remove", "id": entry_id} for entry_id in entry_ids])
+
+    def _on_entry_changed(self, entry_id):
+        self._append_records([{"op": "put", "id": entry_id,
+            "entry": self._data[entry_id].to_json()}])
+
+    def _append_records(self, records):
+        lines = [json.dumps(record, default = to_json_default) + "\n" for record in records]
+
+        with self._pending_records_lock:
+            self._pending_records.extend(lines)
+
+        self._writer.mark_dirty()
+
+    def _replay_journal(self):
+        """Apply the records of the journal file on top of the loaded snapshot."""
+
+        try:
+            with (Path(self._data_path) / self._journal_file_name).open() as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        # A crash in the middle of an append leaves a truncated last record.
+                        break
+
+                    if record["op"] == "put":
+                        self._load_entry(record["id"], record["entry"])
+                    elif record["op"] == "remove":
+                        self._unload_entry(record["id"])
+
+                    self._journal_size += len(line)
+                    self._journal_record_num += 1
+        except (PermissionError, FileNotFoundError):
+            pass
+
+    def _should_compact(self):
+        if self._journal_size >= self._compact_size:
+            return True
+
+        return self._journal_record_num > self._compact_ratio * max(len(self._data), 16)
+
+    def _write_files(self):
+        with self._pending_records_lock:
+            records, self._pending_records = self._pending_records, []
+
+        path = self._prepare_data_path()
+
+        if records:
+            with (path / self._journal_file_name).open('a') as file:
+                file.writelines(records)
+                self._journal_fsync_policy.sync(file)
+
+            self._journal_size += sum(len(record) for record in records)
+            self._journal_record_num += len(records)
+
+        if self._should_compact():
+            self._compact()
+
+    def _compact(self):
+        """Write the data in memory as the snapshot and start an empty journal.
+
+        Records still pending were already applied to the data in memory, replaying them on
+        top of the new snapshot later gives the same result. The snapshot is always synced
+        before the journal is truncated.
+        """
+        self._save_snapshot_file(self._snapshot_file, dict(self._data), True)
+
+        with (Path(self._data_path) / self._journal_file_name).open('w'):
+            pass
 
-        threading.Thread(target = save_file).start()
+        self._journal_size = 0
+        self._journal_record_num = 0
+        self._compaction_num += 1
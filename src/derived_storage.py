@@ -0,0 +1,209 @@
+"""Derived images, such as thumbnails, generated from the images of a storage."""
+import asyncio
+from io import BytesIO
+
+from PIL import Image
+
+from src.lru_cache import LRUCache
+from src.storage import Storage
+
+def save_image(picture, image_format, quality):
+    """Encode a picture as an image file content."""
+    if image_format == "JPEG" and picture.mode != "RGB":
+        picture = picture.convert("RGB")
+
+    file = BytesIO()
+    picture.save(file, image_format, quality = quality)
+
+    return file.getvalue()
+
+class Transform:
+    """Base class for transforms deriving an image from an original one."""
+
+    @property
+    def key(self):
+        """Name of the derived images, unique for the transform and its parameters."""
+        raise NotImplementedError()
+
+    def apply(self, image):
+        """Derive an image file content from an original one, run in an executor."""
+        raise NotImplementedError()
+
+class Resize(Transform):
+    """Downscale an image to fit in width x height, keeping its aspect ratio."""
+
+    def __init__(self, width, height, image_format = "JPEG", quality = 85):
+        self._width = width
+        self._height = height
+        self._image_format = image_format
+        self._quality = quality
+
+    @property
+    def key(self):
+        return "resize_" + str(self._width) + "x" + str(self._height) + "." \
+            + self._image_format.lower()
+
+    def apply(self, image):
+        with Image.open(BytesIO(image)) as picture:
+            # Let JPEG decoding scale down on the fly instead of decoding the full image.
+            picture.draft("RGB", (self._width, self._height))
+            picture.thumbnail((self._width, self._height))
+
+            return save_image(picture, self._image_format, self._quality)
+
+class Crop(Transform):
+    """Cut the (left, top, right, bottom) box out of an image."""
+
+    def __init__(self, box, image_format = "JPEG", quality = 85):
+        self._box = tuple(box)
+        self._image_format = image_format
+        self._quality = quality
+
+    @property
+    def key(self):
+        return "crop_" + "_".join(str(side) for side in self._box) + "." \
+            + self._image_format.lower()
+
+    def apply(self, image):
+        with Image.open(BytesIO(image)) as picture:
+            return save_image(picture.crop(self._box), self._image_format, self._quality)
+
+class DerivedStorage(Storage.Listener):
+    """Images derived from the images of a storage by named transforms.
+
+    Derived images are generated lazily in an executor, stored in the storage under derived_path
+    and kept in an LRU cache of at most cache_max_bytes. Putting or deleting an original image
+    drops its derived images, so they are generated again from the new one.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, storage, transforms, derived_path = "derived", cache_max_bytes = 4 << 20,
+            executor = None):
+        """Initialize derived storage instance."""
+
+        self._storage = storage
+        self._transforms = dict(transforms)
+        self._derived_path = derived_path
+        self._cache = LRUCache(cache_max_bytes)
+        self._executor = executor
+        self._generating = {}
+        self._invalidating = {}
+        self._versions = {}
+        self._generated_num = 0
+        self._loaded_num = 0
+
+        storage.add_listener(self)
+
+    @property
+    def stats(self):
+        """Numbers of generated derived images and of ones loaded from the storage."""
+        return {"generated": self._generated_num, "loaded": self._loaded_num}
+
+    @property
+    def cache_stats(self):
+        """Counters of the derived image cache."""
+        return self._cache.stats
+
+    def close(self):
+        """Stop following the changes of the storage."""
+        self._storage.remove_listener(self)
+
+    async def get(self, path, name, transform_name):
+        """Get the file content of an image derived by a named transform."""
+        transform = self._transforms.get(transform_name)
+
+        if transform is None:
+            raise RuntimeError("Transform not existing.")
+
+        key = (path, name, transform.key)
+        image = self._cache.get(key)
+
+        if image is not None:
+            return image
+
+        future = self._generating.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(self._load_or_generate(path, name, transform))
+            future.add_done_callback(lambda future: self._on_generated(key, future))
+            self._generating[key] = future
+
+        return await asyncio.shield(future)
+
+    def file_put(self, path, name):
+        self._invalidate(path, name)
+
+    def file_deleted(self, path, name):
+        self._invalidate(path, name)
+
+    def _get_derived_location(self, path, name, transform):
+        return self._derived_path + "/" + path, name + "." + transform.key
+
+    async def _load_or_generate(self, path, name, transform):
+        original_key = (path, name)
+        invalidation = self._invalidating.get(original_key)
+
+        if invalidation is not None:
+            await invalidation
+
+        version = self._versions.get(original_key, 0)
+        derived_path, derived_name = self._get_derived_location(path, name, transform)
+
+        try:
+            image = await self._storage.get(derived_path, derived_name).read()
+            self._loaded_num += 1
+        except RuntimeError:
+            original = await self._storage.get(path, name).read()
+            image = await asyncio.get_event_loop().run_in_executor(self._executor,
+                transform.apply, original)
+            self._generated_num += 1
+
+            if self._versions.get(original_key, 0) != version:
+                return image
+
+            await self._storage.put(derived_path, derived_name, BytesIO(image), True)
+
+            if self._versions.get(original_key, 0) != version:
+                # The original changed while storing, do not leave a stale derived image behind.
+                await self._storage.delete(derived_path, derived_name)
+
+                return image
+
+        if self._versions.get(original_key, 0) == version:
+            self._cache.put((path, name, transform.key), image)
+
+        return image
+
+    def _on_generated(self, key, future):
+        if self._generating.get(key) is future:
+            del self._generating[key]
+
+    def _invalidate(self, path, name):
+        """Drop the derived images of an original image."""
+
+        if path == self._derived_path or path.startswith(self._derived_path + "/"):
+            return
+
+        original_key = (path, name)
+        self._versions[original_key] = self._versions.get(original_key, 0) + 1
+
+        for transform in self._transforms.values():
+            self._cache.invalidate((path, name, transform.key))
+            self._generating.pop((path, name, transform.key), None)
+
+        task = asyncio.ensure_future(self._delete_derived(path, name,
+            self._invalidating.get(original_key)))
+        task.add_done_callback(lambda task: self._on_invalidated(original_key, task))
+        self._invalidating[original_key] = task
+
+    async def _delete_derived(self, path, name, previous_invalidation):
+        if previous_invalidation is not None:
+            await previous_invalidation
+
+        await asyncio.gather(*[self._storage.delete(*self._get_derived_location(path, name,
+            transform)) for transform in self._transforms.values()])
+
+    def _on_invalidated(self, original_key, task):
+        if self._invalidating.get(original_key) is task:
+            del self._invalidating[original_key]
@@ -0,0 +1,131 @@
+"""Binary storage of face encodings."""
+from pathlib import Path
+
+import numpy as np
+
+class EncodingStore:
+    """Face encodings kept as fixed-stride rows of a binary file, memory-mapped as a NumPy array.
+
+    Rows released while the store is open are not handed out again until it is reopened, so the
+    row views given to loaded entries never see their rows overwritten. Rows referred to by any
+    snapshot generation still on disk must be given as used_rows when opening, so falling back to
+    an older generation does not read recycled rows.
+    """
+
+    # pylint: disable = too-many-instance-attributes, too-many-arguments
+    def __init__(self, path = '.cache', file_name = 'encodings.bin', dimension = 128,
+            dtype = 'float32', field = 'encodings'):
+        """Initialize encoding store instance."""
+
+        self._path = Path(path)
+        self._file_name = file_name
+        self._dimension = dimension
+        self._dtype = np.dtype(dtype)
+        self._field = field
+        self._matrix = None
+        self._row_num = 0
+        self._free_rows = []
+        self._released_num = 0
+
+    @property
+    def field(self):
+        """Name of the field holding the encodings in the JSON object of an entry."""
+        return self._field
+
+    @property
+    def row_num(self):
+        """Number of rows in the file."""
+        return self._row_num
+
+    @property
+    def released_num(self):
+        """Number of rows released since the store was opened."""
+        return self._released_num
+
+    def open(self, used_rows = ()):
+        """Map the file, rows not in used_rows are free to be reused."""
+        file_path = self._path / self._file_name
+        row_size = self._dimension * self._dtype.itemsize
+
+        self._matrix = None
+        self._row_num = 0
+
+        if file_path.exists():
+            self._row_num = file_path.stat().st_size // row_size
+
+        if self._row_num > 0:
+            self._matrix = np.memmap(str(file_path), self._dtype, 'r+',
+                shape = (self._row_num, self._dimension))
+
+        self._free_rows = sorted(set(range(self._row_num)) - set(used_rows), reverse = True)
+        self._released_num = 0
+
+    def get(self, rows):
+        """Get the encodings of rows as views of the mapped file."""
+        return [self._matrix[row] for row in rows]
+
+    def equals(self, rows, encodings):
+        """Check if the rows hold the encodings."""
+
+        if len(rows) != len(encodings):
+            return False
+
+        return len(rows) == 0 or np.array_equal(self._matrix[rows], encodings)
+
+    def to_matrix(self, encodings):
+        """Convert encodings to a matrix of the store type, or None if the shape does not fit."""
+
+        try:
+            matrix = np.asarray(encodings, self._dtype)
+        except (TypeError, ValueError):
+            return None
+
+        if matrix.size == 0:
+            return matrix.reshape(0, self._dimension)
+
+        if matrix.ndim != 2 or matrix.shape[1] != self._dimension:
+            return None
+
+        return matrix
+
+    def put(self, encodings):
+        """Write the encodings to free rows and return the rows."""
+        missing_num = len(encodings) - len(self._free_rows)
+
+        if missing_num > 0:
+            self._grow(self._row_num + missing_num)
+
+        rows = [self._free_rows.pop() for _ in range(len(encodings))]
+
+        if rows:
+            self._matrix[rows] = encodings
+
+        return rows
+
+    def release(self, rows):
+        """Mark rows as not used anymore."""
+        self._released_num += len(rows)
+
+    def flush(self):
+        """Write the changes of the mapped file to the disk."""
+
+        if self._matrix is not None:
+            self._matrix.flush()
+
+    def _grow(self, min_row_num):
+        """Extend the file to at least min_row_num rows and map it again."""
+        row_num = max(min_row_num, self._row_num * 2, 64)
+        file_path = self._path / self._file_name
+
+        if not self._path.exists():
+            self._path.mkdir(parents = True, exist_ok = True)
+
+        self.flush()
+
+        with file_path.open('ab') as file:
+            file.truncate(row_num * self._dimension * self._dtype.itemsize)
+
+        self._matrix = np.memmap(str(file_path), self._dtype, 'r+',
+            shape = (row_num, self._dimension))
+        self._free_rows = list(range(row_num - 1, self._row_num - 1, -1)) + self._free_rows
+        self._row_num = row_num
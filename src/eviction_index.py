@@ -0,0 +1,74 @@
+"""Ordered index for picking the next entry to evict."""
+import heapq
+from itertools import count
+
+class EvictionIndex:
+    """Min-heap of entry ids by sort key, with lazy deletion of stale records."""
+
+    def __init__(self):
+        """Initialize eviction index instance."""
+        self._heap = []
+        self._records = {}
+        self._counter = count()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._records
+
+    def push(self, entry_id, sort_key):
+        """Add an entry id or move an existing one to the new sort key."""
+        record = [sort_key, next(self._counter), entry_id]
+
+        self._records[entry_id] = record
+        heapq.heappush(self._heap, record)
+        self._compact()
+
+    def discard(self, entry_id):
+        """Remove an entry id if it is indexed."""
+        self._records.pop(entry_id, None)
+        self._compact()
+
+    def get_sort_key(self, entry_id):
+        """Get the sort key of an indexed entry id."""
+        return self._records[entry_id][0]
+
+    def peek(self):
+        """Get the entry id with the lowest sort key without removing it."""
+        self._drop_stale()
+
+        if not self._heap:
+            return None
+
+        return self._heap[0][2]
+
+    def pop(self):
+        """Remove and return the entry id with the lowest sort key."""
+        self._drop_stale()
+
+        if not self._heap:
+            raise KeyError("Eviction index is empty.")
+
+        entry_id = heapq.heappop(self._heap)[2]
+        del self._records[entry_id]
+
+        return entry_id
+
+    def clear(self):
+        """Remove all entry ids."""
+        self._heap = []
+        self._records = {}
+
+    def _is_stale(self, record):
+        return self._records.get(record[2]) is not record
+
+    def _drop_stale(self):
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        """Rebuild the heap once stale records outnumber the live ones."""
+        if len(self._heap) > 2 * len(self._records) + 16:
+            self._heap = list(self._records.values())
+            heapq.heapify(self._heap)
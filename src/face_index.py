@@ -0,0 +1,376 @@
+"""Index for matching face encodings against the entries of a data container."""
+from time import perf_counter
+
+import numpy as np
+
+from src.data_container import DataContainer
+
+def get_encodings(entry):
+    """Get the face encodings of an entry."""
+    encodings = getattr(entry, "encodings", None)
+
+    if encodings is None:
+        return []
+
+    return encodings
+
+def get_nearest_centroids(encodings, centroids):
+    """Get the index of the nearest centroid for each row of the encodings."""
+    square_distances = (encodings ** 2).sum(axis = 1)[:, None] \
+        - 2 * encodings.dot(centroids.T) + (centroids ** 2).sum(axis = 1)[None, :]
+
+    return square_distances.argmin(axis = 1)
+
+class FaceIndex(DataContainer.Listener):
+    """Face encodings of data container entries kept in one contiguous matrix.
+
+    Removed rows become tombstones which are dropped by repacking the matrix once they make up
+    more than repack_ratio of the used rows, so single mutations never rebuild the matrix.
+    """
+
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, dimension = 128, encodings_getter = get_encodings, repack_ratio = .25,
+            dtype = 'float32'):
+        """Initialize face index instance."""
+
+        self._dimension = dimension
+        self._encodings_getter = encodings_getter
+        self._repack_ratio = repack_ratio
+        self._dtype = np.dtype(dtype)
+        self._matrix = np.empty((0, dimension), self._dtype)
+        self._square_norms = np.empty(0, self._dtype)
+        self._alive = np.empty(0, bool)
+        self._row_ids = []
+        self._rows = {}
+        self._row_num = 0
+        self._tombstone_num = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._rows
+
+    @property
+    def encoding_num(self):
+        """Number of indexed encodings."""
+        return self._row_num - self._tombstone_num
+
+    @property
+    def tombstone_num(self):
+        """Number of removed rows not repacked yet."""
+        return self._tombstone_num
+
+    def entry_added(self, entry_id, entry):
+        self.add(entry_id, self._encodings_getter(entry))
+
+    def entry_updated(self, entry_id, old_entry, entry):
+        self.remove(entry_id)
+        self.add(entry_id, self._encodings_getter(entry))
+
+    def entry_removed(self, entry_id, entry):
+        self.remove(entry_id)
+
+    def add(self, entry_id, encodings):
+        """Add the encodings of an entry, replacing the ones already indexed."""
+        self.remove(entry_id)
+
+        encodings = np.asarray(encodings, self._dtype).reshape(-1, self._dimension)
+
+        if len(encodings) == 0:
+            return
+
+        self._reserve(self._row_num + len(encodings))
+
+        rows = range(self._row_num, self._row_num + len(encodings))
+
+        self._matrix[rows.start:rows.stop] = encodings
+        self._square_norms[rows.start:rows.stop] = np.einsum('ij,ij->i', encodings, encodings)
+        self._alive[rows.start:rows.stop] = True
+        self._row_ids[rows.start:rows.stop] = [entry_id] * len(encodings)
+        self._rows[entry_id] = list(rows)
+        self._row_num = rows.stop
+
+    def remove(self, entry_id):
+        """Remove the encodings of an entry."""
+        rows = self._rows.pop(entry_id, None)
+
+        if rows is None:
+            return
+
+        self._alive[rows] = False
+        self._tombstone_num += len(rows)
+
+        if self._tombstone_num > self._repack_ratio * self._row_num:
+            self.repack()
+
+    def clear(self):
+        """Remove all encodings."""
+        self._alive[:] = False
+        self._rows = {}
+        self._row_ids = []
+        self._row_num = 0
+        self._tombstone_num = 0
+
+    def repack(self):
+        """Move the live rows to the front of the matrix, dropping tombstones."""
+        live_rows = np.flatnonzero(self._alive[:self._row_num])
+        row_num = len(live_rows)
+
+        self._matrix[:row_num] = self._matrix[live_rows]
+        self._square_norms[:row_num] = self._square_norms[live_rows]
+        self._alive[:row_num] = True
+        self._alive[row_num:] = False
+        self._row_ids = [self._row_ids[row] for row in live_rows]
+        self._rows = {}
+
+        for row, entry_id in enumerate(self._row_ids):
+            self._rows.setdefault(entry_id, []).append(row)
+
+        self._row_num = row_num
+        self._tombstone_num = 0
+
+    def distances(self, encoding):
+        """Get the euclidean distance of the encoding to every row, tombstones being infinite."""
+        encoding = np.asarray(encoding, self._dtype).reshape(self._dimension)
+        matrix = self._matrix[:self._row_num]
+
+        square_distances = self._square_norms[:self._row_num] - 2 * matrix.dot(encoding) \
+            + encoding.dot(encoding)
+        distances = np.sqrt(np.maximum(square_distances, 0))
+        distances[~self._alive[:self._row_num]] = np.inf
+
+        return distances
+
+    def query(self, encoding, k = 1, threshold = None):
+        """Get up to k (entry id, distance) pairs nearest to the encoding, nearest first.
+
+        Each entry appears once with the distance of its nearest encoding, entries farther than
+        threshold are left out.
+        """
+        return self._rank(self.distances(encoding), range(self._row_num), k, threshold)
+
+    def _rank(self, distances, rows, k, threshold):
+        """Pick the nearest distinct entries from the distances of the rows."""
+
+        if threshold is not None:
+            selected = np.flatnonzero(distances <= threshold)
+        else:
+            selected = np.flatnonzero(np.isfinite(distances))
+
+        candidate_num = min(len(selected), k * 4)
+
+        if candidate_num < len(selected):
+            partitioned = np.argpartition(distances[selected], candidate_num - 1)
+            candidates = selected[partitioned[:candidate_num]]
+        else:
+            candidates = selected
+
+        results = self._pick_distinct(distances, rows, candidates, k)
+
+        if len(results) < k and candidate_num < len(selected):
+            results = self._pick_distinct(distances, rows, selected, k)
+
+        return results
+
+    def _pick_distinct(self, distances, rows, candidates, k):
+        results = []
+        picked_ids = set()
+
+        for candidate in candidates[np.argsort(distances[candidates], kind = 'stable')]:
+            entry_id = self._row_ids[rows[candidate]]
+
+            if entry_id in picked_ids:
+                continue
+
+            picked_ids.add(entry_id)
+            results.append((entry_id, float(distances[candidate])))
+
+            if len(results) == k:
+                break
+
+        return results
+
+    def _reserve(self, row_num):
+        """Grow the arrays to hold at least row_num rows."""
+        capacity = len(self._matrix)
+
+        if row_num <= capacity:
+            return
+
+        capacity = max(row_num, capacity * 2, 64)
+
+        matrix = np.empty((capacity, self._dimension), self._dtype)
+        matrix[:self._row_num] = self._matrix[:self._row_num]
+        square_norms = np.empty(capacity, self._dtype)
+        square_norms[:self._row_num] = self._square_norms[:self._row_num]
+        alive = np.zeros(capacity, bool)
+        alive[:self._row_num] = self._alive[:self._row_num]
+
+        self._matrix = matrix
+        self._square_norms = square_norms
+        self._alive = alive
+
+class IVFFaceIndex(FaceIndex):
+    """Face index answering queries approximately through an inverted file.
+
+    The encodings are clustered around list_num k-means centroids, and queries only compare the
+    encodings of the probe_num lists nearest to the probe, trading recall for latency. Until
+    enough encodings are indexed to train the centroids, queries are exact.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, dimension = 128, encodings_getter = get_encodings, repack_ratio = .25,
+            dtype = 'float32', list_num = 64, probe_num = 8, train_iteration_num = 10,
+            seed = 0):
+        """Initialize IVF face index instance."""
+        super().__init__(dimension, encodings_getter, repack_ratio, dtype)
+
+        self._list_num = list_num
+        self._train_iteration_num = train_iteration_num
+        self._random = np.random.default_rng(seed)
+        self._assignments = np.empty(0, np.int64)
+        self._lists = []
+        self._centroids = None
+        self._trained_num = 0
+        self.probe_num = probe_num
+
+    @property
+    def trained(self):
+        """Whether the centroids have been trained."""
+        return self._centroids is not None
+
+    def add(self, entry_id, encodings):
+        super().add(entry_id, encodings)
+
+        if entry_id in self._rows and self._centroids is not None:
+            self._assign(self._rows[entry_id])
+
+        if self.encoding_num >= max(2 * self._trained_num, 8 * self._list_num):
+            self.train()
+
+    def clear(self):
+        super().clear()
+
+        self._lists = []
+        self._centroids = None
+        self._trained_num = 0
+
+    def repack(self):
+        live_rows = np.flatnonzero(self._alive[:self._row_num])
+        assignments = self._assignments[live_rows]
+
+        super().repack()
+
+        self._assignments[:len(live_rows)] = assignments
+        self._build_lists()
+
+    def train(self):
+        """Cluster the indexed encodings with k-means and assign every row to its list."""
+        live_rows = np.flatnonzero(self._alive[:self._row_num])
+
+        if len(live_rows) < self._list_num:
+            return
+
+        sample_rows = live_rows
+
+        if len(sample_rows) > 64 * self._list_num:
+            sample_rows = self._random.choice(live_rows, 64 * self._list_num, replace = False)
+
+        sample = self._matrix[sample_rows]
+        centroids = sample[self._random.choice(len(sample), self._list_num, replace = False)]
+
+        for _ in range(self._train_iteration_num):
+            labels = get_nearest_centroids(sample, centroids)
+
+            for label in range(self._list_num):
+                members = sample[labels == label]
+
+                if len(members) > 0:
+                    centroids[label] = members.mean(axis = 0)
+
+        self._centroids = centroids
+        self._trained_num = len(live_rows)
+        self._lists = [[] for _ in range(self._list_num)]
+        self._assign(live_rows)
+
+    def query(self, encoding, k = 1, threshold = None):
+        if self._centroids is None:
+            return super().query(encoding, k, threshold)
+
+        encoding = np.asarray(encoding, self._dtype).reshape(self._dimension)
+        centroid_distances = ((self._centroids - encoding) ** 2).sum(axis = 1)
+        probe_num = min(self.probe_num, self._list_num)
+        probes = np.argpartition(centroid_distances, probe_num - 1)[:probe_num]
+        rows = np.concatenate([np.asarray(self._lists[probe], np.int64) for probe in probes])
+
+        if len(rows) == 0:
+            return []
+
+        square_distances = self._square_norms[rows] - 2 * self._matrix[rows].dot(encoding) \
+            + encoding.dot(encoding)
+        distances = np.sqrt(np.maximum(square_distances, 0))
+        distances[~self._alive[rows]] = np.inf
+
+        return self._rank(distances, rows, k, threshold)
+
+    def _assign(self, rows):
+        """Put the rows into the lists of their nearest centroids."""
+        rows = np.asarray(rows, np.int64)
+
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start:start + 4096]
+            labels = get_nearest_centroids(self._matrix[chunk], self._centroids)
+            self._assignments[chunk] = labels
+
+            for row, label in zip(chunk.tolist(), labels.tolist()):
+                self._lists[label].append(row)
+
+    def _build_lists(self):
+        """Rebuild the lists from the assignments of the live rows."""
+
+        if self._centroids is None:
+            return
+
+        self._lists = [[] for _ in range(self._list_num)]
+
+        for row, label in enumerate(self._assignments[:self._row_num].tolist()):
+            if self._alive[row]:
+                self._lists[label].append(row)
+
+    def _reserve(self, row_num):
+        super()._reserve(row_num)
+
+        if len(self._assignments) < len(self._matrix):
+            assignments = np.zeros(len(self._matrix), np.int64)
+            assignments[:len(self._assignments)] = self._assignments
+            self._assignments = assignments
+
+def measure_recall(face_index, encodings, k = 1):
+    """Compare the queries of a face index with exact search.
+
+    Get the mean share of the exact k nearest entries the index also returns, and the total
+    query time of both.
+    """
+    recalls = []
+    exact_time = 0
+    index_time = 0
+
+    for encoding in encodings:
+        start = perf_counter()
+        exact_ids = {entry_id for entry_id, _ in FaceIndex.query(face_index, encoding, k)}
+        exact_time += perf_counter() - start
+
+        start = perf_counter()
+        index_ids = {entry_id for entry_id, _ in face_index.query(encoding, k)}
+        index_time += perf_counter() - start
+
+        if exact_ids:
+            recalls.append(len(exact_ids & index_ids) / len(exact_ids))
+
+    return {
+        "recall": float(np.mean(recalls)) if recalls else 1.0,
+        "exact_time": exact_time,
+        "index_time": index_time,
+    }
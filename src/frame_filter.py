@@ -0,0 +1,122 @@
+"""Filter skipping frames nearly identical to recently processed ones."""
+from collections import deque, namedtuple
+from io import BytesIO
+from time import monotonic
+
+import numpy as np
+from PIL import Image
+
+Fingerprint = namedtuple("Fingerprint", ["frame_hash", "thumbnail"])
+CachedFrame = namedtuple("CachedFrame", ["fingerprint", "result", "source", "processed_at"])
+
+def get_hash_distance(hash_a, hash_b):
+    """Count the differing bits of two frame hashes."""
+    return bin(hash_a ^ hash_b).count("1")
+
+class FrameFilter:
+    """Cache of recently processed frames matched by perceptual hash and by frame difference.
+
+    Frames are compared by their grayscale thumbnails, each pixel of which is the mean of one
+    block of the frame. A frame is skipped when no block differs by more than motion_threshold
+    from the last processed frame of the same source, or from a recent frame of the same source
+    whose 64 bit difference hash is within hash_distance bits, and the cached result is reused
+    instead. The largest block difference is used rather than the mean, so a small local change
+    such as a face entering an otherwise static scene is not taken for noise.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, hash_distance = 1, motion_threshold = 8, cache_size = 32, max_age = 10,
+            thumbnail_size = 32):
+        """Initialize frame filter instance."""
+
+        self._hash_distance = hash_distance
+        self._motion_threshold = motion_threshold
+        self._max_age = max_age
+        self._thumbnail_size = thumbnail_size
+        self._recent_frames = deque(maxlen = cache_size)
+        self._last_frames = {}
+        self._checked_num = 0
+        self._hash_hit_num = 0
+        self._motion_skip_num = 0
+
+    @property
+    def stats(self):
+        """Counters of checked frames, hash hits and motion skips, and the hit rate."""
+        skipped_num = self._hash_hit_num + self._motion_skip_num
+
+        return {
+            "checked": self._checked_num,
+            "hash_hits": self._hash_hit_num,
+            "motion_skips": self._motion_skip_num,
+            "misses": self._checked_num - skipped_num,
+            "hit_rate": skipped_num / self._checked_num if self._checked_num else 0.0,
+        }
+
+    def fingerprint(self, image):
+        """Get the fingerprint of an image file content."""
+
+        with Image.open(BytesIO(image)) as picture:
+            # Let JPEG decoding scale down on the fly, which is much cheaper than a full decode.
+            picture.draft('L', (self._thumbnail_size * 4, self._thumbnail_size * 4))
+            grayscale = picture.convert('L')
+
+        # pylint: disable = no-member
+        pixels = np.asarray(grayscale.resize((9, 8), Image.BILINEAR), np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        thumbnail = grayscale.resize((self._thumbnail_size, self._thumbnail_size), Image.BILINEAR)
+
+        return Fingerprint(int.from_bytes(np.packbits(bits).tobytes(), 'big'),
+            np.asarray(thumbnail, np.int16))
+
+    def lookup(self, fingerprint, source = None):
+        """Find the result of a nearly identical frame, return (whether found, result)."""
+        now = monotonic()
+        self._checked_num += 1
+
+        last_frame = self._last_frames.get(source)
+
+        if last_frame is not None and now - last_frame.processed_at <= self._max_age \
+                and self._is_unchanged(fingerprint, last_frame.fingerprint):
+            self._motion_skip_num += 1
+
+            return True, last_frame.result
+
+        for cached_frame in reversed(self._recent_frames):
+            if now - cached_frame.processed_at > self._max_age:
+                break
+
+            if cached_frame.source != source or cached_frame is last_frame:
+                continue
+
+            frame_hash = cached_frame.fingerprint.frame_hash
+
+            if get_hash_distance(fingerprint.frame_hash, frame_hash) <= self._hash_distance \
+                    and self._is_unchanged(fingerprint, cached_frame.fingerprint):
+                self._hash_hit_num += 1
+
+                return True, cached_frame.result
+
+        return False, None
+
+    def _is_unchanged(self, fingerprint, cached_fingerprint):
+        """Check whether no block of the frame differs noticeably from the cached frame."""
+        difference = np.abs(fingerprint.thumbnail - cached_fingerprint.thumbnail)
+
+        return difference.max() <= self._motion_threshold
+
+    def store(self, fingerprint, result, source = None):
+        """Remember the result of a processed frame."""
+        cached_frame = CachedFrame(fingerprint, result, source, monotonic())
+
+        self._recent_frames.append(cached_frame)
+        self._last_frames[source] = cached_frame
+
+    def discard(self, result):
+        """Forget the frames cached with the result."""
+        self._recent_frames = deque((cached_frame for cached_frame in self._recent_frames
+            if cached_frame.result is not result), self._recent_frames.maxlen)
+
+        for source, cached_frame in list(self._last_frames.items()):
+            if cached_frame.result is result:
+                del self._last_frames[source]
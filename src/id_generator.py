@@ -0,0 +1,76 @@
+"""Generators of entry ids."""
+# pylint: disable = too-few-public-methods
+import os
+from time import time
+from uuid import uuid4
+
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+class IdGenerator:
+    """Base class for entry id generators."""
+
+    def generate(self, entry, is_taken):
+        """Generate an id for the entry, is_taken tells if an id is already used."""
+        raise NotImplementedError()
+
+class UUIDGenerator(IdGenerator):
+    """Random UUID4 ids, drawn again on the unlikely collision."""
+
+    def generate(self, entry, is_taken):
+        while True:
+            entry_id = str(uuid4())
+
+            if not is_taken(entry_id):
+                return entry_id
+
+class TimeOrderedIdGenerator(IdGenerator):
+    """ULID style ids, sorting in the order they are generated.
+
+    An id is a 48 bit millisecond timestamp followed by 80 random bits, as 26 Crockford base32
+    characters. Within the same millisecond, or if the clock goes back, the random part of the
+    last id is incremented instead of drawn again.
+    """
+
+    def __init__(self):
+        """Initialize time ordered id generator instance."""
+
+        self._last_timestamp = -1
+        self._last_randomness = 0
+
+    def generate(self, entry, is_taken):
+        while True:
+            timestamp = int(time() * 1000)
+
+            if timestamp > self._last_timestamp:
+                randomness = int.from_bytes(os.urandom(10), 'big')
+            else:
+                timestamp = self._last_timestamp
+                randomness = self._last_randomness + 1
+
+                if randomness >> 80:
+                    timestamp += 1
+                    randomness = 0
+
+            self._last_timestamp = timestamp
+            self._last_randomness = randomness
+
+            entry_id = encode_base32((timestamp << 80) | randomness, 26)
+
+            if not is_taken(entry_id):
+                return entry_id
+
+class CallerIdGenerator(IdGenerator):
+    """Ids given by the callers, entries added without one are refused."""
+
+    def generate(self, entry, is_taken):
+        raise RuntimeError("Entry id required.")
+
+def encode_base32(value, length):
+    """Encode an integer as length Crockford base32 characters."""
+    characters = []
+
+    for _ in range(length):
+        characters.append(CROCKFORD_BASE32[value & 31])
+        value >>= 5
+
+    return "".join(reversed(characters))
@@ -1,5 +1,14 @@
 """Class of objects that can be converted to JSON."""
 
+def to_json_default(value):
+    """Convert values json does not know, such as NumPy arrays and scalars, for json.dump."""
+    to_list = getattr(value, "tolist", None)
+
+    if to_list is None:
+        raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+    return to_list()
+
 class JSONCompatible():
     """Objects that can be converted to JSON."""
 
@@ -1,9 +1,53 @@
 """Basic class for lockable objects."""
 import asyncio
+from bisect import bisect_left
 from collections import deque
+from contextlib import asynccontextmanager
+from time import monotonic
+
+class LatencyHistogram:
+    """Histogram of durations in seconds, counted in buckets up to each bound."""
+
+    def __init__(self, bounds = (.001, .01, .1, 1, 10)):
+        """Initialize latency histogram instance."""
+
+        self._bounds = tuple(bounds)
+        self._bucket_counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._total = 0
+        self._max = 0
+
+    def record(self, duration):
+        """Count a duration."""
+        self._bucket_counts[bisect_left(self._bounds, duration)] += 1
+        self._count += 1
+        self._total += duration
+        self._max = max(self._max, duration)
+
+    def to_dict(self):
+        """Get the count, total, mean and max durations, and the count of each bucket."""
+        buckets = {str(bound): count for bound, count in zip(self._bounds, self._bucket_counts)}
+        buckets["inf"] = self._bucket_counts[-1]
+
+        return {
+            "count": self._count,
+            "total": self._total,
+            "mean": self._total / self._count if self._count else 0.0,
+            "max": self._max,
+            "buckets": buckets,
+        }
 
 class Lockable:
-    """Basic class for lockable objects."""
+    """Basic class for lockable objects.
+
+    Lock wait and hold times, the longest queue of waiters and forced unlocks are counted and
+    exposed by lock_stats.
+
+    Waiters cancelled or timing out leave the queue, and a lock handed over to a waiter just as it
+    gave up is passed on, so abandoned waiters never hold the lock.
+    """
+
+    # pylint: disable = too-many-instance-attributes
 
     _wrong_key_error = RuntimeError("Wrong key to update data persistence instance.")
 
@@ -15,28 +59,58 @@ class Lockable:
         self._key = object()
         self._locked = False
         self._lock_futures = deque()
+        self._locked_at = None
+        self._wait_times = LatencyHistogram()
+        self._hold_times = LatencyHistogram()
+        self._acquired_num = 0
+        self._forced_unlock_num = 0
+        self._abandoned_num = 0
+        self._max_queue_length = 0
+        self._slow_hold_time = None
+        self._on_slow_hold = None
 
     @property
     def locked(self):
         """Where the instance is locked for sorting."""
         return  self._locked
 
-    async def lock(self):
-        """Lock sorting and get the key."""
+    @property
+    def lock_stats(self):
+        """Lock counters and wait and hold time histograms."""
+
+        return {
+            "acquired": self._acquired_num,
+            "forced_unlocks": self._forced_unlock_num,
+            "abandoned_waits": self._abandoned_num,
+            "queue_length": len(self._lock_futures),
+            "max_queue_length": self._max_queue_length,
+            "wait_time": self._wait_times.to_dict(),
+            "hold_time": self._hold_times.to_dict(),
+        }
+
+    def watch_slow_holders(self, callback, hold_time = 1):
+        """Call back with the hold time whenever the lock has been held at least hold_time."""
+        self._on_slow_hold = callback
+        self._slow_hold_time = hold_time
+
+    async def lock(self, timeout = None):
+        """Lock sorting and get the key, raise asyncio.TimeoutError after timeout seconds."""
+        requested_at = monotonic()
 
         if not self._locked:
             self._locked = True
+            self._on_acquired()
+            self._wait_times.record(0)
 
             return self._key
 
         if (self._max_waiting_num > 0) & (len(self._lock_futures) == self._max_waiting_num):
+            self._forced_unlock_num += 1
             self.unlock(self._key)
             self._change_key()
 
-        future = asyncio.Future()
-        self._lock_futures.append(future)
-
-        await future
+        await self._wait_for_lock(timeout)
+        self._wait_times.record(monotonic() - requested_at)
 
         return self._key
 
@@ -49,16 +123,74 @@ class Lockable:
         if key != self._key:
             raise self._wrong_key_error
 
-        if len(self._lock_futures) > 0:
-            self._lock_futures.popleft().set_result(True)
+        self._on_released()
 
+        if self._hand_over():
             return
 
         self._locked = False
 
+    @asynccontextmanager
+    async def hold(self, timeout = None):
+        """Hold the lock in an async with block, giving the key."""
+        key = await self.lock(timeout)
+
+        try:
+            yield key
+        finally:
+            # The lock may have been forcibly unlocked meanwhile.
+            if self._locked and key == self._key:
+                self.unlock(key)
+
     def _change_key(self):
         self._key = object()
 
+    async def _wait_for_lock(self, timeout = None):
+        future = asyncio.get_event_loop().create_future()
+        self._lock_futures.append(future)
+        self._max_queue_length = max(self._max_queue_length, len(self._lock_futures))
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            self._abandoned_num += 1
+
+            if future.done() and not future.cancelled():
+                self.unlock(self._key)
+            elif future in self._lock_futures:
+                self._lock_futures.remove(future)
+                self._on_waiter_left()
+
+            raise
+
+    def _on_waiter_left(self):
+        """Handle a waiter giving up before getting the lock."""
+
+    def _hand_over(self):
+        """Give the lock to the first waiter still waiting, return whether there was one."""
+
+        while len(self._lock_futures) > 0:
+            future = self._lock_futures.popleft()
+
+            if not future.done():
+                self._on_acquired()
+                future.set_result(True)
+
+                return True
+
+        return False
+
+    def _on_acquired(self):
+        self._acquired_num += 1
+        self._locked_at = monotonic()
+
+    def _on_released(self):
+        hold_time = monotonic() - self._locked_at
+        self._hold_times.record(hold_time)
+
+        if self._on_slow_hold is not None and hold_time >= self._slow_hold_time:
+            self._on_slow_hold(hold_time)
+
     def _check_lock(self, key = None):
         if  self._locked:
             if key is None:
@@ -67,3 +199,165 @@ class Lockable:
 
             if key != self._key:
                 raise self._wrong_key_error
+
+    def _check_read_lock(self, key = None):
+        self._check_lock(key)
+
+class ReadWriteLockable(Lockable):
+    """Lockable letting many readers hold the lock together, writers holding it exclusively.
+
+    lock and unlock take the write lock as in Lockable, lock_read and unlock_read the read lock.
+    Writers are preferred: once a writer waits, new readers wait until the writers are done. While
+    the lock is read locked, reads go on and updates raise.
+
+    Hold times only count writers, and reader wait times are counted apart.
+    """
+
+    def __init__(self, max_waiting_num = 8):
+        """Initialize read write lockable instance."""
+        super().__init__(max_waiting_num)
+
+        self._read_key = object()
+        self._reader_num = 0
+        self._read_futures = deque()
+        self._read_wait_times = LatencyHistogram()
+
+    @property
+    def reader_num(self):
+        """Number of readers holding the lock."""
+        return self._reader_num
+
+    @property
+    def lock_stats(self):
+        lock_stats = super().lock_stats
+        lock_stats["readers"] = self._reader_num
+        lock_stats["read_queue_length"] = len(self._read_futures)
+        lock_stats["read_wait_time"] = self._read_wait_times.to_dict()
+
+        return lock_stats
+
+    async def lock(self, timeout = None):
+        """Lock for writing and get the key, raise asyncio.TimeoutError after timeout seconds."""
+        requested_at = monotonic()
+
+        if not self._locked and self._reader_num == 0:
+            self._locked = True
+            self._on_acquired()
+            self._wait_times.record(0)
+
+            return self._key
+
+        if (self._max_waiting_num > 0) & (len(self._lock_futures) == self._max_waiting_num):
+            self._forced_unlock_num += 1
+
+            if self._locked:
+                self.unlock(self._key)
+                self._change_key()
+            else:
+                self._release_readers()
+
+        await self._wait_for_lock(timeout)
+        self._wait_times.record(monotonic() - requested_at)
+
+        return self._key
+
+    def unlock(self, key):
+        """Unlock writing with the key."""
+
+        if not self._locked:
+            raise RuntimeError("Data persistence instance already unlocked.")
+
+        if key != self._key:
+            raise self._wrong_key_error
+
+        self._on_released()
+
+        if self._hand_over():
+            return
+
+        self._locked = False
+
+        self._wake_readers()
+
+    async def lock_read(self, timeout = None):
+        """Lock for reading and get the read key, raise asyncio.TimeoutError after timeout."""
+        requested_at = monotonic()
+
+        if not self._locked and len(self._lock_futures) == 0:
+            self._reader_num += 1
+            self._read_wait_times.record(0)
+
+            return self._read_key
+
+        future = asyncio.get_event_loop().create_future()
+        self._read_futures.append(future)
+
+        try:
+            read_key = await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            self._abandoned_num += 1
+
+            if future.done() and not future.cancelled():
+                self.unlock_read(future.result())
+            elif future in self._read_futures:
+                self._read_futures.remove(future)
+
+            raise
+
+        self._read_wait_times.record(monotonic() - requested_at)
+
+        return read_key
+
+    def unlock_read(self, key):
+        """Unlock reading with the read key."""
+
+        if key != self._read_key:
+            raise self._wrong_key_error
+
+        if self._reader_num == 0:
+            raise RuntimeError("Data persistence instance already unlocked.")
+
+        self._reader_num -= 1
+
+        if self._reader_num == 0 and self._hand_over():
+            self._locked = True
+
+    @asynccontextmanager
+    async def hold_read(self, timeout = None):
+        """Hold the read lock in an async with block, giving the read key."""
+        read_key = await self.lock_read(timeout)
+
+        try:
+            yield read_key
+        finally:
+            # The readers may have been forcibly released meanwhile.
+            if self._reader_num > 0 and read_key == self._read_key:
+                self.unlock_read(read_key)
+
+    def _on_waiter_left(self):
+        # Readers only queue behind writers.
+        if not self._locked and len(self._lock_futures) == 0:
+            self._wake_readers()
+
+    def _release_readers(self):
+        """Take the lock from the readers for the first waiting writer."""
+        self._reader_num = 0
+        self._read_key = object()
+        self._locked = self._hand_over()
+
+    def _wake_readers(self):
+        while len(self._read_futures) > 0:
+            future = self._read_futures.popleft()
+
+            if not future.done():
+                self._reader_num += 1
+                future.set_result(self._read_key)
+
+    def _check_lock(self, key = None):
+        super()._check_lock(key)
+
+        if self._reader_num > 0:
+            raise RuntimeError('Can not update a data persistence instance being read locked.')
+
+    def _check_read_lock(self, key = None):
+        super()._check_lock(key)
@@ -0,0 +1,87 @@
+"""Least recently used cache with a byte budget."""
+from collections import OrderedDict
+
+class LRUCache:
+    """Cache evicting the least recently used items once their total size exceeds max_bytes."""
+
+    def __init__(self, max_bytes = 16 << 20, get_size = len):
+        """Initialize LRU cache instance."""
+
+        self._max_bytes = max_bytes
+        self._get_size = get_size
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._hit_num = 0
+        self._miss_num = 0
+        self._eviction_num = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def size(self):
+        """Total size of the cached items in bytes."""
+        return self._bytes
+
+    @property
+    def stats(self):
+        """Counters of hits, misses and evictions, and the current usage."""
+
+        return {
+            "hits": self._hit_num,
+            "misses": self._miss_num,
+            "evictions": self._eviction_num,
+            "items": len(self._items),
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+        }
+
+    def get(self, key, default = None):
+        """Get a cached item and mark it as recently used."""
+        item = self._items.get(key)
+
+        if item is None:
+            self._miss_num += 1
+
+            return default
+
+        self._hit_num += 1
+        self._items.move_to_end(key)
+
+        return item[0]
+
+    def put(self, key, value):
+        """Cache an item, items larger than the whole budget are not cached."""
+        self.invalidate(key)
+
+        size = self._get_size(value)
+
+        if size > self._max_bytes:
+            return
+
+        self._items[key] = (value, size)
+        self._bytes += size
+
+        while self._bytes > self._max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last = False)
+            self._bytes -= evicted_size
+            self._eviction_num += 1
+
+    def invalidate(self, key):
+        """Drop a cached item, return whether it was cached."""
+        item = self._items.pop(key, None)
+
+        if item is None:
+            return False
+
+        self._bytes -= item[1]
+
+        return True
+
+    def clear(self):
+        """Drop all cached items."""
+        self._items.clear()
+        self._bytes = 0
@@ -0,0 +1,192 @@
+"""Pipeline running face detection and encoding in worker processes."""
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import os
+
+def detect_and_encode(image, model = "hog", upsample_num = 1):
+    """Detect the faces in an image file content, get their locations and encodings."""
+    # pylint: disable = import-outside-toplevel
+    import face_recognition
+
+    image_array = face_recognition.load_image_file(BytesIO(image))
+    locations = face_recognition.face_locations(image_array, upsample_num, model)
+    encodings = face_recognition.face_encodings(image_array, locations)
+
+    return list(zip(locations, encodings))
+
+def detect_and_encode_batch(images, model = "hog", upsample_num = 1):
+    """Detect and encode the faces of a batch of images, errors are returned in their place."""
+    results = []
+
+    for image in images:
+        try:
+            results.append(detect_and_encode(image, model, upsample_num))
+        except Exception as err: # pylint: disable = broad-except
+            results.append(err)
+
+    return results
+
+class RecognitionPipeline:
+    """Batch frames and detect and encode their faces in a bounded pool of worker processes.
+
+    Frames are sent to the workers in batches of batch_size, or once the oldest waiting frame has
+    waited batch_interval seconds. At most worker_num batches are processed at the same time, and
+    frames arriving meanwhile are sent as soon as a worker finishes.
+
+    With a frame_filter, frames nearly identical to a recently recognized one of the same source
+    reuse its result instead of being recognized again.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, worker_num = None, batch_size = 4, batch_interval = .02, model = "hog",
+            upsample_num = 1, process_batch = detect_and_encode_batch, executor = None,
+            frame_filter = None):
+        """Initialize recognition pipeline instance."""
+
+        self._worker_num = worker_num or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._model = model
+        self._upsample_num = upsample_num
+        self._process_batch = process_batch
+        self._executor = executor
+        self._frame_filter = frame_filter
+        self._pending = deque()
+        self._running_num = 0
+        self._batch_timer = None
+
+    @property
+    def pending_num(self):
+        """Number of frames waiting for a worker."""
+        return len(self._pending)
+
+    async def recognize(self, image, source = None):
+        """Get the (location, encoding) pairs of the faces in an image file content.
+
+        The source, such as a camera entity id, tells the frame filter which frames follow each
+        other.
+        """
+
+        if self._frame_filter is None:
+            return await self._recognize(image)
+
+        loop = asyncio.get_event_loop()
+
+        try:
+            fingerprint = await loop.run_in_executor(None, self._frame_filter.fingerprint, image)
+        except OSError:
+            return await self._recognize(image)
+
+        found, future = self._frame_filter.lookup(fingerprint, source)
+
+        if not found:
+            future = asyncio.ensure_future(self._recognize(image))
+            future.add_done_callback(self._on_filtered_frame_done)
+            self._frame_filter.store(fingerprint, future, source)
+
+        return await asyncio.shield(future)
+
+    async def recognize_many(self, images):
+        """Recognize several images, sharing batches between them."""
+        return await asyncio.gather(*[self.recognize(image) for image in images])
+
+    async def recognize_stored(self, storage, path, name):
+        """Recognize an image file of the storage."""
+        file = storage.get(path, name)
+
+        return await self.recognize(await file.read())
+
+    async def recognize_camera(self, hass, entity_id):
+        """Recognize the current image of a camera entity."""
+        # pylint: disable = import-outside-toplevel
+        from homeassistant.components.camera import async_get_image
+
+        image = await async_get_image(hass, entity_id)
+
+        return await self.recognize(image.content, entity_id)
+
+    def shutdown(self, wait = True):
+        """Stop the worker processes."""
+
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait)
+            self._executor = None
+
+    async def _recognize(self, image):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        self._pending.append((image, future))
+
+        if len(self._pending) >= self._batch_size:
+            self._dispatch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self._batch_interval, self._on_batch_timer)
+
+        return await future
+
+    def _on_filtered_frame_done(self, future):
+        """Do not reuse failed results."""
+
+        if future.cancelled() or future.exception() is not None:
+            self._frame_filter.discard(future)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self._worker_num)
+
+        return self._executor
+
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Send waiting frames to the workers while there are idle ones."""
+
+        while self._pending and self._running_num < self._worker_num:
+            batch_size = min(self._batch_size, len(self._pending))
+            batch = [self._pending.popleft() for _ in range(batch_size)]
+            batch = [(image, future) for image, future in batch if not future.cancelled()]
+
+            if not batch:
+                continue
+
+            self._running_num += 1
+
+            task = asyncio.get_event_loop().run_in_executor(self._get_executor(),
+                self._process_batch, [image for image, _ in batch], self._model, self._upsample_num)
+            task.add_done_callback(lambda task, batch = batch: self._on_batch_done(task, batch))
+
+        if self._batch_timer is not None and not self._pending:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+
+    def _on_batch_done(self, task, batch):
+        self._running_num -= 1
+
+        if task.cancelled() or task.exception() is not None:
+            error = asyncio.CancelledError() if task.cancelled() else task.exception()
+
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for (_, future), result in zip(batch, task.result()):
+                if future.done():
+                    continue
+
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        if self._pending:
+            self._dispatch()
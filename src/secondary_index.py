@@ -0,0 +1,109 @@
+"""Secondary indexes looking up data container entries by attribute."""
+from bisect import bisect_left, insort
+from itertools import islice
+
+from src.data_container import DataContainer
+
+class SecondaryIndex(DataContainer.Listener):
+    """Base class for indexes of entry ids by a value of the entries, queried by query.
+
+    The value is the attribute of the entries named by getter, or the result of getter called
+    with an entry. Entries with None as value are not indexed.
+    """
+
+    def __init__(self, getter):
+        """Initialize secondary index instance."""
+
+        if isinstance(getter, str):
+            attribute_name = getter
+
+            def get_attribute(entry):
+                return getattr(entry, attribute_name, None)
+
+            getter = get_attribute
+
+        self._getter = getter
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def entry_added(self, entry_id, entry):
+        self._reindex(entry_id, entry)
+
+    def entry_updated(self, entry_id, old_entry, entry):
+        self._reindex(entry_id, entry)
+
+    def entry_refreshed(self, entry_id, entry):
+        self._reindex(entry_id, entry)
+
+    def entry_removed(self, entry_id, entry):
+        self._reindex(entry_id, None)
+
+    def _reindex(self, entry_id, entry):
+        old_value = self._values.pop(entry_id, None)
+        value = None if entry is None else self._getter(entry)
+
+        if old_value is not None:
+            self._remove(entry_id, old_value)
+
+        if value is not None:
+            self._values[entry_id] = value
+            self._add(entry_id, value)
+
+    def _add(self, entry_id, value):
+        raise NotImplementedError()
+
+    def _remove(self, entry_id, value):
+        raise NotImplementedError()
+
+class HashIndex(SecondaryIndex):
+    """Index finding the entries with a value in O(1 + k)."""
+
+    def __init__(self, getter):
+        super().__init__(getter)
+
+        self._ids = {}
+
+    def query(self, value):
+        """Get the ids of the entries with the value, in the order they were indexed."""
+        return list(self._ids.get(value, ()))
+
+    def _add(self, entry_id, value):
+        # Dicts keep the insertion order, unlike sets.
+        self._ids.setdefault(value, {})[entry_id] = True
+
+    def _remove(self, entry_id, value):
+        ids = self._ids[value]
+        del ids[entry_id]
+
+        if not ids:
+            del self._ids[value]
+
+class SortedIndex(SecondaryIndex):
+    """Index finding the entries with values in a range in O(log n + k).
+
+    Values have to be comparable with each other, and so do the entry ids of equal values.
+    """
+
+    def __init__(self, getter = "updated_at"):
+        super().__init__(getter)
+
+        self._items = []
+
+    def query(self, start = None, end = None, limit = None, reverse = False):
+        """Get the ids of the entries with values from start up to but excluding end, in order."""
+        start_index = 0 if start is None else bisect_left(self._items, (start,))
+        end_index = len(self._items) if end is None else bisect_left(self._items, (end,))
+        indexes = range(start_index, end_index)
+
+        if reverse:
+            indexes = reversed(indexes)
+
+        return [self._items[index][1] for index in islice(indexes, limit)]
+
+    def _add(self, entry_id, value):
+        insort(self._items, (value, entry_id))
+
+    def _remove(self, entry_id, value):
+        del self._items[bisect_left(self._items, (value, entry_id))]
@@ -0,0 +1,181 @@
+"""Data container partitioning its entries across several data containers."""
+from itertools import chain
+import os
+from zlib import crc32
+
+from src.data_container import EVICTION_OLDEST, DataContainer, DataContainerWithMaxSize
+from src.data_persistence import JSONFileDictDataPersistence
+from src.id_generator import UUIDGenerator
+
+class ShardedDataContainer(DataContainerWithMaxSize):
+    """Data container spreading its entries over shards by the CRC32 of their ids.
+
+    Each shard is a data container with max size, such as a data persistence, with its own lock
+    and files, so updates of entries of different shards do not contend. Operations check the lock
+    of the sharded container, then the one of the shard of the entry, and the key is passed to
+    both. The max size and the byte budget apply to all the shards together, evicting by the
+    eviction policy from any shard.
+    """
+
+    class ShardListener(DataContainer.Listener):
+        """Listener keeping the sharded container up to date with the changes of its shards."""
+
+        # pylint: disable = protected-access
+
+        def __init__(self, sharded_data_container):
+            self._sharded_data_container = sharded_data_container
+
+        def entry_added(self, entry_id, entry):
+            self._sharded_data_container._on_shard_entry_added(entry_id, entry)
+
+        def entry_updated(self, entry_id, old_entry, entry):
+            self._sharded_data_container._on_shard_entry_updated(entry_id, old_entry, entry)
+
+        def entry_refreshed(self, entry_id, entry):
+            self._sharded_data_container._on_shard_entry_refreshed(entry_id, entry)
+
+        def entry_removed(self, entry_id, entry):
+            self._sharded_data_container._on_shard_entry_removed(entry_id, entry)
+
+    # pylint: disable = too-many-arguments
+    def __init__(self, shards, max_size = 8, max_waiting_num = 8, id_generator = None,
+            ttl = None, max_bytes = None, eviction_policy = EVICTION_OLDEST):
+        """Initialize sharded data container instance."""
+        super().__init__(max_size, max_waiting_num, ttl, max_bytes, eviction_policy)
+
+        self._shards = list(shards)
+        self._id_generator = id_generator or UUIDGenerator()
+        self._shard_listener = ShardedDataContainer.ShardListener(self)
+
+        for shard in self._shards:
+            for entry in shard.iter_entries():
+                self._index_entry(entry.entry_id, entry)
+
+            shard.add_listener(self._shard_listener)
+
+        self._check_max_size()
+
+    @property
+    def shards(self):
+        """Data containers holding the entries."""
+        return self._shards
+
+    def get_shard(self, entry_id):
+        """Get the shard holding the entry id, to lock it for example."""
+        return self._shards[self._get_shard_index(entry_id)]
+
+    def add(self, entry, key = None):
+        """Add data entry."""
+        self._check_lock(key)
+
+        if not isinstance(entry, DataContainerWithMaxSize.Entry):
+            raise TypeError("Entry must be of type DataContainerWithMaxSize.Entry.")
+
+        self._check_id(entry)
+        self.get_shard(entry.entry_id).add(entry, key)
+        self._check_max_size(entry.entry_id, key)
+
+        return entry.entry_id
+
+    def update(self, entry_id, entry, key = None):
+        self._check_lock(key)
+        self.get_shard(entry_id).update(entry_id, entry, key)
+        self._check_max_size(entry_id, key)
+
+    def has(self, entry_id, key = None):
+        self._check_read_lock(key)
+
+        return self.get_shard(entry_id).has(entry_id, key)
+
+    def get(self, entry_id, key = None):
+        self._check_read_lock(key)
+
+        entry = self.get_shard(entry_id).get(entry_id, key)
+        self._touch(entry_id)
+
+        return entry
+
+    def remove(self, entry_id, key = None):
+        self._check_lock(key)
+        self.get_shard(entry_id).remove(entry_id, key)
+
+    def remove_many(self, entry_ids, key = None):
+        """Remove entries by id, in one batch per shard."""
+        self._check_lock(key)
+
+        shard_entry_ids = {}
+
+        for entry_id in entry_ids:
+            shard_entry_ids.setdefault(self._get_shard_index(entry_id), []).append(entry_id)
+
+        for shard_index, entry_ids_of_shard in shard_entry_ids.items():
+            self._shards[shard_index].remove_many(entry_ids_of_shard, key)
+
+    def get_all(self):
+        return list(self.iter_entries())
+
+    def iter_entries(self, predicate = None, key = None):
+        self._check_read_lock(key)
+
+        return chain.from_iterable(shard.iter_entries(predicate, key) for shard in self._shards)
+
+    def count(self, predicate = None, key = None):
+        self._check_read_lock(key)
+
+        return sum(shard.count(predicate, key) for shard in self._shards)
+
+    def _get_shard_index(self, entry_id):
+        return crc32(str(entry_id).encode()) % len(self._shards)
+
+    def _check_id(self, entry):
+        """Add id to the entry if not exists."""
+
+        if not entry.entry_id:
+            entry.entry_id = self._generate_id(entry)
+
+    def _generate_id(self, entry):
+        return self._id_generator.generate(entry,
+            lambda entry_id: self.get_shard(entry_id).has(entry_id))
+
+    def _get_sort_key(self, entry):
+        if entry.updated_at is None:
+            return 0
+
+        return entry.updated_at
+
+    def _on_shard_entry_added(self, entry_id, entry):
+        self._index_entry(entry_id, entry)
+
+        for listener in self._listeners:
+            listener.entry_added(entry_id, entry)
+
+    def _on_shard_entry_updated(self, entry_id, old_entry, entry):
+        self._index_entry(entry_id, entry)
+
+        for listener in self._listeners:
+            listener.entry_updated(entry_id, old_entry, entry)
+
+    def _on_shard_entry_refreshed(self, entry_id, entry):
+        self._index_entry(entry_id, entry)
+
+        for listener in self._listeners:
+            listener.entry_refreshed(entry_id, entry)
+
+    def _on_shard_entry_removed(self, entry_id, entry):
+        self._unindex_entry(entry_id)
+
+        for listener in self._listeners:
+            listener.entry_removed(entry_id, entry)
+
+def create_json_file_shards(shard_num, max_size = None, path = '.cache', file_name = 'data.json',
+        **kwargs):
+    """Create shards persisted in their own local JSON files, named after file_name.
+
+    Without max_size, the shards do not evict on their own and leave it to the limits of the
+    sharded container. Extra keyword arguments are passed to JSONFileDictDataPersistence.
+    """
+    stem, extension = os.path.splitext(file_name)
+
+    return [JSONFileDictDataPersistence(max_size, path = path,
+        file_name = stem + "." + str(shard_index) + extension, **kwargs)
+        for shard_index in range(shard_num)]
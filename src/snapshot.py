@@ -0,0 +1,210 @@
+"""Crash-safe JSON snapshot files."""
+import json
+import logging
+import os
+from pathlib import Path
+from time import monotonic
+
+from src.json_compatible import to_json_default
+
+_LOGGER = logging.getLogger(__name__)
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+
+class FsyncPolicy:
+    """Decide when written files should be synced to the disk."""
+
+    def __init__(self, policy = FSYNC_INTERVAL, interval = 5):
+        """Initialize fsync policy instance."""
+
+        if policy not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("Unknown fsync policy: " + str(policy))
+
+        self._policy = policy
+        self._interval = interval
+        self._synced_at = None
+
+    def should_sync(self):
+        """Check if the write happening now should be synced."""
+
+        if self._policy == FSYNC_ALWAYS:
+            return True
+
+        if self._policy == FSYNC_NEVER:
+            return False
+
+        return self._synced_at is None or monotonic() - self._synced_at >= self._interval
+
+    def synced(self):
+        """Mark a sync has just happened."""
+        self._synced_at = monotonic()
+
+    def sync(self, file, force = False):
+        """Flush and sync an open file if the policy asks for it, return whether it was synced."""
+        file.flush()
+
+        if not force and not self.should_sync():
+            return False
+
+        os.fsync(file.fileno())
+        self.synced()
+
+        return True
+
+class SnapshotFile:
+    """JSON snapshot written as numbered generations.
+
+    Each save writes "<file_name>.<generation>" through a temporary file renamed into place, so a
+    crash never leaves a truncated current snapshot. Loading falls back to older generations, and
+    finally to a legacy "<file_name>", when the newest one can not be read.
+    """
+
+    # pylint: disable = too-many-arguments
+    def __init__(self, path, file_name, fsync_policy = FSYNC_INTERVAL, fsync_interval = 5,
+            keep_generations = 2):
+        """Initialize snapshot file instance."""
+
+        self._path = Path(path)
+        self._file_name = file_name
+        self._fsync_policy = FsyncPolicy(fsync_policy, fsync_interval)
+        self._keep_generations = max(keep_generations, 1)
+        self._generation = 0
+        self._synced_generation = 0
+        self._loaded_generation = None
+
+    @property
+    def generation(self):
+        """Generation number of the last saved or loaded snapshot."""
+        return self._generation
+
+    def load(self):
+        """Load the newest readable snapshot, or None if there is none."""
+        generations = self._list_generations()
+
+        if generations:
+            self._generation = generations[0]
+
+        for generation in generations + [0]:
+            try:
+                with self._get_file_path(generation).open() as file:
+                    json_data = json.load(file)
+            except FileNotFoundError:
+                continue
+            except (PermissionError, json.decoder.JSONDecodeError, UnicodeDecodeError) as err:
+                _LOGGER.warning("Can not read snapshot %s, falling back to the previous one: %s",
+                    self._get_file_path(generation), err)
+
+                continue
+
+            if generation != self._generation:
+                _LOGGER.warning("Recovered data from snapshot %s.", self._get_file_path(generation))
+
+            # Newer generations are unreadable, so pruning must keep the one actually loaded.
+            self._synced_generation = generation
+            self._loaded_generation = generation
+
+            return json_data
+
+        if generations:
+            _LOGGER.error("No readable snapshot of %s found, starting empty.",
+                self._path / self._file_name)
+
+        return None
+
+    def load_fallbacks(self):
+        """Load the readable generations other than the loaded one, newest first."""
+        fallbacks = []
+
+        for generation in self._list_generations():
+            if generation == self._loaded_generation:
+                continue
+
+            try:
+                with self._get_file_path(generation).open() as file:
+                    fallbacks.append(json.load(file))
+            except (FileNotFoundError, PermissionError, json.decoder.JSONDecodeError,
+                    UnicodeDecodeError):
+                continue
+
+        return fallbacks
+
+    def save(self, json_data, force_sync = False):
+        """Write the data as a new generation, force_sync overrides the fsync policy."""
+        self._prepare_path()
+
+        generation = self._generation + 1
+        file_path = self._get_file_path(generation)
+        temp_file_path = file_path.with_name(file_path.name + ".tmp")
+
+        with temp_file_path.open('w') as file:
+            json.dump(json_data, file, default = to_json_default)
+            synced = self._fsync_policy.sync(file, force_sync)
+
+        os.replace(str(temp_file_path), str(file_path))
+        self._generation = generation
+
+        if synced:
+            self._sync_directory()
+            self._synced_generation = generation
+
+        self._prune()
+
+    def _get_file_path(self, generation):
+        if generation == 0:
+            return self._path / self._file_name
+
+        return self._path / (self._file_name + "." + str(generation))
+
+    def _list_generations(self):
+        """List existing generation numbers, newest first."""
+        prefix = self._file_name + "."
+        generations = []
+
+        try:
+            file_names = os.listdir(str(self._path))
+        except FileNotFoundError:
+            return generations
+
+        for file_name in file_names:
+            if file_name.startswith(prefix) and file_name[len(prefix):].isdigit():
+                generations.append(int(file_name[len(prefix):]))
+
+        return sorted(generations, reverse = True)
+
+    def _prune(self):
+        """Remove old generations, always keeping the newest synced one."""
+        kept = set(self._list_generations()[:self._keep_generations])
+        kept.add(self._synced_generation)
+
+        for generation in self._list_generations() + [0]:
+            if generation in kept:
+                continue
+
+            try:
+                self._get_file_path(generation).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _prepare_path(self):
+        if not self._path.exists():
+            try:
+                self._path.mkdir()
+            except FileExistsError:
+                pass
+
+    def _sync_directory(self):
+        """Make the rename durable."""
+
+        try:
+            directory = os.open(str(self._path), os.O_RDONLY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(directory)
+        except OSError:
+            pass
+        finally:
+            os.close(directory)
@@ -1,147 +1,350 @@
 """Classes for file storage."""
 
-import os
-from time import time
-from io import BytesIO
-from pathlib import PurePath
-from asyncio import iscoroutine
+import hashlib
+from collections import Counter
+from pathlib import Path, PurePath
+from asyncio import Lock, Semaphore, ensure_future, gather, get_running_loop, iscoroutine, \
+    shield, wait
+import threading
 
 from singleton_decorator import singleton
 from aiofiles import os as aioos
 import aiofiles
 
+from src.lru_cache import LRUCache
+from src.snapshot import FSYNC_INTERVAL, SnapshotFile
+from src.write_behind import WriteBehind
+
+def get_file_key(path, name):
+    """Get the key of a file in the index of a content-addressed storage."""
+    return path + "/" + name
+
 class Storage:
     """Base class for file storage."""
 
-    def put(self, path, name, force = False):
+    class Listener:
+        """Listener notified after the files of the storage change."""
+
+        def file_put(self, path, name):
+            """Handle a put file."""
+
+        def file_deleted(self, path, name):
+            """Handle a deleted file."""
+
+    def __init__(self):
+        """Initialize storage instance."""
+        self._listeners = []
+        self._write_locks = {}
+
+    def add_listener(self, listener):
+        """Notify the listener about changes of the files."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop notifying the listener."""
+        self._listeners.remove(listener)
+
+    async def put(self, path, name, file, force = False):
         """Put new file to the storage or update existing file."""
         raise NotImplementedError()
 
-    def get(self, path, name):
+    def get(self, path, name, chunk_size = 64 << 10):
         """Get file from the storage."""
         raise NotImplementedError()
 
-    def delete(self, path, name):
+    async def delete(self, path, name):
         """Remove file from the storage."""
         raise NotImplementedError()
 
+    def _get_write_lock(self, key):
+        """Get the lock serializing the writes of a file."""
+        write_lock = self._write_locks.get(key)
+
+        if write_lock is None:
+            write_lock = self._write_locks[key] = WriteLock(self._write_locks, key)
+
+        return write_lock
+
 file_not_existing_error = RuntimeError("File not existing.")
 
+class WriteLock:
+    """Lock of a file, dropped from the lock dict once nobody holds or waits for it."""
+
+    def __init__(self, locks, key):
+        self._locks = locks
+        self._key = key
+        self._lock = Lock()
+        self._user_num = 0
+
+    async def __aenter__(self):
+        self._user_num += 1
+
+        try:
+            await self._lock.acquire()
+        except BaseException:
+            self._release_user()
+
+            raise
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self._lock.release()
+        self._release_user()
+
+    def _release_user(self):
+        self._user_num -= 1
+
+        if self._user_num == 0 and self._locks.get(self._key) is self:
+            del self._locks[self._key]
+
+class FileStream:
+    """Async stream over a file content in memory or on the disk.
+
+    Supports read(size), byte range reads and async iteration over chunks of chunk_size. Disk
+    files are opened on the first read and closed once the end is reached, and on_read gets the
+    content of whole file reads.
+    """
+
+    def __init__(self, file_path, file_content = None, on_read = None, chunk_size = 64 << 10):
+        self._file_path = file_path
+        self._file_content = file_content
+        self._on_read = on_read
+        self._chunk_size = chunk_size
+        self._file = None
+        self._position = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self.read(self._chunk_size)
+
+        if not chunk:
+            raise StopAsyncIteration()
+
+        return chunk
+
+    def seek(self, position):
+        """Set current position."""
+        self._position = position
+
+    def tell(self):
+        """Get current position."""
+        return self._position
+
+    async def read(self, size = -1):
+        """Read up to size bytes from current position, or the rest of the file."""
+        rest = size is None or size < 0
+
+        if self._file_content is not None:
+            end = None if rest else self._position + size
+            chunk = self._file_content[self._position:end]
+            self._position += len(chunk)
+
+            return chunk
+
+        if self._file is None:
+            try:
+                self._file = await aiofiles.open(self._file_path, 'rb')
+            except FileNotFoundError as err:
+                raise file_not_existing_error from err
+
+        whole = rest and self._position == 0
+
+        await self._file.seek(self._position)
+        chunk = await self._file.read(-1 if rest else size)
+        self._position += len(chunk)
+
+        if rest or len(chunk) < size:
+            await self.close()
+
+        if whole and self._on_read is not None:
+            self._on_read(chunk)
+
+        return chunk
+
+    async def read_range(self, start, end = None):
+        """Read the bytes from start up to end, or up to the end of the file."""
+        self.seek(start)
+
+        return await self.read(-1 if end is None else max(end - start, 0))
+
+    async def close(self):
+        """Close the disk file if opened."""
+
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
 @singleton
-class FSStorage:
-    """Class for local file system storage."""
+class FSStorage(Storage):
+    """Class for local file system storage.
+
+    Files are served from an LRU read cache of at most cache_max_bytes, filled by put and by reads
+    from the disk. Files being written are served from memory until the write is done.
+
+    Created directories are remembered, and no file system call blocks the event loop: existence
+    checks are left to the non-blocking open, write and remove calls which fail when needed.
+    """
+
+    def __init__(self, path = '.cache', cache_max_bytes = 16 << 20):
+        super().__init__()
 
-    def __init__(self, path = '.cache'):
         self._base_data_path = path
-        self._cache = {}
-        self._awaitables = {}
-        self._updated_at = time()
+        self._cache = LRUCache(cache_max_bytes)
+        self._writing = {}
+        self._generations = {}
+        self._known_directories = set()
+
+    @property
+    def cache_stats(self):
+        """Counters of the read cache."""
+        return self._cache.stats
 
     async def put(self, path, name, file, force = False):
         """Put new file to the storage or update existing file."""
+        await self._put(path, name, file, force)
 
-        updated_at = time()
-        self._updated_at = updated_at
-
-        file_content = file.read()
+    async def put_many(self, files, force = False, max_concurrent_num = 8):
+        """Put (path, name, file) items, return None for each stored file or the error.
 
-        if iscoroutine(file_content):
-            file_content = await file_content
+        Each directory is created once for the whole batch, and at most max_concurrent_num files
+        are written at the same time.
+        """
+        files = list(files)
+        directories = {}
 
-        key = path + "_" + name
-        self._cache[key] = BytesIO(file_content)
+        for path in {path for path, _, _ in files}:
+            directories[path] = await self._prepare_path(path)
 
-        file_path = await self._prepare_path(path) / name
+        async def put(path, name, file):
+            await self._put(path, name, file, force, directories[path])
 
-        if not force and os.path.exists(str(file_path)):
-            raise RuntimeError("File already existing.")
+        return await self._run_many(put, files, max_concurrent_num)
 
-        try:
-            async with aiofiles.open(str(file_path), 'wb') as storage_file:
-                awaitable = storage_file.write(file_content)
-                self._awaitables[key] = awaitable
+    async def get_many(self, files, max_concurrent_num = 8):
+        """Read the content of (path, name) items, return the content of each file or the error."""
 
-                await awaitable
-        except IOError:
-            pass
+        async def get(path, name):
+            return await self.get(path, name).read()
 
-        if key in self._awaitables:
-            del self._awaitables[key]
+        return await self._run_many(get, files, max_concurrent_num)
 
-        if updated_at == self._updated_at:
-            del self._cache[key]
+    async def delete_many(self, files, max_concurrent_num = 8):
+        """Remove (path, name) items, return whether each file was removed or the error."""
+        return await self._run_many(self.delete, files, max_concurrent_num)
 
-    def get(self, path, name):
-        """Get file from the storage."""
-        file = self._cache.get(path + "_" + name, None)
+    async def _run_many(self, operation, items, max_concurrent_num):
+        """Run an operation on each item with bounded concurrency, errors are returned in place."""
+        semaphore = Semaphore(max_concurrent_num)
 
-        class Aiofile(aiofiles.threadpool.binary.AsyncBufferedIOBase):
-            """Fake Async file."""
+        async def run(item):
+            async with semaphore:
+                try:
+                    return await operation(*item)
+                except (RuntimeError, OSError) as err:
+                    return err
 
-            def __init__(self, file_path, file = None):
-                super().__init__(file, None, None)
+        return await gather(*[run(item) for item in items])
 
-                self._file_path = file_path
-                self._file = file
-                self._seek = 0
+    # pylint: disable = too-many-arguments
+    async def _put(self, path, name, file, force = False, directory = None):
+        file_content = file.read()
 
-            def seek(self, position):
-                """Set current position."""
-                self._seek = position
+        if iscoroutine(file_content):
+            file_content = await file_content
 
-                if self._file is not None:
-                    self._file.seek(position)
+        key = (path, name)
+        self._writing[key] = file_content
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._cache.put(key, file_content)
 
-            async def read(self):
-                """Read file content."""
-                if self._file:
-                    file_content = self._file.read()
+        try:
+            async with self._get_write_lock(key):
+                if directory is None:
+                    directory = await self._prepare_path(path)
 
-                    del self._file
+                try:
+                    await self._write_file(directory / name, file_content, force)
+                except FileNotFoundError:
+                    # The directory was removed behind the cache of known directories.
+                    self._forget_path(path)
+                    directory = await self._prepare_path(path)
 
-                    if iscoroutine(file_content):
-                        return await file_content
+                    await self._write_file(directory / name, file_content, force)
 
-                    return file_content
+                for listener in self._listeners:
+                    listener.file_put(path, name)
+        except (RuntimeError, OSError):
+            if self._writing.get(key) is file_content:
+                self._cache.invalidate(key)
 
-                if not os.path.exists(self._file_path):
-                    raise file_not_existing_error
+            raise
+        finally:
+            if self._writing.get(key) is file_content:
+                del self._writing[key]
 
-                async with aiofiles.open(self._file_path, 'rb') as file:
-                    file.seek(self._seek)
+    def get(self, path, name, chunk_size = 64 << 10):
+        """Get file from the storage as a stream."""
+        key = (path, name)
+        file_content = self._writing.get(key)
 
-                    return await file.read()
+        if file_content is None:
+            file_content = self._cache.get(key)
 
         file_path_str = str(PurePath(self._base_data_path + "/" + path + "/" + name))
 
-        if file is not None:
-            return Aiofile(file_path_str, file)
+        if file_content is not None:
+            return FileStream(file_path_str, file_content, chunk_size = chunk_size)
 
-        if not os.path.exists(file_path_str):
-            raise file_not_existing_error
+        writing = self._writing
+        generations = self._generations
+        generation = generations.get(key, 0)
+        cache = self._cache
 
-        return Aiofile(file_path_str, None)
+        def on_read(file_content):
+            # The file may have been put or deleted while it was read.
+            if key not in writing and generations.get(key, 0) == generation:
+                cache.put(key, file_content)
+
+        return FileStream(file_path_str, on_read = on_read, chunk_size = chunk_size)
 
     async def delete(self, path, name):
         """Remove file from the storage."""
-        self._updated_at = time()
+        key = (path, name)
+
+        self._cache.invalidate(key)
 
-        key = path + "_" + name
+        async with self._get_write_lock(key):
+            try:
+                await aioos.remove(str(PurePath(self._base_data_path + "/" + path + "/" + name)))
+            except FileNotFoundError:
+                self._forget_path(path)
 
-        if key in self._awaitables:
-            self._awaitables[key].cancel()
-            del self._awaitables[key]
-            del self._cache[key]
+                return False
+            finally:
+                # Reads finished meanwhile may have cached the file, later ones must not.
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._cache.invalidate(key)
 
+            for listener in self._listeners:
+                listener.file_deleted(path, name)
 
             return True
 
-        try:
-            await aioos.remove(str(PurePath(self._base_data_path + "/" + path + "/" + name)))
+    async def _write_file(self, file_path, file_content, force):
+        """Write a file, creating it exclusively unless forced instead of checking it first."""
 
-            return True
-        except FileNotFoundError:
-            return False
+        try:
+            async with aiofiles.open(str(file_path), 'wb' if force else 'xb') as storage_file:
+                await storage_file.write(file_content)
+        except FileExistsError as err:
+            raise RuntimeError("File already existing.") from err
 
     async def _prepare_path(self, path):
         """Create directory if not exisits."""
@@ -149,11 +352,272 @@ class FSStorage:
 
         for sub_path in [self._base_data_path] + path.split("/"):
             current_path = current_path / sub_path
+            current_path_str = str(current_path)
 
-            if not os.path.exists(str(current_path)):
+            if current_path_str not in self._known_directories:
                 try:
-                    await aioos.mkdir(str(current_path))
+                    await aioos.mkdir(current_path_str)
                 except FileExistsError:
                     pass
 
+                self._known_directories.add(current_path_str)
+
         return current_path
+
+    def _forget_path(self, path):
+        """Drop the directories of a path from the known ones, as they may have been removed."""
+        current_path = PurePath(".")
+
+        for sub_path in [self._base_data_path] + path.split("/"):
+            current_path = current_path / sub_path
+            self._known_directories.discard(str(current_path))
+
+@singleton
+class ContentAddressedStorage(Storage):
+    """Storage keeping each distinct file content once.
+
+    Contents are stored as blobs named by their SHA-256 digest and counted by reference, and an
+    index snapshot maps (path, name) to blobs. Putting a content already stored only updates the
+    index, and a blob is removed once no name refers to it anymore, after an index not referring
+    to it has been synced, so a crash never leaves a saved index referring to a removed blob.
+
+    Blobs not referred to by the loaded index, left by interrupted puts, are removed in an executor
+    before the first change.
+    """
+
+    # pylint: disable = too-many-arguments
+    # pylint: disable = too-many-instance-attributes
+    def __init__(self, path = '.cache', cache_max_bytes = 16 << 20, index_file_name = 'blobs.json',
+            write_debounce = .05, write_max_staleness = 1, fsync_policy = FSYNC_INTERVAL,
+            fsync_interval = 5):
+        super().__init__()
+
+        self._base_data_path = path
+        self._blob_path = Path(path) / "blobs"
+        self._cache = LRUCache(cache_max_bytes)
+        self._blob_generations = {}
+        self._snapshot_file = SnapshotFile(path, index_file_name, fsync_policy, fsync_interval)
+        self._index = self._snapshot_file.load() or {}
+        self._index_lock = threading.Lock()
+        self._index_sync = None
+        self._next_index_sync = None
+        self._ref_nums = Counter(self._index.values())
+        self._deduplicated_num = 0
+        self._writer = WriteBehind(self._write_index, write_debounce, write_max_staleness)
+        self._orphan_removal = None
+
+        try:
+            self._start_orphan_removal()
+        except RuntimeError:
+            # No running event loop, the orphans are removed before the first change.
+            pass
+
+    @property
+    def stats(self):
+        """Numbers of files, blobs and puts of contents already stored."""
+
+        return {
+            "files": len(self._index),
+            "blobs": len(self._ref_nums),
+            "deduplicated": self._deduplicated_num,
+        }
+
+    @property
+    def cache_stats(self):
+        """Counters of the read cache."""
+        return self._cache.stats
+
+    async def put(self, path, name, file, force = False):
+        """Put new file to the storage or update existing file."""
+
+        file_content = file.read()
+
+        if iscoroutine(file_content):
+            file_content = await file_content
+
+        key = get_file_key(path, name)
+        digest = hashlib.sha256(file_content).hexdigest()
+
+        await self._wait_orphan_removal()
+
+        async with self._get_write_lock(key):
+            old_digest = self._index.get(key)
+
+            if old_digest is not None and not force:
+                raise RuntimeError("File already existing.")
+
+            async with self._get_write_lock(digest):
+                if self._ref_nums[digest] > 0 and await self._blob_exists(digest):
+                    self._deduplicated_num += 1
+                else:
+                    await self._write_blob(digest, file_content)
+
+                self._ref_nums[digest] += 1
+
+            self._cache.put(digest, file_content)
+            self._index[key] = digest
+            self._writer.mark_dirty()
+
+            if old_digest is not None:
+                await self._release_blob(old_digest)
+
+            for listener in self._listeners:
+                listener.file_put(path, name)
+
+    def get(self, path, name, chunk_size = 64 << 10):
+        """Get file from the storage as a stream."""
+        digest = self._index.get(get_file_key(path, name))
+
+        if digest is None:
+            raise file_not_existing_error
+
+        file_content = self._cache.get(digest)
+        blob_path_str = str(self._get_blob_path(digest))
+
+        if file_content is not None:
+            return FileStream(blob_path_str, file_content, chunk_size = chunk_size)
+
+        ref_nums = self._ref_nums
+        blob_generations = self._blob_generations
+        generation = blob_generations.get(digest, 0)
+        cache = self._cache
+
+        def on_read(file_content):
+            # The blob may have been removed while it was read.
+            if ref_nums[digest] > 0 and blob_generations.get(digest, 0) == generation:
+                cache.put(digest, file_content)
+
+        return FileStream(blob_path_str, on_read = on_read, chunk_size = chunk_size)
+
+    async def delete(self, path, name):
+        """Remove file from the storage."""
+        key = get_file_key(path, name)
+
+        await self._wait_orphan_removal()
+
+        async with self._get_write_lock(key):
+            digest = self._index.pop(key, None)
+
+            if digest is None:
+                return False
+
+            self._writer.mark_dirty()
+            await self._release_blob(digest)
+
+            for listener in self._listeners:
+                listener.file_deleted(path, name)
+
+            return True
+
+    def flush(self):
+        """Save the index."""
+        self._writer.flush()
+
+    async def async_flush(self):
+        """Save the index without blocking the event loop."""
+        await self._wait_orphan_removal()
+        await self._writer.async_flush()
+
+    def _get_blob_path(self, digest):
+        return self._blob_path / digest[:2] / digest
+
+    async def _write_blob(self, digest, file_content):
+        """Write a blob through a temporary file, so a crash never leaves a truncated one."""
+        blob_path = self._get_blob_path(digest)
+        temp_blob_path = blob_path.with_name(blob_path.name + ".tmp")
+
+        for directory in [self._blob_path.parent, self._blob_path, blob_path.parent]:
+            try:
+                await aioos.mkdir(str(directory))
+            except FileExistsError:
+                pass
+
+        async with aiofiles.open(str(temp_blob_path), 'wb') as blob_file:
+            await blob_file.write(file_content)
+
+        await aioos.rename(str(temp_blob_path), str(blob_path))
+
+    async def _blob_exists(self, digest):
+        try:
+            await aioos.stat(str(self._get_blob_path(digest)))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    async def _release_blob(self, digest):
+        """Drop a reference to a blob, removing the blob once it is not referred to."""
+
+        async with self._get_write_lock(digest):
+            self._ref_nums[digest] -= 1
+
+            if self._ref_nums[digest] > 0:
+                return
+
+            del self._ref_nums[digest]
+
+        try:
+            await self._sync_index()
+        except OSError:
+            # The blob is left to the orphan removal of the next load.
+            return
+
+        async with self._get_write_lock(digest):
+            if self._ref_nums[digest] > 0:
+                # Put again while the index was saved.
+                return
+
+            try:
+                await aioos.remove(str(self._get_blob_path(digest)))
+            except FileNotFoundError:
+                pass
+            finally:
+                self._blob_generations[digest] = self._blob_generations.get(digest, 0) + 1
+                self._cache.invalidate(digest)
+
+    def _write_index(self, force_sync = False):
+        """Write the index, called from the writer thread or an executor."""
+
+        with self._index_lock:
+            self._snapshot_file.save(dict(self._index), force_sync)
+
+    async def _sync_index(self):
+        """Write and sync the index as it is now, sharing the write with the callers meanwhile."""
+
+        if self._next_index_sync is None:
+            self._next_index_sync = ensure_future(self._run_index_sync(self._index_sync))
+
+        await shield(self._next_index_sync)
+
+    async def _run_index_sync(self, previous_index_sync):
+        if previous_index_sync is not None:
+            await wait([previous_index_sync])
+
+        # Callers from now on need a write starting after their change.
+        self._index_sync = self._next_index_sync
+        self._next_index_sync = None
+
+        await get_running_loop().run_in_executor(None, self._write_index, True)
+
+    def _start_orphan_removal(self):
+        if self._orphan_removal is None:
+            self._orphan_removal = get_running_loop().run_in_executor(None,
+                self._remove_orphan_blobs)
+
+    async def _wait_orphan_removal(self):
+        self._start_orphan_removal()
+
+        await shield(self._orphan_removal)
+
+    def _remove_orphan_blobs(self):
+        """Remove the blobs not referred to by the loaded index, left by interrupted puts."""
+
+        if not self._blob_path.exists():
+            return
+
+        for blob_path in self._blob_path.glob("*/*"):
+            if blob_path.name not in self._ref_nums:
+                try:
+                    blob_path.unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,164 @@
+"""Background writer coalescing write requests."""
+import asyncio
+import atexit
+import logging
+import threading
+from time import monotonic
+import weakref
+
+_LOGGER = logging.getLogger(__name__)
+
+_writers = weakref.WeakSet()
+
+@atexit.register
+def _close_writers():
+    """Write the changes still in the debounce window before the interpreter exits."""
+
+    for writer in list(_writers):
+        try:
+            writer.close()
+        except Exception: # pylint: disable = broad-except
+            _LOGGER.exception("Failed to write data at exit.")
+
+class WriteBehind:
+    """Run a write function on a single background thread, coalescing dirty notifications.
+
+    Pending changes are written when closing, and at interpreter exit for writers not closed.
+    """
+
+    # pylint: disable = too-many-instance-attributes
+
+    def __init__(self, write, debounce = .05, max_staleness = 1):
+        """Initialize write behind instance."""
+
+        self._write = write
+        self._debounce = debounce
+        self._max_staleness = max_staleness
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._writing = False
+        self._first_dirty_at = None
+        self._last_dirty_at = None
+        self._pending_num = 0
+        self._requested_num = 0
+        self._coalesced_num = 0
+        self._performed_num = 0
+
+        _writers.add(self)
+
+    @property
+    def dirty(self):
+        """Whether there are changes not written yet."""
+        return self._first_dirty_at is not None
+
+    @property
+    def stats(self):
+        """Counters of requested, coalesced and performed writes."""
+
+        with self._condition:
+            return {
+                "requested": self._requested_num,
+                "coalesced": self._coalesced_num,
+                "performed": self._performed_num,
+            }
+
+    def mark_dirty(self):
+        """Request a write, which happens after the debounce window at the latest."""
+
+        with self._condition:
+            now = monotonic()
+
+            if self._first_dirty_at is None:
+                self._first_dirty_at = now
+
+            self._last_dirty_at = now
+            self._pending_num += 1
+            self._requested_num += 1
+
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target = self._run, daemon = True)
+                self._thread.start()
+
+            self._condition.notify_all()
+
+    def flush(self):
+        """Write pending changes in the calling thread, return whether a write happened."""
+
+        with self._condition:
+            while self._writing:
+                self._condition.wait()
+
+            if self._first_dirty_at is None:
+                return False
+
+            self._begin_write()
+
+        self._perform_write(True)
+
+        return True
+
+    async def async_flush(self):
+        """Write pending changes without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def close(self):
+        """Write pending changes and stop the background thread."""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+        _writers.discard(self)
+
+    def _begin_write(self):
+        """Take over the pending notifications, the condition must be held."""
+        self._coalesced_num += self._pending_num - 1
+        self._pending_num = 0
+        self._first_dirty_at = None
+        self._last_dirty_at = None
+        self._writing = True
+
+    def _perform_write(self, raise_error):
+        try:
+            self._write()
+        except Exception: # pylint: disable = broad-except
+            if raise_error:
+                raise
+
+            _LOGGER.exception("Failed to write data in the background.")
+        finally:
+            with self._condition:
+                self._writing = False
+                self._performed_num += 1
+                self._condition.notify_all()
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                if self._first_dirty_at is None or self._writing:
+                    self._condition.wait()
+
+                    continue
+
+                deadline = min(self._last_dirty_at + self._debounce,
+                    self._first_dirty_at + self._max_staleness)
+                timeout = deadline - monotonic()
+
+                if timeout > 0:
+                    self._condition.wait(timeout)
+
+                    continue
+
+                self._begin_write()
+                self._condition.release()
+
+                try:
+                    self._perform_write(False)
+                finally:
+                    self._condition.acquire()
@@ -6,4 +6,18 @@ def pytest_configure(config):
     config.addinivalue_line("markers", "dict_data_container")
     config.addinivalue_line("markers", "dict_data_container_with_max_size")
     config.addinivalue_line("markers", "local_json_file_dict_data_persistence")
+    config.addinivalue_line("markers", "local_journal_file_dict_data_persistence")
     config.addinivalue_line("markers", "fs_storage")
+    config.addinivalue_line("markers", "eviction_index")
+    config.addinivalue_line("markers", "write_behind")
+    config.addinivalue_line("markers", "snapshot")
+    config.addinivalue_line("markers", "encoding_store")
+    config.addinivalue_line("markers", "face_index")
+    config.addinivalue_line("markers", "recognition_pipeline")
+    config.addinivalue_line("markers", "frame_filter")
+    config.addinivalue_line("markers", "lru_cache")
+    config.addinivalue_line("markers", "content_addressed_storage")
+    config.addinivalue_line("markers", "derived_storage")
+    config.addinivalue_line("markers", "id_generator")
+    config.addinivalue_line("markers", "secondary_index")
+    config.addinivalue_line("markers", "sharded_data_container")
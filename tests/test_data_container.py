@@ -1,7 +1,12 @@
 "Tests for data container module"
+import asyncio
+from time import time
+
+import numpy as np
 import pytest
 
-from src.data_container import DataContainer, DataContainerWithMaxSize, DictDataContainer, DictDataContainerWithMaxSize
+from src.data_container import EVICTION_LARGEST, EVICTION_LRU, EVICTION_OLDEST, DataContainer, DataContainerWithMaxSize, DictDataContainer, DictDataContainerWithMaxSize, get_approximate_size
+from src.id_generator import CallerIdGenerator, TimeOrderedIdGenerator
 
 @pytest.mark.data_container
 @pytest.mark.data_container_with_max_size
@@ -39,12 +44,36 @@ def dict_data_container_with_max_size(max_waiting_num, max_size):
 
 @pytest.mark.dict_data_container
 @pytest.fixture
-def data_entry():
+def data_entry_type():
     class DataEntry(DataContainerWithMaxSize.Entry):
+        def __init__(self, value = None):
+            super().__init__("data_entry")
+
+            self.value = value
+
         def destroy(self):
             pass
 
-    return DataEntry("data_entry")
+    return DataEntry
+
+@pytest.mark.dict_data_container
+@pytest.fixture
+def sized_data_entry_type(data_entry_type):
+    class SizedDataEntry(data_entry_type):
+        def __init__(self, size):
+            super().__init__()
+
+            self.size = size
+
+        def get_size(self):
+            return self.size
+
+    return SizedDataEntry
+
+@pytest.mark.dict_data_container
+@pytest.fixture
+def data_entry(data_entry_type):
+    return data_entry_type()
 
 @pytest.mark.dict_data_container
 @pytest.fixture
@@ -156,3 +185,276 @@ async def test_dict_data_container_with_max_size_wrong_entry_type(dict_data_cont
         assert False
     except TypeError as err:
         assert err.args[0] == "Entry must be of type DataContainerWithMaxSize.Entry."
+
+@pytest.mark.dict_data_container_with_max_size
+def test_dict_data_container_with_max_size_evict_oldest(data_entry_type):
+    """When exceeding the max size, the least recently updated entry should be removed."""
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(2)
+    ids = [dict_data_container_with_max_size.add(data_entry_type()) for _ in range(2)]
+
+    dict_data_container_with_max_size.get(ids[0]).updated_at = -1
+    dict_data_container_with_max_size.get(ids[1]).updated_at = -2
+    dict_data_container_with_max_size.update(ids[1], dict_data_container_with_max_size.get(ids[1]))
+
+    third_id = dict_data_container_with_max_size.add(data_entry_type())
+
+    remaining_ids = [entry.entry_id for entry in dict_data_container_with_max_size.get_all()]
+
+    assert len(remaining_ids) == 2
+    assert ids[1] not in remaining_ids
+    assert ids[0] in remaining_ids
+    assert third_id in remaining_ids
+
+@pytest.mark.dict_data_container_with_max_size
+def test_dict_data_container_with_max_size_expire(data_entry_type):
+    """When expiring, the entries older than their ttl or the container ttl should be removed."""
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8, ttl = 10)
+    ids = [dict_data_container_with_max_size.add(data_entry_type()) for _ in range(3)]
+
+    long_lived_entry = data_entry_type()
+    long_lived_entry.ttl = 100
+    long_lived_id = dict_data_container_with_max_size.add(long_lived_entry)
+
+    for entry_id, updated_at in zip(ids, [0, 5, 20]):
+        entry = dict_data_container_with_max_size.get(entry_id)
+        entry.updated_at = updated_at
+        dict_data_container_with_max_size.update(entry_id, entry)
+
+    long_lived_entry.updated_at = 0
+    dict_data_container_with_max_size.update(long_lived_id, long_lived_entry)
+
+    assert sorted(dict_data_container_with_max_size.expire(16)) == sorted(ids[:2])
+    assert dict_data_container_with_max_size.count() == 2
+    assert dict_data_container_with_max_size.expire(16) == []
+    assert sorted(dict_data_container_with_max_size.expire(101)) == sorted([ids[2], long_lived_id])
+    assert dict_data_container_with_max_size.count() == 0
+
+@pytest.mark.asyncio
+@pytest.mark.dict_data_container_with_max_size
+async def test_dict_data_container_with_max_size_expire_on_timer(data_entry_type):
+    """With a running event loop, expired entries should be removed without calling expire."""
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8, ttl = .05)
+    expiring_id = dict_data_container_with_max_size.add(data_entry_type())
+
+    kept_entry = data_entry_type()
+    kept_entry.ttl = 10
+    kept_id = dict_data_container_with_max_size.add(kept_entry)
+
+    await asyncio.sleep(.15)
+
+    assert not dict_data_container_with_max_size.has(expiring_id)
+    assert dict_data_container_with_max_size.has(kept_id)
+
+@pytest.mark.asyncio
+@pytest.mark.dict_data_container_with_max_size
+async def test_dict_data_container_with_max_size_expire_error():
+    """When an expired entry fails to be destroyed, it should be expired again later."""
+
+    class DataEntry(DataContainerWithMaxSize.Entry):
+        def __init__(self, failure_num):
+            super().__init__("data_entry")
+
+            self.failure_num = failure_num
+
+        def destroy(self):
+            if self.failure_num > 0:
+                self.failure_num -= 1
+
+                raise ValueError("Failed to destroy.")
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8, ttl = 10)
+    dict_data_container_with_max_size._expiry_retry_delay = .05
+    entry_id = dict_data_container_with_max_size.add(DataEntry(1))
+
+    with pytest.raises(ValueError):
+        dict_data_container_with_max_size.expire(time() + 11)
+
+    assert dict_data_container_with_max_size.expire(time() + 11) == [entry_id]
+
+    failing_entry = DataEntry(2)
+    failing_entry.ttl = .05
+    failing_id = dict_data_container_with_max_size.add(failing_entry)
+
+    await asyncio.sleep(.3)
+
+    assert not dict_data_container_with_max_size.has(failing_id)
+
+@pytest.mark.dict_data_container_with_max_size
+def test_dict_data_container_with_max_size_byte_budget(sized_data_entry_type):
+    """When exceeding the byte budget, entries should be evicted by the eviction policy."""
+
+    def fill(eviction_policy):
+        dict_data_container_with_max_size = DictDataContainerWithMaxSize(8, max_bytes = 100,
+            eviction_policy = eviction_policy)
+        ids = [dict_data_container_with_max_size.add(sized_data_entry_type(size))
+            for size in [20, 40, 30]]
+
+        for entry_id, updated_at in zip(ids, [3, 1, 2]):
+            dict_data_container_with_max_size.get(entry_id).updated_at = updated_at
+            dict_data_container_with_max_size.update(entry_id,
+                dict_data_container_with_max_size.get(entry_id))
+
+        assert dict_data_container_with_max_size.total_bytes == 90
+
+        return dict_data_container_with_max_size, ids
+
+    dict_data_container_with_max_size, ids = fill(EVICTION_OLDEST)
+    new_id = dict_data_container_with_max_size.add(sized_data_entry_type(20))
+
+    assert not dict_data_container_with_max_size.has(ids[1])
+    assert dict_data_container_with_max_size.total_bytes == 70
+
+    dict_data_container_with_max_size, ids = fill(EVICTION_LARGEST)
+    dict_data_container_with_max_size.add(sized_data_entry_type(20))
+
+    assert not dict_data_container_with_max_size.has(ids[1])
+
+    dict_data_container_with_max_size, ids = fill(EVICTION_LRU)
+    dict_data_container_with_max_size.get(ids[0])
+    new_id = dict_data_container_with_max_size.add(sized_data_entry_type(60))
+
+    assert [entry.entry_id for entry in dict_data_container_with_max_size.get_all()] == [ids[0], new_id]
+    assert dict_data_container_with_max_size.total_bytes == 80
+
+    grown_entry = sized_data_entry_type(200)
+    grown_entry.entry_id = new_id
+    dict_data_container_with_max_size.update(new_id, grown_entry)
+
+    assert [entry.entry_id for entry in dict_data_container_with_max_size.get_all()] == [new_id]
+    assert dict_data_container_with_max_size.total_bytes == 200
+
+    dict_data_container_with_max_size.remove(new_id)
+
+    assert dict_data_container_with_max_size.total_bytes == 0
+
+    with pytest.raises(ValueError):
+        DictDataContainerWithMaxSize(eviction_policy = "random")
+
+@pytest.mark.asyncio
+@pytest.mark.dict_data_container_with_max_size
+async def test_dict_data_container_with_max_size_byte_budget_locked(sized_data_entry_type):
+    """When updating a locked container over the byte budget with the key, entries should be evicted."""
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8, max_bytes = 100)
+    ids = [dict_data_container_with_max_size.add(sized_data_entry_type(40)) for _ in range(2)]
+
+    key = await dict_data_container_with_max_size.lock()
+
+    grown_entry = sized_data_entry_type(80)
+    grown_entry.entry_id = ids[1]
+    dict_data_container_with_max_size.update(ids[1], grown_entry, key)
+
+    assert not dict_data_container_with_max_size.has(ids[0], key)
+    assert dict_data_container_with_max_size.total_bytes == 80
+
+    dict_data_container_with_max_size.unlock(key)
+
+@pytest.mark.asyncio
+@pytest.mark.dict_data_container_with_max_size
+async def test_dict_data_container_with_max_size_get_all_sorted_locked(data_entry):
+    """When sorting entries while holding the lock, the key should grant the read."""
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8)
+    dict_data_container_with_max_size.add(data_entry)
+
+    key = await dict_data_container_with_max_size.lock()
+
+    assert dict_data_container_with_max_size.get_all_sorted(key) == [data_entry]
+
+    with pytest.raises(RuntimeError):
+        dict_data_container_with_max_size.get_all_sorted()
+
+    dict_data_container_with_max_size.unlock(key)
+
+@pytest.mark.dict_data_container_with_max_size
+def test_dict_data_container_with_max_size_untracked_sizes(mocker, data_entry_type):
+    """Without a byte budget or a size based policy, entry sizes should not be computed."""
+
+    get_size = mocker.patch.object(data_entry_type, "get_size", return_value = 10)
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8)
+    dict_data_container_with_max_size.add(data_entry_type())
+
+    assert get_size.call_count == 0
+    assert dict_data_container_with_max_size.total_bytes == 0
+
+    dict_data_container_with_max_size = DictDataContainerWithMaxSize(8,
+        eviction_policy = EVICTION_LARGEST)
+    dict_data_container_with_max_size.add(data_entry_type())
+
+    assert get_size.call_count > 0
+    assert dict_data_container_with_max_size.total_bytes == 10
+
+@pytest.mark.dict_data_container_with_max_size
+def test_get_approximate_size():
+    """The approximate size should count arrays by their bytes and shared values once."""
+
+    encodings = np.zeros((4, 128))
+    entry = DataContainerWithMaxSize.Entry("entry")
+    entry.encodings = [encodings, encodings]
+
+    assert encodings.nbytes < get_approximate_size({"a": encodings, "b": encodings}) < 2 * encodings.nbytes
+    assert encodings.nbytes < entry.get_size() < 2 * encodings.nbytes
+
+    shared_context = DataContainerWithMaxSize.Entry("context")
+    shared_context.encodings = np.zeros((64, 128))
+    entry.context = shared_context
+
+    assert entry.get_size() < 2 * encodings.nbytes
+
+@pytest.mark.dict_data_container
+def test_dict_data_container_id_generator(data_entry):
+    """When adding entries without id, the id generator of the container should give them ids."""
+
+    dict_data_container = DictDataContainer(id_generator = TimeOrderedIdGenerator())
+    ids = [dict_data_container.add(DataContainerWithMaxSize.Entry("entry")) for _ in range(5)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 5
+
+    dict_data_container = DictDataContainer(id_generator = CallerIdGenerator())
+
+    with pytest.raises(RuntimeError):
+        dict_data_container.add(data_entry)
+
+    data_entry.entry_id = "given"
+
+    assert dict_data_container.add(data_entry) == "given"
+
+@pytest.mark.dict_data_container
+def test_dict_data_container_iterate_and_page(mocker, data_entry_type):
+    """When iterating, counting and paging entries, they should follow the live entries."""
+
+    detach = mocker.spy(DictDataContainer.IdIterator, "detach")
+    dict_data_container = DictDataContainer()
+    view = dict_data_container.view()
+    ids = [dict_data_container.add(data_entry_type(value)) for value in range(10)]
+
+    def is_even(entry):
+        return entry.value % 2 == 0
+
+    assert [entry.value for entry in dict_data_container.iter_entries(is_even)] == [0, 2, 4, 6, 8]
+    assert dict_data_container.count() == 10
+    assert dict_data_container.count(is_even) == 5
+    assert [entry.value for entry in dict_data_container.page(3, 4)] == [3, 4, 5, 6]
+    assert [entry.value for entry in dict_data_container.page(1, 10, is_even)] == [2, 4, 6, 8]
+
+    dict_data_container.remove(ids[0])
+
+    assert len(view) == 9
+    assert ids[0] not in view
+    assert view[ids[1]].value == 1
+    assert [entry.value for entry in view][:2] == [1, 2]
+    assert detach.call_count == 0
+
+    entries = dict_data_container.iter_entries()
+
+    assert next(entries).value == 1
+
+    dict_data_container.remove(ids[2])
+    dict_data_container.add(data_entry_type(10))
+
+    assert [entry.value for entry in entries] == [3, 4, 5, 6, 7, 8, 9]
+    assert detach.call_count == 1
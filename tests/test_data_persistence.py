@@ -3,12 +3,15 @@ from pathlib import Path
 import asyncio
 import json
 from shutil import rmtree
+from time import time
 
+import numpy as np
 import pytest
 import singleton_decorator
 
 from src.data_container import DataContainerWithMaxSize
-from src.data_persistence import LocalJSONFileDictDataPersistence
+from src.encoding_store import EncodingStore
+from src.data_persistence import LocalFileDictDataPersistence, LocalJSONFileDictDataPersistence, LocalJournalFileDictDataPersistence
 
 @pytest.mark.local_json_file_dict_data_persistence
 @pytest.fixture(scope="module")
@@ -34,6 +37,58 @@ def json_data_persistence(request, max_size, max_waiting_num):
 
     return json_data_persistence
 
+@pytest.mark.local_journal_file_dict_data_persistence
+@pytest.fixture
+def journal_data_persistence_factory(request, max_size, max_waiting_num, monkeypatch, JournalItem):
+    monkeypatch.setattr(LocalFileDictDataPersistence, "_get_entry_class", lambda self, json_object: JournalItem)
+
+    def create(**kwargs):
+        LocalJournalFileDictDataPersistence._instance = None
+
+        return LocalJournalFileDictDataPersistence(max_size, max_waiting_num, **kwargs)
+
+    def fin():
+        LocalJournalFileDictDataPersistence._instance = None
+        rmtree('.cache', ignore_errors = True)
+
+    request.addfinalizer(fin)
+
+    return create
+
+@pytest.mark.local_journal_file_dict_data_persistence
+@pytest.fixture
+def JournalItem():
+    class JournalItem(DataContainerWithMaxSize.Entry):
+        hydrated_num = 0
+
+        @classmethod
+        def from_json(cls, json_object):
+            cls.hydrated_num += 1
+
+            entry = cls(json_object["value"], json_object.get("encodings"))
+            entry.entry_id = json_object["entry_id"]
+
+            return entry
+
+        def __init__(self, value, encodings = None):
+            super().__init__("journal_item")
+
+            self.value = value
+            self.encodings = encodings
+
+        def to_json(self):
+            json_object = {"_type": self._type, "entry_id": self.entry_id, "value": self.value}
+
+            if self.encodings is not None:
+                json_object["encodings"] = self.encodings
+
+            return json_object
+
+        def destroy(self):
+            pass
+
+    return JournalItem
+
 @pytest.mark.local_json_file_dict_data_persistence
 @pytest.fixture
 def DataPersistenceItem():
@@ -48,6 +103,9 @@ def DataPersistenceItem():
         def to_json(self):
             return self.entry_id
 
+        def destroy(self):
+            pass
+
     return DataPersistenceItem
 
 @pytest.mark.local_json_file_dict_data_persistence
@@ -116,3 +174,240 @@ async def test_json_data_persistence_wrong_entry_type(json_data_persistence):
         assert False
     except TypeError as err:
         assert err.args[0] == "Entry must be of type DataContainer.Entry."
+
+@pytest.mark.asyncio
+@pytest.mark.local_json_file_dict_data_persistence
+async def test_json_data_persistence_coalesce_writes(json_data_persistence, DataPersistenceItem):
+    """When mutating the data in a burst, the writes should be coalesced and flushed on demand."""
+
+    ids = [json_data_persistence.add(DataPersistenceItem()) for _ in range(20)]
+
+    json_data_persistence.remove(ids[0])
+
+    await json_data_persistence.async_flush()
+
+    write_stats = json_data_persistence.write_stats
+
+    assert write_stats["requested"] == 21
+    assert write_stats["performed"] < write_stats["requested"]
+    assert write_stats["coalesced"] + write_stats["performed"] == write_stats["requested"]
+
+    snapshot_file_name = json_data_persistence._file_name + "." + str(json_data_persistence.generation)
+
+    with (Path(json_data_persistence._data_path) / snapshot_file_name).open() as file:
+        assert sorted(json.load(file).keys()) == sorted(ids[1:])
+
+    json_data_persistence.flush()
+
+    assert json_data_persistence.write_stats["performed"] == write_stats["performed"]
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence(journal_data_persistence_factory, JournalItem):
+    """When reopening the journal persistence, the snapshot and the journal should be replayed."""
+
+    journal_data_persistence = journal_data_persistence_factory()
+
+    id_a = journal_data_persistence.add(JournalItem("a"))
+    id_b = journal_data_persistence.add(JournalItem("b"))
+    id_c = journal_data_persistence.add(JournalItem("c"))
+    journal_data_persistence.update(id_b, JournalItem("b1"))
+    journal_data_persistence.remove(id_c)
+
+    await journal_data_persistence.async_flush()
+
+    with (Path(".cache") / "data.journal").open() as file:
+        assert [json.loads(line)["op"] for line in file] == ["put", "put", "put", "put", "remove"]
+
+    assert journal_data_persistence.compaction_num == 0
+
+    new_journal_data_persistence = journal_data_persistence_factory()
+
+    assert sorted(new_journal_data_persistence._data.keys()) == sorted([id_a, id_b])
+    assert new_journal_data_persistence.get(id_a).value == "a"
+    assert new_journal_data_persistence.get(id_b).value == "b1"
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_expire(journal_data_persistence_factory, JournalItem):
+    """When entries expire together, their removals should be appended in one batch."""
+
+    journal_data_persistence = journal_data_persistence_factory(ttl = 10)
+    ids = [journal_data_persistence.add(JournalItem(i)) for i in range(3)]
+
+    long_lived_item = JournalItem(3)
+    long_lived_item.ttl = 100
+    ids.append(journal_data_persistence.add(long_lived_item))
+
+    await journal_data_persistence.async_flush()
+
+    requested_num = journal_data_persistence.write_stats["requested"]
+
+    assert sorted(journal_data_persistence.expire(time() + 20)) == sorted(ids[:3])
+    assert journal_data_persistence.write_stats["requested"] == requested_num + 1
+
+    await journal_data_persistence.async_flush()
+
+    with (Path(".cache") / "data.journal").open() as file:
+        assert [json.loads(line)["op"] for line in file] == ["put"] * 4 + ["remove"] * 3
+
+    new_journal_data_persistence = journal_data_persistence_factory()
+
+    assert list(new_journal_data_persistence._data.keys()) == [ids[3]]
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_compact(journal_data_persistence_factory, JournalItem):
+    """When the journal crosses the size threshold, it should be compacted into the snapshot."""
+
+    journal_data_persistence = journal_data_persistence_factory(compact_size = 1024)
+    ids = []
+
+    for i in range(40):
+        ids.append(journal_data_persistence.add(JournalItem(i)))
+        journal_data_persistence.flush()
+
+    journal_data_persistence.remove(ids[0])
+    journal_data_persistence.flush()
+
+    assert journal_data_persistence.compaction_num > 0
+    assert (Path(".cache") / "data.journal").stat().st_size < 1024
+
+    with (Path(".cache") / "data.journal").open("a") as file:
+        file.write('{"op": "remove", "id": "')
+
+    new_journal_data_persistence = journal_data_persistence_factory(compact_size = 1024)
+
+    assert sorted(new_journal_data_persistence._data.keys()) == sorted(ids[1:])
+    assert new_journal_data_persistence.get(ids[39]).value == 39
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_lazy_load(journal_data_persistence_factory, JournalItem):
+    """When loading lazily, entries should only be created once they are read or warmed up."""
+
+    journal_data_persistence = journal_data_persistence_factory()
+    ids = [journal_data_persistence.add(JournalItem(i)) for i in range(5)]
+
+    await journal_data_persistence.async_flush()
+
+    JournalItem.hydrated_num = 0
+    lazy_journal_data_persistence = journal_data_persistence_factory(lazy_load = True)
+
+    assert JournalItem.hydrated_num == 0
+    assert lazy_journal_data_persistence.has(ids[0])
+    assert lazy_journal_data_persistence.get(ids[0]).value == 0
+    assert isinstance(lazy_journal_data_persistence.get(ids[0]), JournalItem)
+    assert JournalItem.hydrated_num == 1
+
+    lazy_journal_data_persistence.remove(ids[1])
+
+    assert JournalItem.hydrated_num == 2
+
+    await lazy_journal_data_persistence.warm_up(batch_size = 2)
+
+    assert JournalItem.hydrated_num == 5
+    assert sorted(entry.value for entry in lazy_journal_data_persistence.get_all()) == [0, 2, 3, 4]
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_lazy_page(journal_data_persistence_factory, JournalItem):
+    """When paging lazily loaded entries, only the entries of the page should be created."""
+
+    journal_data_persistence = journal_data_persistence_factory()
+
+    for i in range(6):
+        journal_data_persistence.add(JournalItem(i))
+
+    await journal_data_persistence.async_flush()
+
+    JournalItem.hydrated_num = 0
+    lazy_journal_data_persistence = journal_data_persistence_factory(lazy_load = True)
+
+    assert lazy_journal_data_persistence.count() == 6
+    assert JournalItem.hydrated_num == 0
+    assert [entry.value for entry in lazy_journal_data_persistence.page(2, 2)] == [2, 3]
+    assert JournalItem.hydrated_num == 2
+    assert all(isinstance(entry, JournalItem)
+        for entry in lazy_journal_data_persistence.iter_entries())
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_encoding_store(journal_data_persistence_factory, JournalItem):
+    """When saving a snapshot with an encoding store, the encodings should be restored from its rows."""
+
+    journal_data_persistence = journal_data_persistence_factory(compact_size = 0,
+        encoding_store = EncodingStore(dimension = 4))
+    encodings = [[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]]
+    entry_id = journal_data_persistence.add(JournalItem("a", encodings))
+    journal_data_persistence.flush()
+
+    assert journal_data_persistence.compaction_num == 1
+
+    with (Path(".cache") / ("data.json." + str(journal_data_persistence.generation))).open() as file:
+        assert json.load(file)[entry_id]["encodings"] == {"rows": [0, 1]}
+
+    new_journal_data_persistence = journal_data_persistence_factory(
+        encoding_store = EncodingStore(dimension = 4))
+
+    assert np.array_equal(new_journal_data_persistence.get(entry_id).encodings, encodings)
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_encoding_store_update(journal_data_persistence_factory, JournalItem):
+    """When updating entries loaded from an encoding store, their encodings should be written."""
+
+    journal_data_persistence = journal_data_persistence_factory(compact_size = 0,
+        encoding_store = EncodingStore(dimension = 4))
+    encodings = [[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]]
+    entry_id = journal_data_persistence.add(JournalItem("a", encodings))
+    journal_data_persistence.flush()
+
+    new_journal_data_persistence = journal_data_persistence_factory(compact_size = 1 << 20,
+        encoding_store = EncodingStore(dimension = 4))
+    entry = new_journal_data_persistence.get(entry_id)
+    entry.value = "b"
+    new_journal_data_persistence.update(entry_id, entry)
+    new_journal_data_persistence.flush()
+
+    with (Path(".cache") / "data.journal").open() as file:
+        assert json.loads(file.readlines()[-1])["entry"]["encodings"] == encodings
+
+    reloaded_journal_data_persistence = journal_data_persistence_factory(
+        encoding_store = EncodingStore(dimension = 4))
+
+    assert reloaded_journal_data_persistence.get(entry_id).value == "b"
+    assert np.array_equal(reloaded_journal_data_persistence.get(entry_id).encodings, encodings)
+
+@pytest.mark.asyncio
+@pytest.mark.local_journal_file_dict_data_persistence
+async def test_journal_data_persistence_encoding_store_fallback(journal_data_persistence_factory, JournalItem):
+    """When reopening, the rows of the previous snapshot generation should not be reused."""
+
+    journal_data_persistence = journal_data_persistence_factory(compact_size = 0,
+        encoding_store = EncodingStore(dimension = 4))
+    encodings = [[1.0, 2.0, 3.0, 4.0]]
+    entry_id = journal_data_persistence.add(JournalItem("a", encodings))
+    journal_data_persistence.flush()
+    updated_item = JournalItem("b", [[5.0, 6.0, 7.0, 8.0]])
+    updated_item.entry_id = entry_id
+    journal_data_persistence.update(entry_id, updated_item)
+    journal_data_persistence.flush()
+
+    with (Path(".cache") / ("data.json." + str(journal_data_persistence.generation - 1))).open() as file:
+        fallback_rows = json.load(file)[entry_id]["encodings"]["rows"]
+
+    new_journal_data_persistence = journal_data_persistence_factory(compact_size = 0,
+        encoding_store = EncodingStore(dimension = 4))
+    updated_item = JournalItem("c", [[9.0, 10.0, 11.0, 12.0]])
+    updated_item.entry_id = entry_id
+    new_journal_data_persistence.update(entry_id, updated_item)
+    new_journal_data_persistence.flush()
+
+    with (Path(".cache") / ("data.json." + str(new_journal_data_persistence.generation))).open() as file:
+        assert not set(fallback_rows) & set(json.load(file)[entry_id]["encodings"]["rows"])
+
+    encoding_store = EncodingStore(dimension = 4)
+    encoding_store.open()
+
+    assert np.array_equal(encoding_store.get(fallback_rows), encodings)
@@ -0,0 +1,79 @@
+"Tests for derived storage module"
+from io import BytesIO
+from pathlib import Path
+from shutil import rmtree
+
+from PIL import Image
+import pytest
+
+from src.derived_storage import Crop, DerivedStorage, Resize
+from src.storage import FSStorage
+
+@pytest.fixture
+def storage():
+    base_data_path = ".cache_derived"
+    rmtree(base_data_path, ignore_errors = True)
+
+    yield FSStorage.__wrapped__(base_data_path)
+
+    rmtree(base_data_path, ignore_errors = True)
+
+@pytest.fixture
+def images():
+    asset_path = Path("assets/yalefaces")
+
+    return [(asset_path / file_name).read_bytes()
+        for file_name in ["subject01.centerlight", "subject02.centerlight"]]
+
+def get_size(image):
+    with Image.open(BytesIO(image)) as picture:
+        return picture.size
+
+@pytest.mark.asyncio
+@pytest.mark.derived_storage
+async def test_generate_once(storage, images):
+    """When getting a derived image, it should be generated once, then cached or loaded."""
+    transforms = {"thumbnail": Resize(32, 32), "corner": Crop((0, 0, 20, 10))}
+
+    await storage.put("faces", "subject01", BytesIO(images[0]))
+
+    derived_storage = DerivedStorage(storage, transforms)
+    thumbnail = await derived_storage.get("faces", "subject01", "thumbnail")
+
+    assert max(get_size(thumbnail)) == 32
+    assert get_size(await derived_storage.get("faces", "subject01", "corner")) == (20, 10)
+    assert (await derived_storage.get("faces", "subject01", "thumbnail")) == thumbnail
+    assert derived_storage.stats == {"generated": 2, "loaded": 0}
+
+    derived_storage.close()
+    derived_storage = DerivedStorage(storage, transforms)
+
+    assert (await derived_storage.get("faces", "subject01", "thumbnail")) == thumbnail
+    assert derived_storage.stats == {"generated": 0, "loaded": 1}
+
+    with pytest.raises(RuntimeError):
+        await derived_storage.get("faces", "subject01", "not_existing")
+
+@pytest.mark.asyncio
+@pytest.mark.derived_storage
+async def test_invalidate_on_change(storage, images):
+    """When putting or deleting the original image, its derived images should be dropped."""
+    derived_storage = DerivedStorage(storage, {"thumbnail": Resize(32, 32)})
+
+    await storage.put("faces", "subject", BytesIO(images[0]))
+
+    thumbnail = await derived_storage.get("faces", "subject", "thumbnail")
+
+    await storage.put("faces", "subject", BytesIO(images[1]), True)
+
+    new_thumbnail = await derived_storage.get("faces", "subject", "thumbnail")
+
+    assert new_thumbnail != thumbnail
+    assert derived_storage.stats == {"generated": 2, "loaded": 0}
+
+    await storage.delete("faces", "subject")
+
+    with pytest.raises(RuntimeError):
+        await derived_storage.get("faces", "subject", "thumbnail")
+
+    assert not list(Path(".cache_derived/derived/faces").iterdir())
@@ -0,0 +1,67 @@
+"Tests for encoding store module"
+from shutil import rmtree
+
+import numpy as np
+import pytest
+
+from src.encoding_store import EncodingStore
+
+@pytest.fixture
+def path(request):
+    path = ".cache_encoding_store"
+
+    def fin():
+        rmtree(path, ignore_errors = True)
+
+    request.addfinalizer(fin)
+
+    return path
+
+@pytest.mark.encoding_store
+def test_put_and_get(path):
+    """When putting encodings, they should be readable from the mapped file after reopening."""
+
+    encoding_store = EncodingStore(path, dimension = 4)
+    encoding_store.open()
+
+    encodings = np.arange(12, dtype = np.float32).reshape(3, 4)
+    rows = encoding_store.put(encodings)
+
+    assert rows == [0, 1, 2]
+    assert encoding_store.equals(rows, encodings)
+
+    encoding_store.flush()
+
+    new_encoding_store = EncodingStore(path, dimension = 4)
+    new_encoding_store.open(rows)
+
+    assert np.array_equal(new_encoding_store.get(rows), encodings)
+    assert isinstance(new_encoding_store.get(rows)[0], np.memmap)
+
+@pytest.mark.encoding_store
+def test_reuse_free_rows(path):
+    """When reopening the store, only rows not in use should be handed out again."""
+
+    encoding_store = EncodingStore(path, dimension = 4)
+    encoding_store.open()
+
+    rows = encoding_store.put(np.zeros((3, 4)))
+    encoding_store.release(rows[1:2])
+
+    assert encoding_store.put(np.ones((1, 4))) == [3]
+    assert encoding_store.released_num == 1
+
+    encoding_store.open([0, 2, 3])
+
+    assert encoding_store.put(np.ones((1, 4))) == [1]
+
+@pytest.mark.encoding_store
+def test_to_matrix(path):
+    """When converting encodings, only matrices of the store dimension should be accepted."""
+
+    encoding_store = EncodingStore(path, dimension = 4, dtype = 'float64')
+
+    assert encoding_store.to_matrix([[1, 2, 3, 4]]).dtype == np.float64
+    assert encoding_store.to_matrix([]).shape == (0, 4)
+    assert encoding_store.to_matrix([[1, 2, 3]]) is None
+    assert encoding_store.to_matrix("encodings") is None
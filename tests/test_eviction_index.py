@@ -0,0 +1,56 @@
+"Tests for eviction index module"
+import pytest
+
+from src.eviction_index import EvictionIndex
+
+@pytest.fixture
+def eviction_index():
+    return EvictionIndex()
+
+@pytest.mark.eviction_index
+def test_pop_in_sort_key_order(eviction_index):
+    """When popping entries, they should come out ordered by sort key."""
+
+    eviction_index.push("b", 2)
+    eviction_index.push("c", 3)
+    eviction_index.push("a", 1)
+
+    assert len(eviction_index) == 3
+    assert eviction_index.peek() == "a"
+    assert [eviction_index.pop() for _ in range(3)] == ["a", "b", "c"]
+    assert len(eviction_index) == 0
+
+@pytest.mark.eviction_index
+def test_push_existing_moves_entry(eviction_index):
+    """When pushing an existing entry id, only the latest sort key should count."""
+
+    eviction_index.push("a", 1)
+    eviction_index.push("b", 2)
+    eviction_index.push("a", 3)
+
+    assert len(eviction_index) == 2
+    assert eviction_index.pop() == "b"
+    assert eviction_index.pop() == "a"
+
+@pytest.mark.eviction_index
+def test_discard(eviction_index):
+    """When discarding an entry id, it should never be returned."""
+
+    eviction_index.push("a", 1)
+    eviction_index.push("b", 2)
+    eviction_index.discard("a")
+    eviction_index.discard("not_existing")
+
+    assert "a" not in eviction_index
+    assert eviction_index.peek() == "b"
+
+@pytest.mark.eviction_index
+def test_compact(eviction_index):
+    """When refreshing the same entries repeatedly, the heap should not grow without bound."""
+
+    for i in range(1000):
+        eviction_index.push(i % 10, i)
+
+    assert len(eviction_index) == 10
+    assert len(eviction_index._heap) <= 2 * 10 + 16 + 1
+    assert eviction_index.pop() == 0
@@ -0,0 +1,148 @@
+"Tests for face index module"
+import numpy as np
+import pytest
+
+from src.data_container import DataContainerWithMaxSize, DictDataContainer
+from src.face_index import FaceIndex, IVFFaceIndex, measure_recall
+
+@pytest.fixture
+def dimension():
+    return 8
+
+@pytest.fixture
+def face_index(dimension):
+    return FaceIndex(dimension)
+
+@pytest.fixture
+def FaceEntry():
+    class FaceEntry(DataContainerWithMaxSize.Entry):
+        def __init__(self, encodings):
+            super().__init__("face_entry")
+
+            self.encodings = encodings
+
+        def destroy(self):
+            pass
+
+    return FaceEntry
+
+@pytest.mark.face_index
+def test_query(face_index, dimension):
+    """When querying, the nearest entries should be returned once each, nearest first."""
+
+    face_index.add("a", np.zeros((2, dimension)))
+    face_index.add("b", np.full((1, dimension), 1.0))
+    face_index.add("c", np.full((1, dimension), 3.0))
+
+    results = face_index.query(np.full(dimension, .1), k = 2)
+
+    assert [entry_id for entry_id, _ in results] == ["a", "b"]
+    assert results[0][1] == pytest.approx(np.sqrt(dimension) * .1, rel = 1e-4)
+    assert [entry_id for entry_id, _ in face_index.query(np.zeros(dimension), 5, 3.0)] == ["a", "b"]
+
+@pytest.mark.face_index
+def test_remove_and_repack(face_index, dimension):
+    """When removing entries, they should not match anymore and tombstones should be repacked."""
+
+    for i in range(10):
+        face_index.add(i, np.full((1, dimension), float(i)))
+
+    face_index.remove(0)
+
+    assert face_index.tombstone_num == 1
+    assert face_index.query(np.zeros(dimension))[0][0] == 1
+
+    for i in range(1, 3):
+        face_index.remove(i)
+
+    assert face_index.tombstone_num == 0
+    assert face_index.encoding_num == 7
+    assert len(face_index) == 7
+    assert face_index.query(np.zeros(dimension))[0][0] == 3
+    assert face_index.query(np.full(dimension, 9.0))[0] == (9, 0.0)
+
+@pytest.mark.face_index
+def test_grow(face_index, dimension):
+    """When adding many encodings, the matrix should grow and keep the existing ones."""
+
+    for i in range(200):
+        face_index.add(i, np.full((1, dimension), float(i)))
+
+    assert face_index.encoding_num == 200
+    assert face_index.query(np.full(dimension, 150.2))[0][0] == 150
+
+@pytest.mark.face_index
+def test_attach(face_index, dimension, FaceEntry):
+    """When attached to a data container, the index should follow its changes."""
+
+    dict_data_container = DictDataContainer()
+    id_a = dict_data_container.add(FaceEntry(np.zeros((1, dimension))))
+
+    face_index.attach(dict_data_container)
+
+    id_b = dict_data_container.add(FaceEntry(np.ones((1, dimension))))
+
+    assert face_index.query(np.ones(dimension))[0][0] == id_b
+
+    dict_data_container.update(id_a, FaceEntry(np.full((1, dimension), 2.0)))
+
+    assert face_index.query(np.full(dimension, 2.0))[0][0] == id_a
+
+    dict_data_container.remove(id_b)
+
+    assert id_b not in face_index
+    assert face_index.query(np.ones(dimension), 2) == [(id_a, pytest.approx(np.sqrt(dimension)))]
+
+    face_index.detach(dict_data_container)
+    dict_data_container.add(FaceEntry(np.ones((1, dimension))))
+
+    assert len(face_index) == 1
+
+@pytest.fixture
+def clustered_encodings(dimension):
+    random = np.random.default_rng(1)
+    centers = random.normal(0, 10, (16, dimension))
+
+    return (centers[random.integers(0, 16, 2000)] + random.normal(0, 1, (2000, dimension))).astype(np.float32)
+
+@pytest.mark.face_index
+def test_ivf_face_index(dimension, clustered_encodings):
+    """When enough encodings are indexed, the IVF index should train and keep a high recall."""
+
+    ivf_face_index = IVFFaceIndex(dimension, list_num = 16, probe_num = 4)
+
+    for i, encoding in enumerate(clustered_encodings[:100]):
+        ivf_face_index.add(i, [encoding])
+
+    assert not ivf_face_index.trained
+
+    for i, encoding in enumerate(clustered_encodings[100:], 100):
+        ivf_face_index.add(i, [encoding])
+
+    assert ivf_face_index.trained
+    assert ivf_face_index.query(clustered_encodings[1500])[0] == (1500, 0.0)
+
+    queries = clustered_encodings[:50] + .1
+
+    assert measure_recall(ivf_face_index, queries, 5)["recall"] > .9
+
+    ivf_face_index.probe_num = 16
+
+    assert measure_recall(ivf_face_index, queries, 5)["recall"] == 1.0
+
+@pytest.mark.face_index
+def test_ivf_face_index_remove(dimension, clustered_encodings):
+    """When removing entries from a trained IVF index, they should not match anymore after repacking."""
+
+    ivf_face_index = IVFFaceIndex(dimension, list_num = 16, probe_num = 16)
+
+    for i, encoding in enumerate(clustered_encodings):
+        ivf_face_index.add(i, [encoding])
+
+    for i in range(0, 1000):
+        ivf_face_index.remove(i)
+
+    assert ivf_face_index.tombstone_num < 1000
+    assert ivf_face_index.query(clustered_encodings[10])[0][0] >= 1000
+    assert ivf_face_index.query(clustered_encodings[1990])[0] == (1990, 0.0)
+    assert measure_recall(ivf_face_index, clustered_encodings[:20], 3)["recall"] == 1.0
@@ -0,0 +1,132 @@
+"Tests for frame filter module"
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.frame_filter import FrameFilter
+from src.recognition_pipeline import RecognitionPipeline
+
+def to_jpeg(pixels):
+    file = BytesIO()
+    Image.fromarray(pixels.astype(np.uint8)).save(file, 'JPEG', quality = 95)
+
+    return file.getvalue()
+
+@pytest.fixture
+def frames():
+    random = np.random.default_rng(0)
+    scene = random.integers(0, 255, (120, 160, 3))
+    noisy_scene = np.clip(scene + random.integers(-2, 3, scene.shape), 0, 255)
+    other_scene = 255 - scene
+
+    return to_jpeg(scene), to_jpeg(noisy_scene), to_jpeg(other_scene)
+
+@pytest.fixture
+def asset_image():
+    with open("assets/yalefaces/subject01.centerlight", "rb") as file:
+        return file.read()
+
+@pytest.fixture
+def static_scene():
+    random = np.random.default_rng(0)
+    blocks = Image.fromarray(random.integers(0, 255, (18, 32, 3)).astype(np.uint8))
+
+    return np.asarray(blocks.resize((1280, 720), Image.BILINEAR), np.int16)
+
+@pytest.mark.frame_filter
+def test_lookup(frames):
+    """When a nearly identical frame has been processed, its result should be reused."""
+
+    frame_filter = FrameFilter()
+    scene, noisy_scene, other_scene = frames
+
+    assert frame_filter.lookup(frame_filter.fingerprint(scene), "camera.a") == (False, None)
+
+    frame_filter.store(frame_filter.fingerprint(scene), "result", "camera.a")
+
+    assert frame_filter.lookup(frame_filter.fingerprint(noisy_scene), "camera.a") == (True, "result")
+    assert frame_filter.lookup(frame_filter.fingerprint(noisy_scene), "camera.b") == (False, None)
+    assert frame_filter.lookup(frame_filter.fingerprint(other_scene), "camera.a") == (False, None)
+
+    frame_filter.store(frame_filter.fingerprint(other_scene), "other result", "camera.a")
+
+    assert frame_filter.lookup(frame_filter.fingerprint(noisy_scene), "camera.a") == (True, "result")
+    assert frame_filter.stats == {"checked": 5, "hash_hits": 1, "motion_skips": 1, "misses": 3,
+        "hit_rate": .4}
+
+    frame_filter.discard("result")
+
+    assert frame_filter.lookup(frame_filter.fingerprint(noisy_scene), "camera.a") == (False, None)
+
+@pytest.mark.frame_filter
+@pytest.mark.parametrize("face_size", [120, 180, 240])
+def test_lookup_local_change(asset_image, static_scene, face_size):
+    """When a face enters an otherwise unchanged scene, the frame should not be skipped."""
+
+    frame_filter = FrameFilter()
+    noisy_scene = np.clip(static_scene + np.random.default_rng(1).integers(-2, 3,
+        static_scene.shape), 0, 255)
+    face_scene = Image.fromarray(static_scene.astype(np.uint8))
+
+    with Image.open(BytesIO(asset_image)) as face:
+        face_scene.paste(face.convert('RGB').resize((face_size, face_size)), (600, 300))
+
+    frame_filter.store(frame_filter.fingerprint(to_jpeg(static_scene)), "result", "camera.a")
+
+    assert frame_filter.lookup(frame_filter.fingerprint(to_jpeg(noisy_scene)), "camera.a") \
+        == (True, "result")
+    assert frame_filter.lookup(frame_filter.fingerprint(to_jpeg(np.asarray(face_scene))),
+        "camera.a") == (False, None)
+
+@pytest.mark.frame_filter
+def test_max_age(frames):
+    """When the processed frame is too old, its result should not be reused."""
+
+    frame_filter = FrameFilter(max_age = -1)
+    scene = frames[0]
+
+    frame_filter.store(frame_filter.fingerprint(scene), "result")
+
+    assert frame_filter.lookup(frame_filter.fingerprint(scene)) == (False, None)
+
+@pytest.mark.frame_filter
+def test_fingerprint_gif(asset_image):
+    """When fingerprinting other image formats, the fingerprint should still be computed."""
+
+    fingerprint = FrameFilter().fingerprint(asset_image)
+
+    assert 0 <= fingerprint.frame_hash < 1 << 64
+    assert fingerprint.thumbnail.shape == (32, 32)
+
+@pytest.mark.asyncio
+@pytest.mark.frame_filter
+async def test_recognition_pipeline_frame_filter(frames):
+    """When the pipeline has a frame filter, nearly identical frames should only be recognized once."""
+
+    processed_images = []
+
+    def process_batch(images, model, upsample_num):
+        processed_images.extend(images)
+
+        return [[len(image)] for image in images]
+
+    frame_filter = FrameFilter()
+    recognition_pipeline = RecognitionPipeline(1, 1, process_batch = process_batch,
+        executor = ThreadPoolExecutor(1), frame_filter = frame_filter)
+    scene, noisy_scene, other_scene = frames
+
+    results = [
+        await recognition_pipeline.recognize(scene, "camera.a"),
+        await recognition_pipeline.recognize(noisy_scene, "camera.a"),
+        await recognition_pipeline.recognize(other_scene, "camera.a"),
+        await recognition_pipeline.recognize(b"not an image", "camera.a"),
+    ]
+
+    assert results == [[len(scene)], [len(scene)], [len(other_scene)], [len(b"not an image")]]
+    assert processed_images == [scene, other_scene, b"not an image"]
+    assert frame_filter.stats["motion_skips"] == 1
+
+    recognition_pipeline.shutdown()
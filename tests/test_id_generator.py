@@ -0,0 +1,34 @@
+"Tests for id generator module"
+from unittest.mock import patch
+
+import pytest
+
+from src.id_generator import TimeOrderedIdGenerator, UUIDGenerator, encode_base32
+
+@pytest.mark.id_generator
+def test_time_ordered_ids_sort_by_generation():
+    """When generating ids within the same millisecond or a clock going back, they should sort."""
+    id_generator = TimeOrderedIdGenerator()
+
+    with patch("src.id_generator.time", side_effect = [1.0] * 3 + [.5] * 3):
+        ids = [id_generator.generate(None, lambda entry_id: False) for _ in range(6)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 6
+    assert all(len(entry_id) == 26 for entry_id in ids)
+    assert ids[0][:10] == encode_base32(1000, 10)
+
+@pytest.mark.id_generator
+def test_skip_taken_ids():
+    """When an id is taken, another one should be generated."""
+    taken_ids = []
+
+    def is_taken(entry_id):
+        taken_ids.append(entry_id)
+
+        return len(taken_ids) == 1
+
+    entry_id = UUIDGenerator().generate(None, is_taken)
+
+    assert len(taken_ids) == 2
+    assert entry_id == taken_ids[1]
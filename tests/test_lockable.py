@@ -3,7 +3,7 @@ import asyncio
 
 import pytest
 
-from src.lockable import Lockable
+from src.lockable import Lockable, ReadWriteLockable
 
 @pytest.fixture
 def loop(request):
@@ -234,3 +234,170 @@ async def test_check_lock_without_key(lockable):
         assert False
     except Exception as err:
         assert err.args[0] == "Can not update a data persistence instance being locked, check if it has been lock before the operation."
+
+@pytest.fixture
+def read_write_lockable(max_waiting_num):
+    return ReadWriteLockable(max_waiting_num)
+
+@pytest.mark.asyncio
+async def test_concurrent_readers(read_write_lockable):
+    """When read locking several times, readers should hold the lock together and allow reads."""
+
+    keys = [await read_write_lockable.lock_read() for _ in range(3)]
+
+    assert read_write_lockable.reader_num == 3
+
+    read_write_lockable._check_read_lock()
+
+    with pytest.raises(RuntimeError):
+        read_write_lockable._check_lock()
+
+    for key in keys:
+        read_write_lockable.unlock_read(key)
+
+    assert read_write_lockable.reader_num == 0
+
+    with pytest.raises(RuntimeError):
+        read_write_lockable.unlock_read(keys[0])
+
+@pytest.mark.asyncio
+async def test_writer_preference(read_write_lockable):
+    """When a writer waits for readers, new readers should wait until the writer is done."""
+    events = []
+
+    read_key = await read_write_lockable.lock_read()
+
+    async def write():
+        key = await read_write_lockable.lock()
+        events.append("write")
+        await asyncio.sleep(0)
+        read_write_lockable.unlock(key)
+
+    async def read():
+        key = await read_write_lockable.lock_read()
+        events.append("read")
+        read_write_lockable.unlock_read(key)
+
+    writer = asyncio.ensure_future(write())
+    await asyncio.sleep(0)
+    reader = asyncio.ensure_future(read())
+    await asyncio.sleep(0)
+
+    assert events == []
+
+    read_write_lockable.unlock_read(read_key)
+
+    await asyncio.gather(writer, reader)
+
+    assert events == ["write", "read"]
+    assert not read_write_lockable.locked
+
+@pytest.mark.asyncio
+async def test_write_lock_blocks_reads(read_write_lockable):
+    """When write locked, reads should need the key."""
+
+    key = await read_write_lockable.lock()
+
+    with pytest.raises(RuntimeError):
+        read_write_lockable._check_read_lock()
+
+    read_write_lockable._check_read_lock(key)
+    read_write_lockable.unlock(key)
+    read_write_lockable._check_read_lock()
+
+@pytest.mark.asyncio
+async def test_lock_stats(lockable):
+    """When locking, waiting and forcing unlocks, the lock stats should count them."""
+    slow_hold_times = []
+    lockable.watch_slow_holders(slow_hold_times.append, 0)
+
+    key = await lockable.lock()
+    waiters = [asyncio.ensure_future(lockable.lock()) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    lock_stats = lockable.lock_stats
+
+    assert lock_stats["forced_unlocks"] == 1
+    assert lock_stats["max_queue_length"] == 2
+    assert lock_stats["hold_time"]["count"] == 1
+    assert len(slow_hold_times) == 1
+
+    with pytest.raises(RuntimeError):
+        lockable.unlock(key)
+
+    for waiter in waiters:
+        lockable.unlock(await waiter)
+
+    lock_stats = lockable.lock_stats
+
+    assert lock_stats["acquired"] == 4
+    assert lock_stats["queue_length"] == 0
+    assert lock_stats["wait_time"]["count"] == 4
+    assert lock_stats["hold_time"]["count"] == 4
+    assert sum(lock_stats["hold_time"]["buckets"].values()) == 4
+
+@pytest.mark.asyncio
+async def test_lock_timeout(lockable):
+    """When a waiter times out, it should leave the queue and not get the lock."""
+
+    key = await lockable.lock()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await lockable.lock(.01)
+
+    assert len(lockable._lock_futures) == 0
+
+    lockable.unlock(key)
+
+    assert lockable.locked == False
+    assert lockable.lock_stats["abandoned_waits"] == 1
+
+@pytest.mark.asyncio
+async def test_skip_cancelled_waiter(lockable):
+    """When a waiter is cancelled, the lock should be handed over to the next one."""
+
+    key = await lockable.lock()
+    cancelled_waiter = asyncio.ensure_future(lockable.lock())
+    waiter = asyncio.ensure_future(lockable.lock())
+    await asyncio.sleep(0)
+
+    cancelled_waiter.cancel()
+    await asyncio.sleep(0)
+    lockable.unlock(key)
+
+    assert (await waiter) == lockable._key
+    assert cancelled_waiter.cancelled()
+
+@pytest.mark.asyncio
+async def test_hold(read_write_lockable):
+    """When holding the lock in an async with block, it should be unlocked after the block."""
+
+    async with read_write_lockable.hold() as key:
+        assert read_write_lockable.locked
+        read_write_lockable._check_lock(key)
+
+        with pytest.raises(asyncio.TimeoutError):
+            async with read_write_lockable.hold_read(.01):
+                assert False
+
+    assert not read_write_lockable.locked
+
+    async with read_write_lockable.hold_read():
+        assert read_write_lockable.reader_num == 1
+
+    assert read_write_lockable.reader_num == 0
+
+@pytest.mark.asyncio
+async def test_readers_woken_when_writer_gives_up(read_write_lockable):
+    """When the only waiting writer times out, readers queued behind it should get the lock."""
+
+    read_key = await read_write_lockable.lock_read()
+    writer = asyncio.ensure_future(read_write_lockable.lock(.01))
+    await asyncio.sleep(0)
+    reader = asyncio.ensure_future(read_write_lockable.lock_read())
+
+    with pytest.raises(asyncio.TimeoutError):
+        await writer
+
+    assert (await reader) == read_key
+    assert read_write_lockable.reader_num == 2
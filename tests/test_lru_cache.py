@@ -0,0 +1,47 @@
+"Tests for LRU cache module"
+import pytest
+
+from src.lru_cache import LRUCache
+
+@pytest.mark.lru_cache
+def test_evict_least_recently_used():
+    """When exceeding the byte budget, the least recently used items should be evicted."""
+    lru_cache = LRUCache(10)
+
+    lru_cache.put("a", b"aaaa")
+    lru_cache.put("b", b"bbbb")
+
+    assert lru_cache.get("a") == b"aaaa"
+
+    lru_cache.put("c", b"cccc")
+
+    assert "a" in lru_cache
+    assert "b" not in lru_cache
+    assert "c" in lru_cache
+    assert lru_cache.size == 8
+    assert lru_cache.stats["evictions"] == 1
+
+@pytest.mark.lru_cache
+def test_skip_items_over_budget():
+    """When putting an item larger than the whole budget, it should not be cached."""
+    lru_cache = LRUCache(4)
+
+    lru_cache.put("a", b"aa")
+    lru_cache.put("a", b"aaaaa")
+
+    assert "a" not in lru_cache
+    assert lru_cache.size == 0
+
+@pytest.mark.lru_cache
+def test_stats():
+    """When getting items, hits and misses should be counted."""
+    lru_cache = LRUCache(10)
+
+    lru_cache.put("a", b"a")
+
+    assert lru_cache.get("a") == b"a"
+    assert lru_cache.get("b", b"default") == b"default"
+    assert lru_cache.invalidate("a")
+    assert not lru_cache.invalidate("a")
+    assert lru_cache.stats == {"hits": 1, "misses": 1, "evictions": 0, "items": 0, "bytes": 0,
+        "max_bytes": 10}
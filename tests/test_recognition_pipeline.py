@@ -0,0 +1,109 @@
+"Tests for recognition pipeline module"
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import asyncio
+import os
+import threading
+
+import pytest
+
+from src.recognition_pipeline import RecognitionPipeline
+
+def process_batch(images, model, upsample_num):
+    """Fake worker function returning the size of the images and the worker process id."""
+    results = []
+
+    for image in images:
+        if image == b"broken":
+            results.append(ValueError("Broken image."))
+        else:
+            results.append([(len(image), model, upsample_num, os.getpid())])
+
+    return results
+
+@pytest.mark.asyncio
+@pytest.mark.recognition_pipeline
+async def test_recognize_in_worker_processes():
+    """When recognizing frames, they should be processed in worker processes and resolved in order."""
+
+    recognition_pipeline = RecognitionPipeline(2, 2, .01, "cnn", 0, process_batch)
+
+    try:
+        results = await recognition_pipeline.recognize_many([b"a", b"bb", b"ccc", b"broken", b"eeeee"])
+    except ValueError as err:
+        assert err.args[0] == "Broken image."
+    else:
+        assert False
+
+    results = await recognition_pipeline.recognize_many([b"a", b"bb", b"ccc"])
+
+    assert [result[0][:3] for result in results] == [(1, "cnn", 0), (2, "cnn", 0), (3, "cnn", 0)]
+    assert results[0][0][3] != os.getpid()
+    assert recognition_pipeline.pending_num == 0
+
+    recognition_pipeline.shutdown()
+
+@pytest.mark.asyncio
+@pytest.mark.recognition_pipeline
+async def test_recognize_batches():
+    """When frames arrive together, they should share batches and no more batches than workers should run."""
+
+    batch_sizes = []
+    running_num = 0
+    max_running_num = 0
+    lock = threading.Lock()
+
+    def record_batch(images, model, upsample_num):
+        nonlocal running_num, max_running_num
+
+        with lock:
+            running_num += 1
+            max_running_num = max(max_running_num, running_num)
+            batch_sizes.append(len(images))
+
+        threading.Event().wait(.02)
+
+        with lock:
+            running_num -= 1
+
+        return [[]] * len(images)
+
+    recognition_pipeline = RecognitionPipeline(2, 3, .01, process_batch = record_batch,
+        executor = ThreadPoolExecutor(4))
+
+    results = await recognition_pipeline.recognize_many([b"frame"] * 10)
+
+    assert results == [[]] * 10
+    assert sum(batch_sizes) == 10
+    assert max(batch_sizes) == 3
+    assert max_running_num <= 2
+
+    single_result = await recognition_pipeline.recognize(b"frame")
+
+    assert single_result == []
+    assert batch_sizes[-1] == 1
+
+    recognition_pipeline.shutdown()
+
+@pytest.mark.asyncio
+@pytest.mark.recognition_pipeline
+async def test_recognize_stored():
+    """When recognizing a stored image, its content should be read from the storage."""
+
+    class Storage:
+        def get(self, path, name):
+            return BytesIOFile((path + name).encode())
+
+    class BytesIOFile:
+        def __init__(self, content):
+            self._file = BytesIO(content)
+
+        async def read(self):
+            return self._file.read()
+
+    recognition_pipeline = RecognitionPipeline(1, 1, process_batch = process_batch,
+        executor = ThreadPoolExecutor(1))
+
+    assert (await recognition_pipeline.recognize_stored(Storage(), "ab", "cd"))[0][0] == 4
+
+    recognition_pipeline.shutdown()
@@ -0,0 +1,73 @@
+"Tests for secondary index module"
+import pytest
+
+from src.data_container import DataContainerWithMaxSize, DictDataContainerWithMaxSize
+from src.secondary_index import HashIndex, SortedIndex
+
+class DataEntry(DataContainerWithMaxSize.Entry):
+    def __init__(self, name):
+        super().__init__("data_entry")
+
+        self.name = name
+
+    def destroy(self):
+        pass
+
+@pytest.fixture
+def data_container():
+    return DictDataContainerWithMaxSize(100)
+
+@pytest.mark.secondary_index
+def test_hash_index(data_container):
+    """When adding, updating and removing entries, the hash index should follow them."""
+
+    alice_id = data_container.add(DataEntry("alice"))
+    data_container.add_index("name", HashIndex("name"))
+    bob_id = data_container.add(DataEntry("bob"))
+    other_alice_id = data_container.add(DataEntry("alice"))
+
+    assert [entry.entry_id for entry in data_container.find("name", "alice")] \
+        == [alice_id, other_alice_id]
+
+    new_alice = DataEntry("alice")
+    new_alice.entry_id = bob_id
+    data_container.update(bob_id, new_alice)
+    data_container.remove(alice_id)
+
+    assert [entry.entry_id for entry in data_container.find("name", "alice")] \
+        == [other_alice_id, bob_id]
+    assert data_container.find("name", "bob") == []
+
+    with pytest.raises(RuntimeError):
+        data_container.find("not_existing", "alice")
+
+@pytest.mark.secondary_index
+def test_sorted_index(data_container):
+    """When querying a sorted index on the update time, entries should come in the range and order."""
+
+    data_container.add_index("updated_at", SortedIndex())
+    ids = [data_container.add(DataEntry(str(i))) for i in range(5)]
+
+    for i, entry_id in enumerate(ids):
+        entry = data_container.get(entry_id)
+        entry.updated_at = i * 10
+        data_container.update(entry_id, entry)
+
+    assert data_container._indexes["updated_at"].query(10, 30) == ids[1:3]
+    assert [entry.entry_id for entry in data_container.find("updated_at", 15)] == ids[2:]
+    assert [entry.entry_id for entry in data_container.find("updated_at", limit = 2,
+        reverse = True)] == [ids[4], ids[3]]
+
+    data_container.remove(ids[2])
+
+    assert data_container._indexes["updated_at"].query(15) == ids[3:]
+
+@pytest.mark.secondary_index
+def test_sorted_index_follows_refresh(data_container):
+    """When an entry is added, its refreshed update time should be indexed."""
+
+    data_container.add_index("updated_at", SortedIndex())
+    entry_id = data_container.add(DataEntry("alice"))
+
+    assert data_container._indexes["updated_at"].query(data_container.get(entry_id).updated_at) \
+        == [entry_id]
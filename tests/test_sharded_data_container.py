@@ -0,0 +1,135 @@
+"Tests for sharded data container module"
+from pathlib import Path
+from shutil import rmtree
+
+import pytest
+
+from src.data_container import EVICTION_LRU, DataContainerWithMaxSize, DictDataContainerWithMaxSize
+from src.data_persistence import JSONFileDictDataPersistence
+from src.secondary_index import HashIndex
+from src.sharded_data_container import ShardedDataContainer, create_json_file_shards
+
+class DataEntry(DataContainerWithMaxSize.Entry):
+    def __init__(self, name):
+        super().__init__("data_entry")
+
+        self.name = name
+
+    def destroy(self):
+        pass
+
+    def to_json(self):
+        return {"_type": "data_entry", "name": self.name, "entry_id": self.entry_id,
+            "updated_at": self.updated_at}
+
+@pytest.fixture
+def sharded_data_container():
+    return ShardedDataContainer([DictDataContainerWithMaxSize(100) for _ in range(4)], 100)
+
+@pytest.mark.sharded_data_container
+def test_spread_entries(sharded_data_container):
+    """When adding entries, they should be spread over the shards and found through the container."""
+
+    sharded_data_container.add_index("name", HashIndex("name"))
+    ids = [sharded_data_container.add(DataEntry(str(i % 5))) for i in range(40)]
+
+    assert all(shard.count() > 0 for shard in sharded_data_container.shards)
+    assert sharded_data_container.count() == 40
+    assert len(sharded_data_container.get_all()) == 40
+    assert all(sharded_data_container.get_shard(entry_id).has(entry_id) for entry_id in ids)
+    assert len(sharded_data_container.find("name", "0")) == 8
+
+    sharded_data_container.remove(ids[0])
+
+    assert not sharded_data_container.has(ids[0])
+    assert len(sharded_data_container.find("name", "0")) == 7
+
+@pytest.mark.sharded_data_container
+def test_global_max_size():
+    """When exceeding the max size, the oldest entry of all shards should be evicted."""
+    sharded_data_container = ShardedDataContainer(
+        [DictDataContainerWithMaxSize(3) for _ in range(3)], 3)
+    ids = [sharded_data_container.add(DataEntry(str(i))) for i in range(3)]
+
+    sharded_data_container.get(ids[1]).updated_at = -1
+    sharded_data_container.update(ids[1], sharded_data_container.get(ids[1]))
+    sharded_data_container.add(DataEntry("3"))
+
+    assert sharded_data_container.count() == 3
+    assert not sharded_data_container.has(ids[1])
+
+@pytest.mark.sharded_data_container
+def test_global_byte_budget():
+    """When exceeding the byte budget, the least recently used entry of all shards should be evicted."""
+    sharded_data_container = ShardedDataContainer(
+        [DictDataContainerWithMaxSize(100) for _ in range(3)], 100, max_bytes = 1,
+        eviction_policy = EVICTION_LRU)
+    ids = [sharded_data_container.add(DataEntry(str(i))) for i in range(3)]
+
+    assert sharded_data_container.count() == 1
+    assert sharded_data_container.has(ids[2])
+    assert sharded_data_container.total_bytes > 0
+
+    sharded_data_container._max_bytes = 3 * sharded_data_container.total_bytes
+    ids = [ids[2]] + [sharded_data_container.add(DataEntry(str(i))) for i in range(3, 5)]
+
+    sharded_data_container.get(ids[0])
+    sharded_data_container.add(DataEntry("5"))
+
+    assert sharded_data_container.has(ids[0])
+    assert not sharded_data_container.has(ids[1])
+
+@pytest.mark.asyncio
+@pytest.mark.sharded_data_container
+async def test_shard_locks(sharded_data_container):
+    """When a shard is locked, only the entries of the other shards should be updated freely."""
+    ids = [sharded_data_container.add(DataEntry(str(i))) for i in range(8)]
+    shard = sharded_data_container.get_shard(ids[0])
+    key = await shard.lock()
+
+    other_ids = [entry_id for entry_id in ids if sharded_data_container.get_shard(entry_id) is not shard]
+    sharded_data_container.remove(other_ids[0])
+
+    with pytest.raises(RuntimeError):
+        sharded_data_container.remove(ids[0])
+
+    sharded_data_container.remove(ids[0], key)
+    shard.unlock(key)
+
+@pytest.mark.asyncio
+@pytest.mark.sharded_data_container
+async def test_json_file_shards(monkeypatch):
+    """When sharding persisted data, each shard should have its own file and reload its entries."""
+    path = ".cache_shards"
+    rmtree(path, ignore_errors = True)
+
+    def get_entry_class(self, json_object):
+        class LoadedEntry(DataEntry):
+            @staticmethod
+            def from_json(json_object):
+                entry = DataEntry(json_object["name"])
+                entry.entry_id = json_object["entry_id"]
+                entry.updated_at = json_object["updated_at"]
+
+                return entry
+
+        return LoadedEntry
+
+    monkeypatch.setattr(JSONFileDictDataPersistence, "_get_entry_class", get_entry_class)
+
+    shards = create_json_file_shards(2, path = path)
+    sharded_data_container = ShardedDataContainer(shards, 20)
+    ids = [sharded_data_container.add(DataEntry(str(i))) for i in range(12)]
+
+    assert sharded_data_container.count() == 12
+
+    for shard in shards:
+        await shard.async_flush()
+
+    assert sorted(file.name for file in Path(path).iterdir()) == ["data.0.json.1", "data.1.json.1"]
+
+    sharded_data_container = ShardedDataContainer(create_json_file_shards(2, path = path), 20)
+
+    assert sorted(entry.entry_id for entry in sharded_data_container.iter_entries()) == sorted(ids)
+
+    rmtree(path, ignore_errors = True)
@@ -0,0 +1,123 @@
+"Tests for snapshot module"
+from pathlib import Path
+from shutil import rmtree
+
+import pytest
+
+from src.snapshot import FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER, FsyncPolicy, SnapshotFile
+
+@pytest.fixture
+def path(request):
+    path = ".cache_snapshot"
+
+    def fin():
+        rmtree(path, ignore_errors = True)
+
+    request.addfinalizer(fin)
+
+    return path
+
+@pytest.mark.snapshot
+def test_save_and_load(path):
+    """When saving snapshots, each save should write a new generation readable later."""
+
+    snapshot_file = SnapshotFile(path, "data.json")
+
+    assert snapshot_file.load() is None
+
+    snapshot_file.save({"a": 1})
+    snapshot_file.save({"a": 2})
+
+    assert snapshot_file.generation == 2
+
+    new_snapshot_file = SnapshotFile(path, "data.json")
+
+    assert new_snapshot_file.load() == {"a": 2}
+    assert new_snapshot_file.generation == 2
+
+    new_snapshot_file.save({"a": 3})
+
+    assert new_snapshot_file.generation == 3
+    assert not list(Path(path).glob("*.tmp"))
+
+@pytest.mark.snapshot
+def test_fall_back_to_previous_generation(path):
+    """When the newest snapshot is truncated, the previous generation should be loaded."""
+
+    snapshot_file = SnapshotFile(path, "data.json", FSYNC_ALWAYS)
+
+    snapshot_file.save({"a": 1})
+    snapshot_file.save({"a": 2})
+
+    with (Path(path) / "data.json.2").open('w') as file:
+        file.write('{"a": ')
+
+    assert SnapshotFile(path, "data.json").load() == {"a": 1}
+
+@pytest.mark.snapshot
+def test_keep_recovered_generation(path):
+    """When falling back to a previous generation, it should be kept until a synced save."""
+
+    snapshot_file = SnapshotFile(path, "data.json", FSYNC_ALWAYS)
+
+    snapshot_file.save({"a": 1})
+    snapshot_file.save({"a": 2})
+
+    with (Path(path) / "data.json.2").open('w') as file:
+        file.write('{"a": ')
+
+    new_snapshot_file = SnapshotFile(path, "data.json", FSYNC_NEVER, keep_generations = 1)
+
+    assert new_snapshot_file.load() == {"a": 1}
+
+    new_snapshot_file.save({"a": 3})
+    new_snapshot_file.save({"a": 4})
+
+    assert sorted(file.name for file in Path(path).iterdir()) == ["data.json.1", "data.json.4"]
+
+@pytest.mark.snapshot
+def test_legacy_file_and_prune(path):
+    """When only the legacy file exists, it should be loaded and pruned after newer generations."""
+
+    Path(path).mkdir()
+
+    with (Path(path) / "data.json").open('w') as file:
+        file.write('{"a": 0}')
+
+    snapshot_file = SnapshotFile(path, "data.json", FSYNC_ALWAYS, keep_generations = 2)
+
+    assert snapshot_file.load() == {"a": 0}
+
+    for i in range(1, 5):
+        snapshot_file.save({"a": i})
+
+    assert sorted(file.name for file in Path(path).iterdir()) == ["data.json.3", "data.json.4"]
+
+@pytest.mark.snapshot
+def test_keep_synced_generation(path):
+    """When later generations are not synced, the last synced generation should not be pruned."""
+
+    snapshot_file = SnapshotFile(path, "data.json", FSYNC_INTERVAL, 3600, keep_generations = 1)
+
+    for i in range(1, 4):
+        snapshot_file.save({"a": i})
+
+    assert sorted(file.name for file in Path(path).iterdir()) == ["data.json.1", "data.json.3"]
+
+@pytest.mark.snapshot
+def test_fsync_policy():
+    """The fsync policies should decide whether a write is synced."""
+
+    assert FsyncPolicy(FSYNC_ALWAYS).should_sync()
+    assert not FsyncPolicy(FSYNC_NEVER).should_sync()
+
+    fsync_policy = FsyncPolicy(FSYNC_INTERVAL, 3600)
+
+    assert fsync_policy.should_sync()
+
+    fsync_policy.synced()
+
+    assert not fsync_policy.should_sync()
+
+    with pytest.raises(ValueError):
+        FsyncPolicy("sometimes")
@@ -4,9 +4,10 @@ from pathlib import Path
 import asyncio
 from shutil import rmtree
 
+from aiofiles import os as aioos
 import pytest
 
-from src.storage import FSStorage
+from src.storage import ContentAddressedStorage, FSStorage
 
 @pytest.fixture
 @pytest.mark.fs_storage
@@ -66,6 +67,8 @@ def image_1(asset_path, asset_file_name_1):
 def fs_storage():
     fs_storage = FSStorage()
     rmtree(fs_storage._base_data_path, ignore_errors = True)
+    fs_storage._cache.clear()
+    fs_storage._known_directories.clear()
 
     return fs_storage
 
@@ -157,6 +160,8 @@ async def test_fs_storage_delete(fs_storage, path, file_name, asset_file_name):
     try:
         file = fs_storage.get(path, file_name)
 
+        await file.read()
+
         assert False
     except RuntimeError as err:
         assert err.args[0] == "File not existing."
@@ -166,3 +171,252 @@ async def test_fs_storage_delete(fs_storage, path, file_name, asset_file_name):
 async def test_fs_storage_delete_not_existing(fs_storage, path, file_name):
     """When deleting a file not existing from the storage, the operation should be indicated as failed."""
     assert await fs_storage.delete(path, file_name) == False
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_read_cache(fs_storage, path, file_name, image):
+    """When reading a file written by another instance, it should be read from the disk once."""
+    base_data_path = fs_storage._base_data_path
+    writer = FSStorage.__wrapped__(base_data_path)
+
+    await writer.put(path, file_name, BytesIO(image))
+
+    hit_num = fs_storage.cache_stats["hits"]
+
+    assert (await fs_storage.get(path, file_name).read()) == image
+    assert fs_storage.cache_stats["hits"] == hit_num
+
+    (Path(base_data_path) / path / file_name).write_bytes(b"changed behind the cache")
+
+    assert (await fs_storage.get(path, file_name).read()) == image
+    assert fs_storage.cache_stats["hits"] == hit_num + 1
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_read_cache_invalidated(fs_storage, path, file_name, image, image_1):
+    """When overwriting or deleting a file, the cached content should not be served anymore."""
+
+    await fs_storage.put(path, file_name, BytesIO(image))
+    await fs_storage.put(path, file_name, BytesIO(image_1), True)
+
+    assert (await fs_storage.get(path, file_name).read()) == image_1
+
+    await fs_storage.delete(path, file_name)
+
+    with pytest.raises(RuntimeError):
+        await fs_storage.get(path, file_name).read()
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_read_during_delete(fs_storage, path, file_name, image):
+    """When a read from the disk finishes after a delete, its content should not be cached."""
+    writer = FSStorage.__wrapped__(fs_storage._base_data_path)
+
+    await writer.put(path, file_name, BytesIO(image))
+
+    stream = fs_storage.get(path, file_name)
+
+    await fs_storage.delete(path, file_name)
+
+    stream._on_read(image)
+
+    with pytest.raises(RuntimeError):
+        await fs_storage.get(path, file_name).read()
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_concurrent_puts(fs_storage, path, file_name, image, image_1):
+    """When putting a file several times at once, the last put should win on the disk too."""
+
+    await asyncio.gather(*[fs_storage.put(path, file_name, BytesIO(content), True)
+        for content in [image, image_1, image, image_1]])
+
+    fs_storage._cache.clear()
+
+    assert (await fs_storage.get(path, file_name).read()) == image_1
+    assert not fs_storage._writing
+    assert not fs_storage._write_locks
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_stream(fs_storage, path, file_name, image):
+    """When streaming a file, chunks and ranges should match whether it is cached or not."""
+
+    await fs_storage.put(path, file_name, BytesIO(image))
+
+    for cached in [True, False]:
+        if not cached:
+            fs_storage._cache.clear()
+
+        file = fs_storage.get(path, file_name, chunk_size = 1000)
+        chunks = [chunk async for chunk in file]
+
+        assert all(len(chunk) == 1000 for chunk in chunks[:-1])
+        assert b"".join(chunks) == image
+
+        async with fs_storage.get(path, file_name) as file:
+            assert (await file.read(10)) == image[:10]
+            assert (await file.read(10)) == image[10:20]
+            assert (await file.read_range(100, 150)) == image[100:150]
+            assert (await file.read_range(len(image) - 5)) == image[-5:]
+            assert file.tell() == len(image)
+
+    assert fs_storage.cache_stats["items"] == 0
+
+@pytest.fixture
+def content_addressed_storage_factory():
+    base_data_path = ".cache_blobs"
+    rmtree(base_data_path, ignore_errors = True)
+    storages = []
+
+    def create():
+        ContentAddressedStorage._instance = None
+        storages.append(ContentAddressedStorage(base_data_path))
+
+        return storages[-1]
+
+    yield create
+
+    for storage in storages:
+        storage.flush()
+
+    rmtree(base_data_path, ignore_errors = True)
+
+def count_blobs():
+    return len(list(Path(".cache_blobs/blobs").glob("*/*")))
+
+@pytest.mark.asyncio
+@pytest.mark.content_addressed_storage
+async def test_content_addressed_storage_deduplicate(content_addressed_storage_factory, path,
+        file_name, image, image_1):
+    """When putting identical contents, they should be stored once until all are deleted."""
+    storage = content_addressed_storage_factory()
+
+    await storage.put(path, file_name, BytesIO(image))
+    await storage.put(path, file_name + "_copy", BytesIO(image))
+    await storage.put("other_path", file_name, BytesIO(image))
+
+    assert count_blobs() == 1
+    assert storage.stats == {"files": 3, "blobs": 1, "deduplicated": 2}
+    assert (await storage.get("other_path", file_name).read()) == image
+
+    with pytest.raises(RuntimeError):
+        await storage.put(path, file_name, BytesIO(image_1))
+
+    await storage.put(path, file_name, BytesIO(image_1), True)
+
+    assert count_blobs() == 2
+    assert (await storage.get(path, file_name).read()) == image_1
+
+    assert await storage.delete(path, file_name + "_copy")
+    assert await storage.delete("other_path", file_name)
+    assert not await storage.delete("other_path", file_name)
+
+    assert count_blobs() == 1
+
+    with pytest.raises(RuntimeError):
+        storage.get("other_path", file_name)
+
+@pytest.mark.asyncio
+@pytest.mark.content_addressed_storage
+async def test_content_addressed_storage_reload(content_addressed_storage_factory, path,
+        file_name, image):
+    """When reloading the storage, saved names should be kept and orphan blobs removed."""
+    storage = content_addressed_storage_factory()
+
+    await storage.put(path, file_name, BytesIO(image))
+    storage.flush()
+
+    orphan_path = Path(".cache_blobs/blobs/00/00orphan")
+    orphan_path.parent.mkdir()
+    orphan_path.write_bytes(b"orphan")
+
+    storage = content_addressed_storage_factory()
+
+    assert (await storage.get(path, file_name).read()) == image
+
+    await storage.async_flush()
+
+    assert not orphan_path.exists()
+    assert count_blobs() == 1
+
+@pytest.mark.asyncio
+@pytest.mark.content_addressed_storage
+async def test_content_addressed_storage_reload_before_flush(content_addressed_storage_factory,
+        path, file_name, image, image_1):
+    """When reloading before the index is flushed, an overwritten file should still be readable."""
+    storage = content_addressed_storage_factory()
+
+    await storage.put(path, file_name, BytesIO(image))
+    storage.flush()
+    await storage.put(path, file_name, BytesIO(image_1), True)
+
+    storage = content_addressed_storage_factory()
+    await storage.async_flush()
+
+    assert (await storage.get(path, file_name).read()) == image_1
+    assert count_blobs() == 1
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_bulk(fs_storage, path, file_name, image, image_1, mocker):
+    """When putting, getting and deleting files in bulk, each item should get its own result."""
+    prepare_path = mocker.spy(fs_storage, "_prepare_path")
+
+    results = await fs_storage.put_many([(path, file_name + str(index),
+        BytesIO(image if index % 2 else image_1)) for index in range(6)],
+        max_concurrent_num = 2)
+
+    assert results == [None] * 6
+    assert prepare_path.call_count == 1
+
+    results = await fs_storage.put_many([(path, file_name + "0", BytesIO(image))])
+
+    assert isinstance(results[0], RuntimeError)
+
+    fs_storage._cache.clear()
+
+    contents = await fs_storage.get_many([(path, file_name + str(index)) for index in range(7)])
+
+    assert contents[:6] == [image if index % 2 else image_1 for index in range(6)]
+    assert isinstance(contents[6], RuntimeError)
+
+    removed = await fs_storage.delete_many([(path, file_name + str(index)) for index in range(7)])
+
+    assert removed == [True] * 6 + [False]
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_bulk_write_error(fs_storage, path, file_name, image):
+    """When a file can not be written, its error should be returned and it should not be cached."""
+    Path(fs_storage._base_data_path).mkdir()
+    (Path(fs_storage._base_data_path) / path).write_bytes(image)
+
+    results = await fs_storage.put_many([(path, file_name, BytesIO(image))])
+
+    assert isinstance(results[0], NotADirectoryError)
+    assert fs_storage._cache.get((path, file_name)) is None
+
+    with pytest.raises(NotADirectoryError):
+        await fs_storage.put(path, file_name, BytesIO(image))
+
+    rmtree(fs_storage._base_data_path, ignore_errors = True)
+
+@pytest.mark.asyncio
+@pytest.mark.fs_storage
+async def test_fs_storage_known_directories(fs_storage, path, file_name, image, mocker):
+    """When putting files, directories should be created once, and again once removed."""
+    mkdir = mocker.spy(aioos, "mkdir")
+
+    await fs_storage.put(path, file_name, BytesIO(image))
+    await fs_storage.put(path, file_name + "_1", BytesIO(image))
+
+    assert mkdir.call_count == 2
+
+    rmtree(fs_storage._base_data_path)
+
+    await fs_storage.put(path, file_name, BytesIO(image))
+    fs_storage._cache.clear()
+
+    assert (await fs_storage.get(path, file_name).read()) == image
+    assert mkdir.call_count == 4
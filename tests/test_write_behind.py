@@ -0,0 +1,78 @@
+"Tests for write behind module"
+from pathlib import Path
+import subprocess
+import sys
+import threading
+from time import sleep
+
+import pytest
+
+from src.write_behind import WriteBehind
+
+@pytest.mark.write_behind
+def test_debounce():
+    """When notifying dirty within the debounce window, only one background write should happen."""
+
+    written = threading.Event()
+    write_behind = WriteBehind(written.set, .05, 5)
+
+    for _ in range(10):
+        write_behind.mark_dirty()
+
+    assert written.wait(1)
+
+    sleep(.1)
+
+    assert write_behind.stats == {"requested": 10, "coalesced": 9, "performed": 1}
+    assert not write_behind.dirty
+
+@pytest.mark.write_behind
+def test_max_staleness():
+    """When notifying dirty continuously, a write should still happen after the max staleness."""
+
+    written = threading.Event()
+    write_behind = WriteBehind(written.set, .05, .1)
+
+    for _ in range(20):
+        write_behind.mark_dirty()
+        sleep(.02)
+
+        if written.is_set():
+            break
+
+    assert written.is_set()
+
+@pytest.mark.write_behind
+def test_flush_and_close():
+    """When flushing, pending changes should be written in the calling thread."""
+
+    writer_threads = []
+    write_behind = WriteBehind(lambda: writer_threads.append(threading.current_thread()), 10, 10)
+
+    assert write_behind.flush() == False
+
+    write_behind.mark_dirty()
+
+    assert write_behind.flush() == True
+    assert writer_threads == [threading.current_thread()]
+
+    write_behind.mark_dirty()
+    write_behind.close()
+
+    assert len(writer_threads) == 2
+    assert write_behind.stats["performed"] == 2
+
+@pytest.mark.write_behind
+def test_write_at_exit(tmp_path):
+    """When exiting within the debounce window, the pending changes should still be written."""
+
+    marker = tmp_path / "written"
+    script = "from pathlib import Path\n" \
+        "from src.write_behind import WriteBehind\n" \
+        "write_behind = WriteBehind(lambda: Path(" + repr(str(marker)) + ").touch(), 10, 10)\n" \
+        "write_behind.mark_dirty()\n"
+
+    subprocess.run([sys.executable, "-c", script], check = True, timeout = 10,
+        cwd = Path(__file__).parent.parent)
+
+    assert marker.exists()